@@ -0,0 +1,119 @@
+"""
+A tiny fake Consul agent for benchmarks.
+
+The agent runs an aiohttp server in a child process, so it does not compete
+with the benchmarked client for the GIL. It serves canned JSON payloads,
+optionally adding a fixed latency to every request, and honours blocking
+queries: a request whose *index* matches the current index of the path is
+parked for the requested *wait* or until the path is updated.
+
+Payloads are published with :meth:`FakeAgent.set`, which PUTs them to the
+``/_set/<path>`` control endpoint.
+"""
+import asyncio
+import base64
+import json
+import multiprocessing
+import re
+import urllib.request
+
+from aiohttp import web
+
+
+def parse_wait(wait):
+    match = re.match(r'^(\d+(?:\.\d+)?)(ms|s|m)?$', wait or '')
+    if not match:
+        return 300.0
+    value, unit = float(match.group(1)), match.group(2) or 's'
+    return value * {'ms': 0.001, 's': 1, 'm': 60}[unit]
+
+
+def kv_payload(key, value):
+    return [{
+        'CreateIndex': 1,
+        'ModifyIndex': 1,
+        'LockIndex': 0,
+        'Key': key,
+        'Flags': 0,
+        'Value': base64.b64encode(value).decode('ascii'),
+    }]
+
+
+class Server(object):
+    def __init__(self, latency):
+        self.latency = latency
+        self.payloads = {}
+        self.indexes = {}
+        self.changed = {}
+
+    def publish(self, path, body):
+        self.payloads[path] = body
+        self.indexes[path] = self.indexes.get(path, 0) + 1
+        event = self.changed.pop(path, None)
+        if event is not None:
+            event.set()
+
+    async def handle(self, request):
+        path = request.path
+        if path.startswith('/_set/'):
+            self.publish(path[len('/_set'):], await request.read())
+            return web.Response(text='true')
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if path not in self.payloads:
+            if not path.startswith('/v1/kv/'):
+                return web.Response(status=404)
+            key = path[len('/v1/kv/'):]
+            self.publish(path, json.dumps(kv_payload(key, b'value')).encode())
+        index = request.query.get('index')
+        if index is not None and int(index) == self.indexes[path]:
+            event = self.changed.setdefault(path, asyncio.Event())
+            try:
+                await asyncio.wait_for(
+                    event.wait(), parse_wait(request.query.get('wait')))
+            except asyncio.TimeoutError:
+                pass
+        return web.Response(
+            body=self.payloads[path],
+            content_type='application/json',
+            headers={'X-Consul-Index': str(self.indexes[path])})
+
+    async def serve(self, ready):
+        app = web.Application()
+        app.router.add_route('*', '/{tail:.*}', self.handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0, backlog=4096)
+        await site.start()
+        ready.send(site._server.sockets[0].getsockname()[1])
+        await asyncio.Event().wait()
+
+
+def serve(latency, ready):
+    asyncio.run(Server(latency).serve(ready))
+
+
+class FakeAgent(object):
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.port = None
+        self._process = None
+
+    def start(self):
+        parent, child = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(
+            target=serve, args=(self.latency, child), daemon=True)
+        self._process.start()
+        self.port = parent.recv()
+        return self
+
+    def set(self, path, payload):
+        """Publishes *payload* on *path*, waking up its blocking queries."""
+        request = urllib.request.Request(
+            'http://127.0.0.1:%s/_set%s' % (self.port, path),
+            data=json.dumps(payload).encode('utf-8'), method='PUT')
+        urllib.request.urlopen(request).read()
+
+    def stop(self):
+        self._process.terminate()
+        self._process.join()
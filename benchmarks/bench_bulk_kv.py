@@ -0,0 +1,52 @@
+"""
+Time to write many KV keys one request each or in transactions.
+
+Writes the same keys to a local fake agent adding a fixed latency per
+request, with one ``kv.put`` per key and with ``kv.put_many``, which packs
+them into transactions of at most 64 operations and 512KB, sent one after
+the other or several at once.
+
+    PYTHONPATH=. python benchmarks/bench_bulk_kv.py
+"""
+import argparse
+import time
+
+import consul
+from agent import FakeAgent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--keys', type=int, default=2000)
+    parser.add_argument('--value-size', type=int, default=256)
+    parser.add_argument('--latency', type=float, default=0.005)
+    parser.add_argument('--concurrency', type=int, default=4)
+    args = parser.parse_args()
+
+    agent = FakeAgent(latency=args.latency).start()
+    agent.set('/v1/txn', {'Results': [], 'Errors': None})
+    c = consul.Consul(port=agent.port)
+    items = [('bulk/%d' % i, 'x' * args.value_size)
+             for i in range(args.keys)]
+
+    print('%-16s %8s %10s %12s' % ('mode', 'keys', 'seconds', 'keys/s'))
+    start = time.time()
+    for key, value in items:
+        c.kv.put(key, value)
+    elapsed = time.time() - start
+    print('%-16s %8d %10.2f %12.1f' % (
+        'put', args.keys, elapsed, args.keys / elapsed))
+    for concurrency in (1, args.concurrency):
+        start = time.time()
+        result = c.kv.put_many(items, concurrency=concurrency)
+        elapsed = time.time() - start
+        assert result.ok
+        print('%-16s %8d %10.2f %12.1f' % (
+            'put_many x%d' % concurrency, args.keys, elapsed,
+            args.keys / elapsed))
+    c.close()
+    agent.stop()
+
+
+if __name__ == '__main__':
+    main()
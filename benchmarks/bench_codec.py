@@ -0,0 +1,124 @@
+"""
+Decode throughput of the JSON codecs on realistic agent responses.
+
+Builds a ``Health.service`` response for a service with many instances and a
+``KV.get(recurse=True)`` response for a large prefix, then runs the same
+callbacks the endpoints use over them with every installed codec.
+
+    PYTHONPATH=. python benchmarks/bench_codec.py
+"""
+import argparse
+import base64
+import json
+import os
+import time
+
+from consul import base
+
+
+def health_service(instances):
+    nodes = []
+    for i in range(instances):
+        node = 'node-%05d' % i
+        address = '10.%d.%d.%d' % (i >> 16 & 255, i >> 8 & 255, i & 255)
+        nodes.append({
+            'Node': {
+                'ID': '40e4a748-2192-161a-0510-%012x' % i,
+                'Node': node,
+                'Address': address,
+                'Datacenter': 'dc1',
+                'TaggedAddresses': {'lan': address, 'wan': address},
+                'Meta': {'rack': 'r%d' % (i % 40),
+                         'consul-network-segment': ''},
+                'CreateIndex': 1000 + i,
+                'ModifyIndex': 2000 + i,
+            },
+            'Service': {
+                'ID': 'api-%05d' % i,
+                'Service': 'api',
+                'Tags': ['primary', 'v2', 'az-%d' % (i % 3)],
+                'Address': address,
+                'Meta': {'version': '2.14.%d' % (i % 7)},
+                'Port': 8080,
+                'Weights': {'Passing': 10, 'Warning': 1},
+                'EnableTagOverride': False,
+                'CreateIndex': 3000 + i,
+                'ModifyIndex': 4000 + i,
+            },
+            'Checks': [{
+                'Node': node,
+                'CheckID': check_id,
+                'Name': name,
+                'Status': 'passing',
+                'Notes': '',
+                'Output': output,
+                'ServiceID': service_id,
+                'ServiceName': service_name,
+                'ServiceTags': tags,
+                'CreateIndex': 5000 + i,
+                'ModifyIndex': 6000 + i,
+            } for check_id, name, output, service_id, service_name, tags in (
+                ('serfHealth', 'Serf Health Status',
+                 'Agent alive and reachable', '', '', []),
+                ('service:api-%05d' % i, 'Service api check',
+                 'HTTP GET http://%s:8080/health: 200 OK' % address,
+                 'api-%05d' % i, 'api', ['primary', 'v2']),
+            )],
+        })
+    return nodes
+
+
+def kv_recurse(keys, size):
+    return [{
+        'LockIndex': 0,
+        'Key': 'config/app/%06d' % i,
+        'Flags': 0,
+        'Value': base64.b64encode(os.urandom(size)).decode('ascii'),
+        'CreateIndex': 100 + i,
+        'ModifyIndex': 200 + i,
+    } for i in range(keys)]
+
+
+def bench(callback, content, codec, duration):
+    headers = {'X-Consul-Index': '42'}
+    runs = 0
+    start = time.time()
+    while time.time() - start < duration:
+        callback(base.Response(200, headers, content=content, codec=codec))
+        runs += 1
+    return runs / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--instances', type=int, default=3000)
+    parser.add_argument('--keys', type=int, default=5000)
+    parser.add_argument('--value-size', type=int, default=256)
+    parser.add_argument('--duration', type=float, default=3.0)
+    args = parser.parse_args()
+
+    payloads = (
+        ('Health.service', CB_HEALTH,
+         json.dumps(health_service(args.instances)).encode('utf-8')),
+        ('KV.get(recurse)', CB_KV,
+         json.dumps(kv_recurse(args.keys, args.value_size)).encode('utf-8')),
+    )
+    print('%-16s %-8s %10s %10s' % ('payload', 'codec', 'calls/s', 'MB/s'))
+    for name, callback, content in payloads:
+        for codec_name in sorted(base.CODECS):
+            try:
+                codec = base.get_codec(codec_name)
+            except ImportError:
+                continue
+            rate = bench(callback, content, codec, args.duration)
+            print('%-16s %-8s %10.1f %10.1f' % (
+                name, codec_name, rate, rate * len(content) / 1e6))
+
+
+CB_HEALTH = base.CB.json(index=True)
+CB_KV = base.CB.json(index=True, decode='Value',
+                     map=lambda x: x if x else None)
+
+
+if __name__ == '__main__':
+    main()
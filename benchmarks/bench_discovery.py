@@ -0,0 +1,71 @@
+"""
+Cost of picking a service instance per request.
+
+Compares asking a local fake agent for the passing instances of a service
+with ``health.service`` before every request against picking one from a
+``consul.std.Discovery``, for each of its strategies.
+
+    PYTHONPATH=. python benchmarks/bench_discovery.py
+"""
+import argparse
+import random
+import time
+
+import consul
+import consul.std
+from agent import FakeAgent
+
+
+def health_payload(service, instances):
+    return [{
+        'Node': {'Node': 'node-%d' % i, 'Address': '10.0.%d.%d' % divmod(
+            i, 256), 'ModifyIndex': 1},
+        'Service': {'ID': '%s-%d' % (service, i), 'Service': service,
+                    'Port': 8080, 'Tags': ['v%d' % (i % 2)],
+                    'Weights': {'Passing': random.randint(1, 10),
+                                'Warning': 1},
+                    'ModifyIndex': 1},
+        'Checks': [],
+    } for i in range(instances)]
+
+
+def bench(pick, duration):
+    runs = 0
+    start = time.time()
+    while time.time() - start < duration:
+        pick()
+        runs += 1
+    elapsed = time.time() - start
+    return runs / elapsed, elapsed / runs * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--instances', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--duration', type=float, default=3.0)
+    args = parser.parse_args()
+
+    agent = FakeAgent(latency=args.latency).start()
+    agent.set('/v1/health/service/api',
+              health_payload('api', args.instances))
+    c = consul.Consul(port=agent.port)
+
+    def query():
+        index, nodes = c.health.service('api', passing=True)
+        return random.choice(nodes)
+
+    print('%-16s %12s %10s' % ('mode', 'picks/s', 'us/pick'))
+    print('%-16s %12.1f %10.1f' % (
+        ('health.service',) + bench(query, args.duration)))
+    for strategy in sorted(consul.std.Discovery.strategies):
+        discovery = consul.std.Discovery(c, strategy=strategy)
+        discovery.pick('api')
+        print('%-16s %12.1f %10.2f' % ((strategy,) + bench(
+            lambda: discovery.pick('api', tag='v1'), args.duration)))
+        discovery.close()
+    agent.stop()
+
+
+if __name__ == '__main__':
+    main()
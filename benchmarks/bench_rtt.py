@@ -0,0 +1,55 @@
+"""
+Cost of estimating round trip times from network coordinates.
+
+Times ``consul.base.RTTEstimator`` over random 8 dimensional coordinates,
+as ``coordinate.nodes`` returns them, with NumPy and with the pure Python
+fallback: the nearest nodes to one origin, and the full matrix.
+
+    PYTHONPATH=. python benchmarks/bench_rtt.py
+"""
+import argparse
+import random
+import time
+
+from consul import base
+
+
+def coordinates(nodes):
+    return [{
+        'Node': 'node-%d' % i,
+        'Segment': '',
+        'Coord': {'Vec': [random.gauss(0, 0.01) for _ in range(8)],
+                  'Height': random.uniform(0, 0.001),
+                  'Adjustment': random.uniform(-0.0005, 0.0005),
+                  'Error': 0.2},
+    } for i in range(nodes)]
+
+
+def timed(func, *args):
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--nodes', default='100,1000,3000')
+    parser.add_argument('--python-max', type=int, default=1000,
+                        help='largest pure Python matrix')
+    args = parser.parse_args()
+
+    print('%-8s %8s %14s %12s' % ('mode', 'nodes', 'nearest ms', 'matrix s'))
+    for n in [int(x) for x in args.nodes.split(',')]:
+        nodes = coordinates(n)
+        for name, use_numpy in (('python', False), ('numpy', True)):
+            rtt = base.RTTEstimator(nodes, use_numpy=use_numpy)
+            rtt.nearest('node-0', 10)
+            nearest = timed(rtt.nearest, 'node-0', 10) * 1000
+            matrix = float('nan')
+            if use_numpy or n <= args.python_max:
+                matrix = timed(rtt.matrix)
+            print('%-8s %8d %14.2f %12.3f' % (name, n, nearest, matrix))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Throughput of one shared consul.std client as the number of threads grows.
+
+Every thread issues ``kv.get`` calls against a local fake agent which adds a
+fixed latency per request, so throughput scales with the thread count until
+the client becomes CPU bound. Past 10 threads the default pool of 10
+connections starts discarding and re-opening connections, while a client
+with ``pool_maxsize`` sized to the thread count keeps reusing them.
+
+    PYTHONPATH=. python benchmarks/bench_std_pool.py
+"""
+import argparse
+import threading
+import time
+
+import consul
+from agent import FakeAgent
+
+
+def run(c, threads, duration):
+    count = [0] * threads
+    deadline = time.time() + duration
+
+    def worker(i):
+        while time.time() < deadline:
+            c.kv.get('foo')
+            count[i] += 1
+
+    workers = [threading.Thread(target=worker, args=(i,))
+               for i in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return sum(count) / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--duration', type=float, default=2.0)
+    parser.add_argument('--threads', default='1,2,4,8,16,32,64')
+    args = parser.parse_args()
+
+    agent = FakeAgent(latency=args.latency).start()
+    threads = [int(t) for t in args.threads.split(',')]
+    print('%8s %14s %14s' % ('threads', 'default req/s', 'sized req/s'))
+    for n in threads:
+        default = consul.Consul(port=agent.port)
+        sized = consul.Consul(port=agent.port, pool_maxsize=n)
+        print('%8d %14.0f %14.0f' % (n,
+                                     run(default, n, args.duration),
+                                     run(sized, n, args.duration)))
+        default.close()
+        sized.close()
+    agent.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""
+Cost of the unchanged answers to blocking queries which time out.
+
+Runs the ``KV.get(recurse=True)`` callback over the same large response as
+sent with a plain index, which decodes it every time, and with a
+``consul.base.Index``, which only compares the index or also hashes the body.
+
+    PYTHONPATH=. python benchmarks/bench_unchanged.py
+"""
+import argparse
+import json
+import time
+
+from bench_codec import kv_recurse
+from consul import base
+
+
+def bench(since, content, duration):
+    headers = {'X-Consul-Index': '42'}
+    runs = 0
+    start = time.time()
+    while time.time() - start < duration:
+        callback = base.CB.json(index=True, decode='Value', since=since,
+                                map=lambda x: x if x else None)
+        callback(base.Response(200, headers, content=content))
+        runs += 1
+    return runs / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--keys', type=int, default=5000)
+    parser.add_argument('--value-size', type=int, default=256)
+    parser.add_argument('--duration', type=float, default=3.0)
+    args = parser.parse_args()
+
+    content = json.dumps(kv_recurse(args.keys, args.value_size)).encode()
+    response = base.Response(200, {'X-Consul-Index': '42'}, content=content)
+    hashed, _ = base.Index(hashed=True).follow(response)
+    print('%-10s %12s' % ('since', 'calls/s'))
+    for name, since in (('42', '42'),
+                        ('Index', base.Index('42')),
+                        ('hashed', hashed)):
+        print('%-10s %12.1f' % (name, bench(since, content, args.duration)))
+
+
+if __name__ == '__main__':
+    main()
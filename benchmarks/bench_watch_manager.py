@@ -0,0 +1,121 @@
+"""
+Memory and threads used to watch many keys with consul.std.
+
+Every scenario runs in a fresh process against a local fake agent which
+parks blocking queries until they time out. The thread-per-watch baseline
+runs one ``c.watch`` generator per thread, the watch manager multiplexes all
+the blocking queries on one background event loop with a bounded number of
+connections. Both are measured once every watch delivered its first result.
+
+    PYTHONPATH=. python benchmarks/bench_watch_manager.py
+"""
+import argparse
+import multiprocessing
+import resource
+import threading
+import time
+
+import consul
+import consul.std
+from agent import FakeAgent
+
+
+def rss():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024.0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+class Counter(object):
+    def __init__(self, target):
+        self.target = target
+        self.count = 0
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    def __call__(self, *args):
+        with self.lock:
+            self.count += 1
+            if self.count == self.target:
+                self.done.set()
+
+
+def manager(port, watches, concurrency, results):
+    raise_fd_limit()
+    before = rss()
+    start = time.time()
+    c = consul.Consul(port=port)
+    m = consul.std.WatchManager(c, concurrency=concurrency)
+    counter = Counter(watches)
+    for i in range(watches):
+        m.watch(counter, 'kv.get', 'watch/%d' % i, wait='30s')
+    counter.done.wait(300)
+    results.send((counter.count, time.time() - start,
+                  rss() - before, threading.active_count()))
+    m.close()
+
+
+def threads(port, watches, concurrency, results):
+    raise_fd_limit()
+    before = rss()
+    start = time.time()
+    c = consul.Consul(port=port, pool_maxsize=watches)
+    counter = Counter(watches)
+
+    def follow(key):
+        for change in c.watch(c.kv.get, key, wait='30s'):
+            counter()
+
+    for i in range(watches):
+        t = threading.Thread(target=follow, args=('watch/%d' % i,))
+        t.daemon = True
+        t.start()
+    counter.done.wait(300)
+    results.send((counter.count, time.time() - start,
+                  rss() - before, threading.active_count()))
+
+
+def run(scenario, port, watches, concurrency):
+    parent, child = multiprocessing.Pipe()
+    p = multiprocessing.Process(
+        target=scenario, args=(port, watches, concurrency, child))
+    p.start()
+    result = parent.recv()
+    p.terminate()
+    p.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--watches', default='100,1000,10000')
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--baseline-max', type=int, default=1000,
+                        help='largest thread-per-watch run')
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    agent = FakeAgent().start()
+    print('%-10s %8s %8s %10s %10s %8s' % (
+        'mode', 'watches', 'ready', 'seconds', 'rss MB', 'threads'))
+    for n in [int(w) for w in args.watches.split(',')]:
+        modes = [('manager', manager)]
+        if n <= args.baseline_max:
+            modes.insert(0, ('threads', threads))
+        for name, scenario in modes:
+            ready, seconds, memory, count = run(
+                scenario, agent.port, n, args.concurrency)
+            print('%-10s %8d %8d %10.2f %10.1f %8d' % (
+                name, n, ready, seconds, memory, count))
+    agent.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -3,8 +3,11 @@ __version__ = '0.1.4'
 from consul.base import ACLDisabled  # noqa
 from consul.base import ACLPermissionDenied  # noqa
 from consul.base import Check  # noqa
+from consul.base import CircuitOpen  # noqa
 from consul.base import ConsulException  # noqa
+from consul.base import Filter  # noqa
 from consul.base import NotFound  # noqa
+from consul.base import Selector  # noqa
 from consul.base import Timeout  # noqa
 from consul.std import Consul  # noqa
 # from consul.tornado import Consul  # noqa
@@ -1,7 +1,7 @@
 from __future__ import absolute_import
 
 import asyncio
-import sys
+import logging
 import warnings
 
 import aiohttp
@@ -9,82 +9,663 @@ import aiohttp
 from consul import base
 
 __all__ = ['Consul']
-PY_341 = sys.version_info >= (3, 4, 1)
+
+log = logging.getLogger(__name__)
 
 
 class HTTPClient(base.HTTPClient):
-    """Asyncio adapter for python consul using aiohttp library"""
+    """Asyncio adapter for python consul using aiohttp library
 
-    def __init__(self, *args, loop=None, **kwargs):
+    A single :class:`aiohttp.ClientSession` is created lazily on the first
+    request and reused for every subsequent call, so connections to the agent
+    are pooled and kept alive instead of being re-established per request.
+
+    *connections_limit* is the total number of simultaneous connections the
+    pool may hold, *connections_limit_per_host* caps the connections opened
+    to a single agent (0 means no per-host limit).
+
+    *keepalive_timeout* is the number of seconds an idle connection is kept
+    in the pool and *ttl_dns_cache* is the number of seconds resolved agent
+    addresses are cached.
+
+    With the 'unix' *scheme* the pool connects to the agent's unix domain
+    socket instead of TCP.
+
+    *endpoints* is a list of agent addresses, or a
+    :class:`consul.base.EndpointPool`, to balance requests over instead of
+    *host* and *port*. A request failing to connect is retried on the next
+    best endpoint, and ejected endpoints are probed in the background once
+    their ejection time has passed.
+
+    *hedge* enables hedged stale reads across the endpoints: either True or
+    a :class:`consul.base.HedgePolicy`. The losing leg of a hedged read is
+    cancelled as soon as the other one answers.
+    """
+
+    def __init__(self, *args, loop=None, connections_limit=100,
+                 connections_limit_per_host=0, keepalive_timeout=15,
+                 ttl_dns_cache=10, hedge=None, **kwargs):
         super(HTTPClient, self).__init__(*args, **kwargs)
+        self.hedge = base.HedgePolicy() if hedge is True else hedge
         self._session = None
+        self._background = set()
         self._loop = loop or asyncio.get_event_loop()
+        self._connector_kwargs = dict(
+            limit=connections_limit,
+            limit_per_host=connections_limit_per_host,
+            keepalive_timeout=keepalive_timeout,
+            ttl_dns_cache=ttl_dns_cache)
+
+    def _connector(self):
+        kwargs = dict(self._connector_kwargs)
+        if self.socket_path:
+            del kwargs['ttl_dns_cache']
+            return aiohttp.UnixConnector(
+                path=self.socket_path, loop=self._loop, **kwargs)
+        if not self.verify:
+            kwargs['ssl'] = False
+        return aiohttp.TCPConnector(loop=self._loop, **kwargs)
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(connector=self._connector())
+        return self._session
 
-    async def _request(self, callback, method, uri, data=None, headers=None):
-        connector = aiohttp.TCPConnector(loop=self._loop,
-                                         verify_ssl=self.verify)
-        async with aiohttp.ClientSession(connector=connector) as session:
-            self._session = session
-            resp = await session.request(method=method,
-                                         url=uri,
-                                         data=data,
-                                         headers=headers)
-            body = await resp.text(encoding='utf-8')
-            content = await resp.read()
-            if resp.status == 599:
-                raise base.Timeout
-            r = base.Response(resp.status, resp.headers, body, content)
-            await session.close()
-            return callback(r)
-
-    # python prior 3.4.1 does not play nice with __del__ method
-    if PY_341:  # pragma: no branch
-        def __del__(self):
-            warnings.warn("Unclosed connector in aio.Consul.HTTPClient",
+    async def _probe(self, endpoint):
+        uri = self.uri('/v1/status/leader', endpoint=endpoint)
+        timeout = aiohttp.ClientTimeout(total=self.endpoints.probe_timeout)
+        try:
+            async with self.session.get(uri, timeout=timeout) as resp:
+                await resp.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.endpoints.failed(endpoint)
+        else:
+            self.endpoints.responded(endpoint, error=resp.status >= 500)
+
+    async def _send(self, endpoint, method, path, params=None, data=None,
+                    headers=None):
+        # the duration of a blocking query says nothing about the agent
+        timed = 'index' not in dict(params or ())
+        kwargs = {}
+        timeout = self.request_timeout(params)
+        if timeout is not None:
+            kwargs['timeout'] = aiohttp.ClientTimeout(total=timeout)
+        circuit = self.circuit_enter(path, endpoint)
+        start = self._loop.time()
+        try:
+            async with self.session.request(method=method,
+                                            url=self.uri(path, params,
+                                                         endpoint),
+                                            data=data,
+                                            headers=headers,
+                                            **kwargs) as resp:
+                content = await resp.read()
+        except asyncio.CancelledError:
+            # the losing leg of a hedged read says nothing about the agent
+            self.circuit_exit(circuit, failed=None)
+            raise
+        except Exception as e:
+            if isinstance(e, aiohttp.ClientConnectionError):
+                self.endpoints.failed(endpoint)
+            self.circuit_exit(circuit, failed=True)
+            raise
+        error = resp.status >= 500
+        self.endpoints.responded(endpoint,
+                                 self._loop.time() - start if timed else None,
+                                 error=error)
+        self.circuit_exit(circuit, failed=error)
+        return resp.status, resp.headers, content
+
+    async def _failover(self, method, path, params=None, data=None,
+                        headers=None):
+        tried = []
+        endpoint = self.endpoints.select()
+        while True:
+            try:
+                return await self._send(endpoint, method, path, params, data,
+                                        headers)
+            except (aiohttp.ClientConnectionError, base.CircuitOpen):
+                tried.append(endpoint)
+                endpoint = self.endpoints.select(exclude=tried)
+                if endpoint is None:
+                    raise
+
+    async def _leg(self, endpoint, path, params=None, headers=None):
+        start = self._loop.time()
+        result = await self._send(endpoint, 'GET', path, params,
+                                  headers=headers)
+        self.hedge.record(self._loop.time() - start)
+        return result
+
+    async def _hedged(self, path, params=None, headers=None):
+        tried = []
+        pending = set()
+
+        def launch():
+            endpoint = self.endpoints.select(exclude=tried)
+            if endpoint is not None:
+                tried.append(endpoint)
+                pending.add(self._loop.create_task(
+                    self._leg(endpoint, path, params, headers)))
+
+        launch()
+        timeout = self.hedge.delay()
+        try:
+            while pending:
+                done, _ = await asyncio.wait(
+                    pending,
+                    timeout=timeout,
+                    return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # the first endpoint is slow, race it against another one
+                    timeout = None
+                    launch()
+                    continue
+                for leg in done:
+                    pending.discard(leg)
+                    error = leg.exception()
+                    if error is None:
+                        result = leg.result()
+                        if not self.hedge.failed(result[0]):
+                            return result
+                launch()
+            # every leg failed, the last answer goes to the retry policy
+            if error is not None:
+                raise error
+            return result
+        finally:
+            for leg in pending:
+                leg.cancel()
+
+    async def _request(self, callback, method, path, params=None, data=None,
+                       headers=None):
+        for endpoint in self.endpoints.due():
+            probe = self._loop.create_task(self._probe(endpoint))
+            self._background.add(probe)
+            probe.add_done_callback(self._background.discard)
+        hedged = self.hedge is not None and \
+            len(self.endpoints.endpoints) > 1 and \
+            self.hedge.applies(method, path, params)
+        start = self._loop.time()
+        attempt = 0
+        while True:
+            try:
+                if hedged:
+                    status, resp_headers, content = await self._hedged(
+                        path, params, headers)
+                else:
+                    status, resp_headers, content = await self._failover(
+                        method, path, params, data, headers)
+            except aiohttp.ClientConnectionError:
+                delay = self.retry_delay(attempt, method, params)
+                if delay is None:
+                    raise
+            else:
+                if status == 599:
+                    raise base.Timeout
+                delay = self.retry_delay(attempt, method, params, status)
+                if delay is None:
+                    self.cache_invalidate(method, path)
+                    return callback(self.response(
+                        status, resp_headers, content,
+                        self._loop.time() - start))
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def __del__(self):
+        if self._session is not None and not self._session.closed:
+            warnings.warn("Unclosed connector in aio.Consul.HTTPClient, "
+                          "close it with `await consul.close()`",
                           ResourceWarning)
-            if self._session and not self._session.closed:
-                warnings.warn("Unclosed connector in aio.Consul.HTTPClient",
-                              ResourceWarning)
-                asyncio.ensure_future(self.close())
 
     async def get(self, callback, path, params=None, headers=None):
-        uri = self.uri(path, params)
-        return await self._request(callback, 'GET', uri, headers=headers)
+        response, request = self.cache_lookup(callback, path, params, headers)
+        if response is not None:
+            if request is not None:
+                # refresh the stale cached response in the background
+                refresh = self._loop.create_task(
+                    self._get(request, path, params, headers))
+                self._background.add(refresh)
+                refresh.add_done_callback(self._refreshed)
+            return callback(response)
+        return await self._get(request, path, params, headers)
+
+    def _refreshed(self, refresh):
+        self._background.discard(refresh)
+        if not refresh.cancelled() and refresh.exception() is not None:
+            log.warning('consul: refreshing a cached response failed',
+                        exc_info=refresh.exception())
+
+    async def _get(self, callback, path, params, headers):
+        if self.coalesce is None:
+            return await self._request(callback, 'GET', path, params,
+                                       headers=headers)
+        key = self.coalesce.key(path, params, headers)
+        flight, leader = self.coalesce.join(
+            key, lambda: self._loop.create_task(
+                self._request(self.raw, 'GET', path, params,
+                              headers=headers)))
+        if leader:
+            flight.add_done_callback(lambda f: self.coalesce.land(key))
+        # a cancelled caller must not cancel the request of the others
+        return callback(await asyncio.shield(flight))
 
     async def put(self, callback, path, params=None, data='', headers=None):
-        uri = self.uri(path, params)
         return await self._request(callback,
                                    'PUT',
-                                   uri,
+                                   path,
+                                   params,
                                    data=data,
                                    headers=headers)
 
     async def delete(self, callback, path, params=None, data='', headers=None):
-        uri = self.uri(path, params)
         return await self._request(callback,
                                    'DELETE',
-                                   uri,
+                                   path,
+                                   params,
                                    data=data,
                                    headers=headers)
 
     async def post(self, callback, path, params=None, data='', headers=None):
-        uri = self.uri(path, params)
         return await self._request(callback,
                                    'POST',
-                                   uri,
+                                   path,
+                                   params,
                                    data=data,
                                    headers=headers)
 
     async def close(self):
-        await self._session.close()
+        for task in list(self._background):
+            task.cancel()
+        if self._session is not None:
+            await self._session.close()
+
+
+class Watch(base.Watch):
+    """
+    A :class:`consul.base.Watch` iterated over with ``async for``.
+    """
+
+    errors = (base.ConsulException, aiohttp.ClientError, asyncio.TimeoutError)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while True:
+            try:
+                result = await self.request()
+            except Exception as e:
+                delay = self.failed(e)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            if self.update(result):
+                return result
+
+    next = __anext__
+
+
+class WatchManager(object):
+    """
+    Runs many watches over one client, each as a task of its event loop.
+
+    Every blocking query holds a connection to the agent for as long as it
+    waits, and agents only accept a limited number of connections per
+    client. At most *concurrency* blocking queries are in flight at once,
+    which should stay below the *connections_limit* of the client to leave
+    room for the first, non-blocking, query of new watches. When there are
+    more watches than that, their waits are shortened in proportion so that
+    queued watches get their turn, down to *min_wait*.
+    """
+
+    def __init__(self, consul, concurrency=100, min_wait='1s'):
+        self.consul = consul
+        self.concurrency = concurrency
+        self.min_wait = base.Watch.seconds(min_wait)
+        # watch -> (task, wait asked for)
+        self.watches = {}
+        self.subscriptions = base.Subscriptions()
+        self._slots = None
+
+    def _limited(self, call):
+        async def limited(*args, **kwargs):
+            if not kwargs.get('index'):
+                return await call(*args, **kwargs)
+            if self._slots is None:
+                self._slots = asyncio.Semaphore(self.concurrency)
+            async with self._slots:
+                return await call(*args, **kwargs)
+        return limited
+
+    def _balance(self):
+        share = float(self.concurrency) / max(len(self.watches), 1)
+        for watch, (task, wait) in self.watches.items():
+            watch.wait = max(min(wait, wait * share), self.min_wait)
+
+    async def _run(self, watch, callback, errback=None):
+        try:
+            async for index, data in watch:
+                try:
+                    result = callback(index, data)
+                    if asyncio.iscoroutine(result):
+                        await result
+                except Exception:
+                    log.exception('consul watch callback failed')
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.exception('consul watch stopped')
+            if self.watches.pop(watch, None) is not None:
+                self._balance()
+            if errback is not None:
+                errback(e)
+
+    def watch(self, callback, call, *args, errback=None, **kwargs):
+        """
+        Starts watching the endpoint method *call* with *args* and *kwargs*,
+        as :class:`consul.base.Watch` does, and returns the watch.
+        *callback* is called with the (*index*, *data*) of every change and
+        may be a coroutine function. *errback*, if set, is called with the
+        error the watch stopped on, one it does not retry.
+        """
+        watch = Watch(self._limited(call), *args, **kwargs)
+        task = self.consul._loop.create_task(
+            self._run(watch, callback, errback))
+        self.watches[watch] = (task, watch.wait)
+        self._balance()
+        return watch
+
+    def unwatch(self, watch):
+        """
+        Stops *watch*.
+        """
+        if watch not in self.watches:
+            # it already stopped on an error
+            return
+        task, wait = self.watches.pop(watch)
+        task.cancel()
+        self._balance()
+
+    def subscribe(self, callback, call, *args, errback=None, **kwargs):
+        """
+        Like :meth:`watch`, except that all the subscribers to identical
+        requests share a single upstream watch, which stops when the last
+        one unsubscribes. A new subscriber is handed the last known result
+        right away. Returns the subscription.
+        """
+        subscription, first, last = self.subscriptions.subscribe(
+            callback, call, args, kwargs, errback)
+        key = subscription.key
+        if first:
+            async def fanout(index, data):
+                for result in self.subscriptions.publish(key, index, data):
+                    if asyncio.iscoroutine(result):
+                        await result
+
+            def failed(error):
+                self.subscriptions.fail(key, error)
+
+            self.subscriptions.attach(key, self.watch(
+                fanout, call, *args, errback=failed, **kwargs))
+        elif last is not None:
+            result = callback(*last)
+            if asyncio.iscoroutine(result):
+                self.consul._loop.create_task(result)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """
+        Removes *subscription*, stopping the upstream watch if it was the
+        last subscriber.
+        """
+        watch = self.subscriptions.unsubscribe(subscription)
+        if watch is not None:
+            self.unwatch(watch)
+
+    async def close(self):
+        """
+        Stops every watch.
+        """
+        tasks = [task for task, wait in self.watches.values()]
+        self.watches.clear()
+        self.subscriptions = base.Subscriptions()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class Discovery(base.Discovery):
+    """
+    A :class:`consul.base.Discovery` following the services it watches
+    with blocking ``health.service`` queries of *consul*, passing instances
+    only, and *kwargs* such as *dc* or *wait*. The queries are subscriptions
+    of *manager*, a :class:`WatchManager` of *consul* by default.
+
+    Picking is synchronous, so services have to be watched first, which
+    waits up to *timeout* seconds for their instances::
+
+        discovery = consul.aio.Discovery(c)
+        await discovery.watch('web')
+        instance = discovery.pick('web', tag='v2')
+    """
+
+    def __init__(self, consul, strategy='round_robin', timeout=10,
+                 manager=None, **kwargs):
+        super().__init__(strategy)
+        self.consul = consul
+        self.timeout = timeout
+        self.manager = manager or WatchManager(consul)
+        self.kwargs = kwargs
+        # service -> (future of the first result, subscription)
+        self.watches = {}
+
+    async def watch(self, service):
+        """
+        Starts following *service* if it is not yet, and waits for its
+        instances. Raises Timeout if they did not come, or the error the
+        query stopped on, in which case the next call watches it again.
+        """
+        watched = self.watches.get(service)
+        if watched is None:
+            ready = self.consul._loop.create_future()
+
+            def changed(index, nodes):
+                self.update(service, nodes)
+                if not ready.done():
+                    ready.set_result(None)
+
+            def failed(error):
+                if self.watches.get(service, (None,))[0] is ready:
+                    del self.watches[service]
+                if not ready.done():
+                    ready.set_exception(error)
+
+            subscription = self.manager.subscribe(
+                changed, self.consul.health.service, service, passing=True,
+                errback=failed, **self.kwargs)
+            self.watches[service] = watched = (ready, subscription)
+        try:
+            await asyncio.wait_for(asyncio.shield(watched[0]), self.timeout)
+        except asyncio.TimeoutError:
+            raise base.Timeout(
+                'no answer about %s in %ss' % (service, self.timeout))
+
+    def unwatch(self, service):
+        """
+        Stops following *service* and drops its instances.
+        """
+        watched = self.watches.pop(service, None)
+        if watched is not None:
+            self.manager.unsubscribe(watched[1])
+        self.forget(service)
+
+    def close(self):
+        """
+        Stops following services.
+        """
+        for service in list(self.watches):
+            self.unwatch(service)
+
+
+class Resolver(base.Resolver):
+    """
+    A :class:`consul.base.Resolver` querying the nearest datacenter first
+    and, when it has no passing instance, all the others concurrently. The
+    ranking is refreshed in a background task.
+    """
+
+    errors = Watch.errors
+
+    async def datacenters(self):
+        """
+        Returns the datacenters, nearest first.
+        """
+        if self.ranking is None:
+            return await self.update()
+        if self.stale():
+            self.refreshing = True
+            self.consul._loop.create_task(self._refresh())
+        return self.ranking
+
+    async def _refresh(self):
+        try:
+            await self.update()
+        except Exception:
+            self.refreshing = False
+            log.exception('consul datacenter ranking failed')
+
+    async def update(self):
+        """
+        Ranks the datacenters again and returns them.
+        """
+        origin = self.origin
+        if origin is None:
+            origin = (await self.consul.agent.self())['Config']['Datacenter']
+        datacenters, coordinates = await asyncio.gather(
+            self.consul.catalog.datacenters(),
+            self.consul.coordinate.datacenters())
+        return self.rank(origin, datacenters, coordinates)
+
+    async def _query(self, service, dc, kwargs):
+        try:
+            result = await self.consul.health.service(
+                service, passing=True, dc=dc, **kwargs)
+            return result[1]
+        except self.errors as e:
+            log.warning('consul resolve of %s in %s failed: %s',
+                        service, dc, e)
+            return e
+
+    async def resolve(self, service, **kwargs):
+        """
+        Returns the datacenter and the passing instances of *service* in
+        the nearest datacenter which has any, or (None, []). *kwargs* are
+        passed on to ``health.service``.
+
+        Datacenters which can't be queried are skipped; when none could be,
+        the last error is raised.
+        """
+        ranking = await self.datacenters()
+        if not ranking:
+            return None, []
+        results = [await self._query(service, ranking[0], kwargs)]
+        if isinstance(results[0], list) and results[0]:
+            return ranking[0], results[0]
+        results += await asyncio.gather(
+            *[self._query(service, dc, kwargs) for dc in ranking[1:]])
+        for dc, nodes in zip(ranking, results):
+            if isinstance(nodes, list) and nodes:
+                return dc, nodes
+        if all(isinstance(nodes, Exception) for nodes in results):
+            raise results[-1]
+        return None, []
 
 
 class Consul(base.Consul):
+    """
+    Asyncio Consul client.
+
+    The underlying connection pool lives as long as the client, so either use
+    it as an async context manager::
+
+        async with consul.aio.Consul() as c:
+            index, data = await c.kv.get('foo')
+
+    or call :meth:`close` once it is no longer needed.
+    """
 
     def __init__(self, *args, loop=None, **kwargs):
         self._loop = loop or asyncio.get_event_loop()
         super().__init__(*args, **kwargs)
 
-    def http_connect(self, host, port, scheme, verify=True, cert=None):
+    def http_connect(self, host, port, scheme, verify=True, cert=None,
+                     **kwargs):
         return HTTPClient(host, port, scheme, loop=self._loop,
-                          verify=verify, cert=None)
+                          verify=verify, cert=None, **kwargs)
+
+    def watch(self, call, *args, **kwargs):
+        """
+        Returns an endless async iterator over the changes of an endpoint
+        returning (*index*, *data*), such as ``c.kv.get``::
+
+            async for index, data in c.watch(c.kv.get, 'foo', wait='1m'):
+                print(data)
+
+        See :class:`consul.base.Watch` for the arguments.
+        """
+        return Watch(call, *args, **kwargs)
+
+    async def fanout(self, call, args=(), kwargs=None, datacenters=None,
+                     timeout=None):
+        """
+        Calls the endpoint method *call* with *args* and *kwargs* in each
+        of *datacenters*, all of those of ``catalog.datacenters`` by default,
+        concurrently, and returns a :class:`consul.base.FanOut`.
+        Datacenters which did not answer within *timeout* seconds are
+        reported as errors.
+        """
+        if datacenters is None:
+            datacenters = await self.catalog.datacenters()
+        kwargs = kwargs or {}
+
+        async def one(dc):
+            try:
+                result = await asyncio.wait_for(
+                    call(*args, dc=dc, **kwargs), timeout)
+            except asyncio.TimeoutError:
+                return dc, None, base.FanOut.timeout(dc, timeout)
+            except Exception as e:
+                return dc, None, e
+            return dc, result, None
+
+        return base.FanOut.collect(
+            await asyncio.gather(*[one(dc) for dc in datacenters]))
+
+    async def _gather(self, calls, concurrency, done):
+        slots = asyncio.Semaphore(max(concurrency, 1))
+
+        async def attempt(call):
+            async with slots:
+                try:
+                    return await call(), None
+                except Exception as e:
+                    return None, e
+
+        return done(await asyncio.gather(*[attempt(call) for call in calls]))
+
+    async def close(self):
+        """
+        Closes the connection pool of this client.
+        """
+        await self.http.close()
+
+    aclose = close
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
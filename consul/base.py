@@ -1,9 +1,17 @@
 import abc
 import base64
+import bisect
 import collections
+import hashlib
+import itertools
 import json
 import logging
+import math
 import os
+import random
+import re
+import threading
+import time
 import warnings
 
 import six
@@ -41,6 +49,14 @@ class ClientError(ConsulException):
     pass
 
 
+class CircuitOpen(ConsulException):
+    """
+    Raised instead of sending a request while the circuit breaker of the
+    agent and endpoint family is open
+    """
+    pass
+
+
 #
 # Convenience to define checks
 
@@ -182,121 +198,2157 @@ class Check(object):
         # if deregister:
         #     ret['check']['DeregisterCriticalServiceAfter'] = deregister
 
-        return ret
+        return ret
+
+
+#
+# Convenience to build filter expressions
+
+class Filter(object):
+    """
+    A `filter expression`_ the servers evaluate to return only the matching
+    entries of a listing. Filters are built from :class:`Selector` and
+    combined with ``&``, ``|`` and ``~``; values are always quoted::
+
+        >>> port = Selector('Service.Port')
+        >>> tags = Selector('Service.Tags')
+        >>> str((port == 8080) & ~tags.contains('canary'))
+        'Service.Port == 8080 and not "canary" in Service.Tags'
+
+    Every endpoint taking a *filter* also accepts a plain string.
+    """
+
+    def __init__(self, expression, compound=False):
+        self.expression = expression
+        self.compound = compound
+
+    @staticmethod
+    def quote(value):
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+        if isinstance(value, six.integer_types + (float,)):
+            return repr(value)
+        if isinstance(value, six.binary_type):
+            value = value.decode('utf-8')
+        return '"%s"' % six.text_type(value).replace(
+            '\\', '\\\\').replace('"', '\\"')
+
+    def operand(self):
+        return '(%s)' % self.expression if self.compound else self.expression
+
+    def __and__(self, other):
+        return Filter('%s and %s' % (self.operand(), other.operand()), True)
+
+    def __or__(self, other):
+        return Filter('%s or %s' % (self.operand(), other.operand()), True)
+
+    def __invert__(self):
+        return Filter('not %s' % self.operand())
+
+    def __str__(self):
+        return self.expression
+
+    def __repr__(self):
+        return '<Filter %s>' % self.expression
+
+
+class Selector(object):
+    """
+    A field of the entries a :class:`Filter` applies to, as a dotted path
+    like 'Service.Meta.version'. Comparing it builds a :class:`Filter`.
+    """
+
+    pattern = re.compile(r'^[A-Za-z_][\w/-]*(\.[\w/-]+)*$')
+
+    def __init__(self, selector):
+        if not self.pattern.match(selector):
+            raise ValueError('invalid filter selector: %r' % selector)
+        self.selector = selector
+
+    def __eq__(self, value):
+        return Filter('%s == %s' % (self.selector, Filter.quote(value)))
+
+    def __ne__(self, value):
+        return Filter('%s != %s' % (self.selector, Filter.quote(value)))
+
+    def contains(self, value):
+        return Filter('%s in %s' % (Filter.quote(value), self.selector))
+
+    def not_contains(self, value):
+        return Filter('%s not in %s' % (Filter.quote(value), self.selector))
+
+    def matches(self, pattern):
+        return Filter('%s matches %s' % (self.selector, Filter.quote(pattern)))
+
+    def is_empty(self):
+        return Filter('%s is empty' % self.selector)
+
+    def is_not_empty(self):
+        return Filter('%s is not empty' % self.selector)
+
+    __hash__ = None
+
+
+class JSONCodec(object):
+    """
+    Encodes request payloads and decodes response bodies with the standard
+    library json module.
+
+    A codec is any object with a *dumps* method returning str or bytes and a
+    *loads* method accepting the raw bytes of a response.
+    """
+
+    name = 'json'
+
+    def dumps(self, obj):
+        return json.dumps(obj)
+
+    def loads(self, data):
+        try:
+            return json.loads(data)
+        except TypeError:
+            # json.loads only accepts bytes from python 3.6 on
+            return json.loads(data.decode('utf-8'))
+
+
+class OrjsonCodec(JSONCodec):
+    """
+    Codec based on `orjson <https://github.com/ijl/orjson>`_. Payloads are
+    sent as the bytes produced by orjson, without an intermediate str.
+    """
+
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self.orjson = orjson
+
+    def dumps(self, obj):
+        return self.orjson.dumps(obj)
+
+    def loads(self, data):
+        return self.orjson.loads(data)
+
+
+class UjsonCodec(JSONCodec):
+    """
+    Codec based on `ujson <https://github.com/ultrajson/ultrajson>`_.
+    """
+
+    name = 'ujson'
+
+    def __init__(self):
+        import ujson
+        self.ujson = ujson
+
+    def dumps(self, obj):
+        return self.ujson.dumps(obj)
+
+    def loads(self, data):
+        return self.ujson.loads(data)
+
+
+CODECS = dict((c.name, c) for c in (JSONCodec, OrjsonCodec, UjsonCodec))
+
+
+def get_codec(codec=None):
+    """
+    Returns the codec to use for *codec*, which is either a codec instance,
+    the name of one of the bundled codecs ('json', 'orjson' or 'ujson') or
+    None to pick orjson if it is installed and the standard json module
+    otherwise.
+    """
+    if codec is None:
+        try:
+            return OrjsonCodec()
+        except ImportError:
+            return JSONCodec()
+    if isinstance(codec, six.string_types):
+        if codec not in CODECS:
+            raise ConsulException('unknown codec %s, expected one of %s'
+                                  % (codec, ', '.join(sorted(CODECS))))
+        return CODECS[codec]()
+    return codec
+
+
+class Response(object):
+    """
+    The agent's answer to a request.
+
+    Only the raw *content* bytes are kept. *body*, the utf-8 decoded text,
+    is decoded the first time it is accessed and :meth:`json` parses the raw
+    bytes directly with *codec*, so callbacks only pay for the representation
+    they use.
+    """
+
+    __slots__ = ('code', 'headers', 'content', 'codec', 'elapsed', '_body')
+
+    def __init__(self, code, headers, body=None, content=None, codec=None,
+                 elapsed=None):
+        self.code = code
+        self.headers = headers
+        self.content = content
+        self.codec = codec or JSONCodec()
+        # seconds from sending the request to the response, retries included
+        self.elapsed = elapsed
+        self._body = body
+
+    @property
+    def body(self):
+        if self._body is None and self.content is not None:
+            self._body = self.content.decode('utf-8')
+        return self._body
+
+    def json(self):
+        if self.content is None:
+            return self.codec.loads(self.body)
+        return self.codec.loads(self.content)
+
+    def __repr__(self):
+        return '<Response [%s]>' % self.code
+
+
+class Unchanged(object):
+    def __repr__(self):
+        return 'UNCHANGED'
+
+
+#: Returned in place of the data of a blocking query answered with the same
+#: :class:`Index` it was sent with.
+UNCHANGED = Unchanged()
+
+
+class Index(str):
+    """
+    The index of a blocking query which lets the index-returning callbacks
+    skip decoding a response they have already seen. When the wait of a
+    query times out the agent answers with the same X-Consul-Index and the
+    same body; sent with an Index, such an answer is returned as
+    (*index*, :data:`UNCHANGED`).
+
+    With *hashed* set the callbacks also compare a *digest* of the body, for
+    callers who do not trust the index alone. The callbacks return the index
+    of each response as an Index to send with the next query.
+    """
+
+    def __new__(klass, value=None, digest=None, hashed=False):
+        self = str.__new__(klass, '' if value is None else value)
+        self.digest = digest
+        self.hashed = hashed
+        return self
+
+    def follow(self, response):
+        """
+        Returns the Index of *response*, the answer to a query sent with this
+        index, and whether its body is the one already seen.
+        """
+        digest = None
+        if self.hashed:
+            content = response.content
+            if content is None:
+                content = (response.body or '').encode('utf-8')
+            digest = hashlib.sha1(content).hexdigest()
+        index = Index(response.headers.get('X-Consul-Index'), digest,
+                      self.hashed)
+        return index, bool(self) and index == self and digest == self.digest
+
+
+class CacheInfo(collections.namedtuple('CacheInfo', ['hit', 'age'])):
+    """
+    What the agent's cache did for a request made with *cached*: *hit* tells
+    whether the response came from the cache, None if the agent did not say,
+    and *age* is how many seconds old the response is.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_headers(klass, headers):
+        hit = headers.get('X-Cache')
+        if hit is not None:
+            hit = hit.upper() == 'HIT'
+        return klass(hit, int(headers.get('Age') or 0))
+
+
+class QueryMeta(collections.namedtuple('QueryMeta', [
+        'index', 'last_contact_ms', 'known_leader', 'consistency',
+        'cache_hit', 'cache_age', 'request_time'])):
+    """
+    The metadata the agent returns along with a read: the *index*, the
+    milliseconds since the answering server last heard from the leader
+    *last_contact_ms*, whether it knew of one *known_leader*, the
+    *consistency* the read was served with, the agent cache's *cache_hit*
+    and *cache_age*, and *request_time*, the seconds the request took.
+    Headers the agent did not send are None.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_response(klass, response):
+        headers = response.headers
+        last_contact = headers.get('X-Consul-LastContact')
+        known_leader = headers.get('X-Consul-KnownLeader')
+        if known_leader is not None:
+            known_leader = known_leader.lower() == 'true'
+        cache = CacheInfo.from_headers(headers)
+        return klass(
+            headers.get('X-Consul-Index'),
+            None if last_contact is None else int(last_contact),
+            known_leader,
+            headers.get('X-Consul-Effective-Consistency'),
+            cache.hit,
+            cache.age if cache.hit is not None else None,
+            response.elapsed)
+
+
+def max_stale_param(params, max_stale):
+    """
+    Bounds the staleness of a stale read: a server whose last contact with
+    the leader is older than *max_stale*, in seconds or a duration like
+    '5s', forwards the read to the leader instead.
+    """
+    params.append(('max_stale', '%dms' % (Watch.seconds(max_stale) * 1000)))
+
+
+def agent_cache(params, headers, max_age=None, stale_if_error=None):
+    """
+    Asks the agent to serve a read from its cache by adding the *cached*
+    param to *params* and the Cache-Control directives to *headers*.
+    *max_age* is the age past which the agent must fetch a fresh response
+    and *stale_if_error* how much older a response may be served when the
+    servers can't be reached, either as seconds or durations like '30s'.
+    """
+    params.append(('cached', ''))
+    directives = []
+    if max_age is not None:
+        directives.append('max-age=%d' % Watch.seconds(max_age))
+    if stale_if_error is not None:
+        directives.append('stale-if-error=%d' % Watch.seconds(stale_if_error))
+    if directives:
+        headers['Cache-Control'] = ', '.join(directives)
+
+
+#
+# Conveniences to create consistent callback handlers for endpoints
+
+class CB(object):
+    @classmethod
+    def _status(klass, response, allow_404=True):
+        # status checking
+        if 400 <= response.code < 500:
+            if response.code == 400:
+                raise BadRequest('%d %s' % (response.code, response.body))
+            elif response.code == 401:
+                raise ACLDisabled(response.body)
+            elif response.code == 403:
+                raise ACLPermissionDenied(response.body)
+            elif response.code == 404:
+                if not allow_404:
+                    raise NotFound(response.body)
+            else:
+                raise ClientError("%d %s" % (response.code, response.body))
+        elif 500 <= response.code < 600:
+            raise ConsulException("%d %s" % (response.code, response.body))
+
+    @classmethod
+    def bool(klass):
+        # returns True on successful response
+        def cb(response):
+            CB._status(response)
+            return response.code == 200
+
+        return cb
+
+    @classmethod
+    def json(
+            klass,
+            map=None,
+            allow_404=True,
+            one=False,
+            decode=False,
+            is_id=False,
+            index=False,
+            cache=False,
+            meta=False,
+            since=None):
+        """
+        *map* is a function to apply to the final result.
+
+        *allow_404* if set, None will be returned on 404, instead of raising
+        NotFound.
+
+        *index* if set, a tuple of index, data will be returned.
+
+        *one* returns only the first item of the list of items. empty lists are
+        coerced to None.
+
+        *decode* if specified this key will be base64 decoded.
+
+        *is_id* only the 'ID' field of the json object will be returned.
+
+        *cache* if set, the :class:`CacheInfo` of the response is appended to
+        the result: (index, data, info) or (data, info).
+
+        *meta* if set along with *index*, a :class:`QueryMeta` takes the place
+        of the index, and of the cache info.
+
+        *since* is the index the query was sent with. If it is an
+        :class:`Index` and *index* is set, the index of the response is
+        returned as an :class:`Index` too, and :data:`UNCHANGED` in place of
+        the data when the response is the one *since* was taken from.
+        """
+
+        def cb(response):
+            CB._status(response, allow_404=allow_404)
+            current = response.headers.get('X-Consul-Index')
+            unchanged = False
+            if isinstance(since, Index):
+                current, unchanged = since.follow(response)
+            if meta:
+                current = QueryMeta.from_response(response)._replace(
+                    index=current)
+            if response.code == 404:
+                return current, None
+            if index and unchanged:
+                return current, UNCHANGED
+
+            data = response.json()
+
+            if decode:
+                for item in data:
+                    if item.get(decode) is not None:
+                        item[decode] = base64.b64decode(item[decode])
+            if is_id:
+                data = data['ID']
+            if one:
+                if not data:
+                    data = None
+                if data is not None:
+                    data = data[0]
+            if map:
+                data = map(data)
+            if index and meta:
+                return current, data
+            if cache:
+                info = CacheInfo.from_headers(response.headers)
+                if index:
+                    return current, data, info
+                return data, info
+            if index:
+                return current, data
+            return data
+
+        return cb
+
+    @classmethod
+    def txn(klass):
+        """
+        Returns the decoded body of a transaction: its results, or the
+        errors which rolled it back along with a 409.
+        """
+
+        def cb(response):
+            if response.code != 409:
+                CB._status(response)
+            return response.json()
+
+        return cb
+
+    @classmethod
+    def binary(klass):
+        """
+        This method simply returns response body, usefull for snapshot
+        """
+
+        def cb(response):
+            CB._status(response)
+            return response.content
+
+        return cb
+
+
+class Endpoint(object):
+    """
+    One agent a client can send requests to, along with the statistics used
+    to rank it: an exponentially weighted moving average of its *latency* in
+    seconds and of its *error_rate*, and the number of consecutive
+    connection *failures*.
+    """
+
+    def __init__(self, host, port, scheme='http'):
+        self.host = host
+        self.port = port
+        self.scheme = scheme
+        self.latency = None
+        self.error_rate = 0.0
+        self.failures = 0
+        self.ejected_until = None
+
+    @property
+    def address(self):
+        if self.port is None:
+            return self.host
+        return '%s:%s' % (self.host, self.port)
+
+    @property
+    def base_uri(self):
+        return '%s://%s' % (self.scheme, self.address)
+
+    @property
+    def ejected(self):
+        return self.ejected_until is not None
+
+    def __repr__(self):
+        return '<Endpoint %s>' % self.base_uri
+
+
+class EndpointPool(object):
+    """
+    The set of agents a client balances its requests over.
+
+    Requests go to the better of two randomly chosen available endpoints,
+    ranked by latency plus *error_penalty* seconds weighted by the error
+    rate, so the fastest healthy agent takes most of the load while the
+    statistics of the others stay fresh. *alpha* is the weight of the
+    latest sample in the moving averages.
+
+    After *max_failures* consecutive connection failures an endpoint is
+    ejected; once *eject_time* seconds have passed it is due to be probed
+    with a ``/v1/status/leader`` request, allowed *probe_timeout* seconds,
+    and re-admitted if the agent answers.
+
+    Endpoints are given as 'host:port' strings, '<scheme>://host:port'
+    strings, (host, port) tuples or :class:`Endpoint` instances.
+    """
+
+    def __init__(self,
+                 endpoints=(),
+                 scheme='http',
+                 alpha=0.3,
+                 error_penalty=1.0,
+                 max_failures=1,
+                 eject_time=10.0,
+                 probe_timeout=2.0,
+                 clock=time.time):
+        self.scheme = scheme
+        self.alpha = alpha
+        self.error_penalty = error_penalty
+        self.max_failures = max_failures
+        self.eject_time = eject_time
+        self.probe_timeout = probe_timeout
+        self.clock = clock
+        self.endpoints = []
+        self._lock = threading.Lock()
+        for endpoint in endpoints:
+            self.add(endpoint)
+
+    def add(self, endpoint, port=None):
+        """
+        Adds *endpoint* to the pool unless an endpoint with the same address
+        is already part of it, and returns the pooled endpoint. *port* is
+        used when *endpoint* does not carry one.
+        """
+        if not isinstance(endpoint, Endpoint):
+            endpoint = self.parse(endpoint, port)
+        with self._lock:
+            for existing in self.endpoints:
+                if existing.base_uri == endpoint.base_uri:
+                    return existing
+            self.endpoints.append(endpoint)
+        return endpoint
+
+    def parse(self, address, port=None):
+        scheme = self.scheme
+        if isinstance(address, (tuple, list)):
+            host, port = address
+            return Endpoint(host, port, scheme)
+        if '://' in address:
+            scheme, address = address.split('://', 1)
+        host, sep, address_port = address.rpartition(':')
+        if not sep:
+            host = address_port
+        elif address_port:
+            port = int(address_port)
+        return Endpoint(host, port, scheme)
+
+    def score(self, endpoint):
+        return (endpoint.latency or 0.0) + \
+            endpoint.error_rate * self.error_penalty
+
+    def select(self, exclude=()):
+        """
+        Returns the endpoint the next request should go to, skipping the
+        endpoints in *exclude*. When every endpoint is ejected the one due
+        to be re-admitted first is returned, so requests keep being tried.
+        Returns None once every endpoint has been excluded.
+        """
+        candidates = [e for e in self.endpoints if e not in exclude]
+        if not candidates:
+            return None
+        available = [e for e in candidates if not e.ejected]
+        if not available:
+            return min(candidates, key=lambda e: e.ejected_until)
+        if len(available) > 2:
+            available = random.sample(available, 2)
+        return min(available, key=self.score)
+
+    def _sample(self, endpoint, error, latency=None):
+        alpha = self.alpha
+        endpoint.error_rate += alpha * (error - endpoint.error_rate)
+        if latency is not None:
+            if endpoint.latency is None:
+                endpoint.latency = latency
+            else:
+                endpoint.latency += alpha * (latency - endpoint.latency)
+
+    def responded(self, endpoint, latency=None, error=False):
+        """
+        Records a response from *endpoint*, which re-admits it if it was
+        ejected. *error* is set for server errors, which count against the
+        error rate of the endpoint without ejecting it. *latency* is None for
+        requests whose duration says nothing about the agent, such as
+        blocking queries.
+        """
+        with self._lock:
+            self._sample(endpoint, 1.0 if error else 0.0, latency)
+            endpoint.failures = 0
+            if endpoint.ejected:
+                log.info('consul endpoint %s re-admitted', endpoint.address)
+                endpoint.ejected_until = None
+
+    def failed(self, endpoint):
+        """
+        Records a connection failure of *endpoint*, ejecting it once it
+        failed *max_failures* times in a row.
+        """
+        with self._lock:
+            self._sample(endpoint, 1.0)
+            endpoint.failures += 1
+            if endpoint.failures >= self.max_failures:
+                if not endpoint.ejected:
+                    log.warning('consul endpoint %s ejected', endpoint.address)
+                endpoint.ejected_until = self.clock() + self.eject_time
+
+    def due(self):
+        """
+        Returns the ejected endpoints due to be probed. Each of them is
+        returned once per *eject_time*, so concurrent callers never probe
+        the same endpoint twice.
+        """
+        now = self.clock()
+        due = []
+        with self._lock:
+            for endpoint in self.endpoints:
+                if endpoint.ejected and endpoint.ejected_until <= now:
+                    endpoint.ejected_until = now + self.eject_time
+                    due.append(endpoint)
+        return due
+
+
+class HedgePolicy(object):
+    """
+    Decides which reads are hedged and how long to wait before hedging.
+
+    A hedged read is sent to a second endpoint when the first one has not
+    answered after *delay* seconds, and the first answer wins, unless it
+    has one of the *failed_statuses*: a failing agent must not beat a slow
+    healthy one, so the other leg is waited for then. Only stale
+    reads can be hedged, as any server may answer them, and only on the
+    paths starting with one of *paths*; blocking queries never are.
+
+    When *delay* is None it is the *percentile* of the latencies of the last
+    *window* hedgeable reads, bounded by *min_delay* and *max_delay*, so
+    only the slowest few percent of the reads are duplicated. *max_delay* is
+    used until *min_samples* latencies have been recorded.
+    """
+
+    paths = ('/v1/health/service/', '/v1/catalog/service/', '/v1/kv/')
+    failed_statuses = (429, 500, 502, 503, 504)
+
+    def __init__(self,
+                 delay=None,
+                 percentile=0.95,
+                 window=200,
+                 min_samples=20,
+                 min_delay=0.002,
+                 max_delay=0.5,
+                 paths=None):
+        self.fixed_delay = delay
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        if paths is not None:
+            self.paths = tuple(paths)
+        self.samples = collections.deque(maxlen=window)
+
+    def applies(self, method, path, params=None):
+        if method != 'GET' or not path.startswith(self.paths):
+            return False
+        params = dict(params or ())
+        return 'stale' in params and 'index' not in params
+
+    def record(self, latency):
+        self.samples.append(latency)
+
+    def failed(self, status):
+        return status in self.failed_statuses
+
+    def delay(self):
+        if self.fixed_delay is not None:
+            return self.fixed_delay
+        samples = sorted(self.samples)
+        if len(samples) < self.min_samples:
+            return self.max_delay
+        delay = samples[int(math.ceil(self.percentile * len(samples))) - 1]
+        return min(max(delay, self.min_delay), self.max_delay)
+
+
+class RetryPolicy(object):
+    """
+    Decides whether and when a failed request is retried.
+
+    Only idempotent requests are retried: GETs and PUTs guarded by a *cas*
+    index, whose replay can't apply a change twice. They are retried when
+    they fail to connect or get one of the *statuses* in return, up to
+    *retries* times.
+
+    The wait before the n-th retry is drawn uniformly between 0 and
+    *backoff* * 2 ** n seconds, capped at *max_backoff*, so clients failing
+    together don't retry together.
+
+    Retries are paid from a token bucket holding up to *burst* tokens:
+    every request adds *budget* tokens and every retry takes one, so
+    retries never exceed *budget* of the traffic once the burst is spent.
+    """
+
+    statuses = (500, 502, 503, 504)
+
+    def __init__(self,
+                 retries=3,
+                 backoff=0.05,
+                 max_backoff=2.0,
+                 budget=0.1,
+                 burst=10,
+                 statuses=None):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.budget = budget
+        self.burst = burst
+        if statuses is not None:
+            self.statuses = tuple(statuses)
+        self.tokens = float(burst)
+        self._lock = threading.Lock()
+
+    def retryable(self, method, params=None):
+        method = method.upper()
+        if method == 'GET':
+            return True
+        return method == 'PUT' and 'cas' in dict(params or ())
+
+    def delay(self, attempt, method, params=None, status=None):
+        """
+        Returns the number of seconds to wait before retrying a request
+        whose *attempt*-th try, counting from 0, ended with *status*, or
+        None if it must not be retried. *status* is None when the request
+        failed to connect.
+
+        It must be called once for every try, successful or not, as the
+        first try of each request replenishes the retry budget.
+        """
+        with self._lock:
+            if attempt == 0:
+                self.tokens = min(self.burst, self.tokens + self.budget)
+            if status is not None and status not in self.statuses:
+                return None
+            if attempt >= self.retries or \
+                    not self.retryable(method, params) or \
+                    self.tokens < 1:
+                return None
+            self.tokens -= 1
+        cap = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return random.uniform(0, cap)
+
+
+class CircuitBreaker(object):
+    """
+    Stops sending requests to an agent that keeps failing them, giving it a
+    chance to recover.
+
+    A circuit is kept per agent address and endpoint family (kv, health,
+    catalog...). A closed circuit lets every request through and opens
+    after *failure_threshold* consecutive failures: connection errors,
+    timeouts and 5xx responses. An open circuit fails requests right away
+    with :class:`CircuitOpen` for *reset_timeout* seconds, then turns
+    half-open and lets *half_open_requests* trial requests through. A
+    successful trial closes the circuit, a failed one opens it again.
+
+    *listener* is called with the circuit key, an (address, family) tuple,
+    and the old and new states on every transition; more listeners can be
+    appended to *listeners*.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self,
+                 failure_threshold=5,
+                 reset_timeout=30.0,
+                 half_open_requests=1,
+                 listener=None,
+                 clock=time.time):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_requests = half_open_requests
+        self.listeners = [listener] if listener else []
+        self.clock = clock
+        # key -> [state, consecutive failures, opened at, trials in flight]
+        self.circuits = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def family(path):
+        parts = path.split('/')
+        return parts[2] if len(parts) > 2 else path
+
+    def state(self, key):
+        return self.circuits.get(key, (self.CLOSED,))[0]
+
+    def _transition(self, key, circuit, state):
+        old, circuit[0] = circuit[0], state
+        return key, old, state
+
+    def _notify(self, transition):
+        if transition is not None:
+            for listener in self.listeners:
+                listener(*transition)
+
+    def acquire(self, key):
+        """
+        Lets a request through the circuit *key* or raises
+        :class:`CircuitOpen`.
+        """
+        transition = None
+        with self._lock:
+            circuit = self.circuits.setdefault(key, [self.CLOSED, 0, 0, 0])
+            if circuit[0] == self.OPEN:
+                if self.clock() - circuit[2] < self.reset_timeout:
+                    raise CircuitOpen('circuit open for %s %s' % key)
+                transition = self._transition(key, circuit, self.HALF_OPEN)
+                circuit[3] = 0
+            if circuit[0] == self.HALF_OPEN:
+                if circuit[3] >= self.half_open_requests:
+                    raise CircuitOpen('circuit half-open for %s %s' % key)
+                circuit[3] += 1
+        self._notify(transition)
+
+    def release(self, key, failed):
+        """
+        Records the outcome of a request let through the circuit *key*.
+        *failed* is None for requests abandoned before their outcome was
+        known.
+        """
+        transition = None
+        with self._lock:
+            circuit = self.circuits[key]
+            if circuit[0] == self.HALF_OPEN:
+                circuit[3] = max(circuit[3] - 1, 0)
+            if failed:
+                circuit[1] += 1
+                if circuit[0] == self.HALF_OPEN or (
+                        circuit[0] == self.CLOSED and
+                        circuit[1] >= self.failure_threshold):
+                    circuit[2] = self.clock()
+                    transition = self._transition(key, circuit, self.OPEN)
+            elif failed is not None:
+                circuit[1] = 0
+                if circuit[0] != self.CLOSED:
+                    transition = self._transition(key, circuit, self.CLOSED)
+        self._notify(transition)
+
+
+class Watch(object):
+    """
+    Follows the changes of an endpoint returning (*index*, *data*) through
+    blocking queries.
+
+    *call* is an endpoint method such as ``c.kv.get`` or
+    ``c.health.service``, called with *args* and *kwargs* plus the *index*
+    of the previous response and *wait*, the longest time each query may
+    block (e.g. '10s', 5 minutes by default). Each wait is shortened by up to
+    *jitter* of its duration so that clients started together drift apart.
+
+    Only results whose data differ from the previous result are returned,
+    the first result always is. Indexes are sanitized as Consul requires:
+    an index going backwards restarts the watch from scratch and an index
+    of 0 is replaced by 1.
+
+    Queries are sent with an :class:`Index` so that the endpoints skip
+    decoding the unchanged answers to the queries which time out, comparing
+    a digest of the body as well when *hashed* is set.
+
+    Errors in *errors*, except those in *fatal*, are retried after an
+    exponential backoff from *backoff* up to *max_backoff* seconds; other
+    errors are raised.
+
+    The backends iterate over watches in their own way: see
+    :meth:`Consul.watch` of each backend.
+    """
+
+    jitter = 0.1
+    backoff = 1.0
+    max_backoff = 60.0
+    hashed = False
+    errors = (ConsulException,)
+    fatal = (ACLDisabled, ACLPermissionDenied, BadRequest, ClientError,
+             NotFound)
+
+    def __init__(self, call, *args, **kwargs):
+        self.call = call
+        self.wait = self.seconds(kwargs.pop('wait', None) or '5m')
+        self.args = args
+        self.kwargs = kwargs
+        self.index = None
+        self.digest = None
+        self.data = None
+        self.failures = 0
+
+    @staticmethod
+    def seconds(duration):
+        if isinstance(duration, (int, float)):
+            return float(duration)
+        for unit, factor in (('ms', 0.001), ('s', 1), ('m', 60), ('h', 3600)):
+            if duration.endswith(unit):
+                return float(duration[:-len(unit)]) * factor
+        return float(duration)
+
+    def request(self):
+        """
+        Sends the next query and returns what *call* returns.
+        """
+        kwargs = dict(self.kwargs)
+        kwargs['index'] = None
+        if self.index is not None:
+            kwargs['index'] = Index(self.index, self.digest, self.hashed)
+        wait = self.wait * (1 - self.jitter * random.random())
+        kwargs['wait'] = '%dms' % max(wait * 1000, 1)
+        return self.call(*self.args, **kwargs)
+
+    def update(self, result):
+        """
+        Takes the (*index*, *data*) result of a query into account and
+        returns whether it must be handed to the caller.
+        """
+        index, data = result[:2]
+        if isinstance(index, QueryMeta):
+            index = index.index
+        self.digest = getattr(index, 'digest', None)
+        index = int(index or 0)
+        first = self.index is None
+        self.failures = 0
+        if not first and index < self.index:
+            log.info('consul index went backwards (%s < %s), resetting',
+                     index, self.index)
+            index = 0
+        elif index <= 0:
+            index = 1
+        self.index = index
+        if data is UNCHANGED:
+            return False
+        changed = first or data != self.data
+        self.data = data
+        return changed
+
+    def failed(self, error):
+        """
+        Returns the number of seconds to wait before querying again after
+        *error*, or None if it must be raised.
+        """
+        if not isinstance(error, self.errors) or \
+                isinstance(error, self.fatal):
+            return None
+        self.failures += 1
+        log.warning('consul watch failed (%s), retry #%s',
+                    error, self.failures)
+        delay = min(self.max_backoff,
+                    self.backoff * 2 ** (self.failures - 1))
+        return random.uniform(delay / 2, delay)
+
+
+class Changes(collections.namedtuple(
+        'Changes', ['added', 'removed', 'changed'])):
+    """
+    What changed between two results of a listing, as dicts mapping the key
+    of each entry to the entry: the entries *added*, the previous version of
+    those *removed* and the new version of those *changed*. It is false when
+    nothing changed.
+    """
+
+    __slots__ = ()
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    __nonzero__ = __bool__
+
+
+class Differ(object):
+    """
+    Turns the successive results of a listing, typically followed by a
+    :class:`Watch`, into :class:`Changes` so that consumers can update their
+    state incrementally.
+
+    Subclasses tell how entries are identified, :meth:`key`, and give a
+    cheap :meth:`version` of each entry, so that entries are not compared
+    deeply. The first result is all added.
+    """
+
+    def __init__(self):
+        # key -> (version, entry)
+        self.entries = {}
+
+    def items(self, data):
+        """
+        Returns the (key, entry) pairs of *data*.
+        """
+        return ((self.key(entry), entry) for entry in data or ())
+
+    def key(self, entry):
+        raise NotImplementedError
+
+    def version(self, entry):
+        return entry
+
+    def update(self, data):
+        """
+        Returns the :class:`Changes` from the previous result to *data*.
+        """
+        if data is UNCHANGED:
+            return Changes({}, {}, {})
+        previous = self.entries
+        self.entries = {}
+        added = {}
+        changed = {}
+        for key, entry in self.items(data):
+            version = self.version(entry)
+            self.entries[key] = (version, entry)
+            if key not in previous:
+                added[key] = entry
+            elif previous[key][0] != version:
+                changed[key] = entry
+        removed = dict((key, entry)
+                       for key, (version, entry) in previous.items()
+                       if key not in self.entries)
+        return Changes(added, removed, changed)
+
+    def handler(self, callback):
+        """
+        Returns a watch callback taking (*index*, *data*) which calls
+        *callback* with (*index*, *changes*) when something changed.
+        """
+        def handle(index, data):
+            changes = self.update(data)
+            if changes:
+                return callback(index, changes)
+
+        return handle
+
+
+class HealthDiff(Differ):
+    """
+    A :class:`Differ` of ``health.service`` results, keyed by (node, service
+    id). An instance changes when its node, service or checks are modified.
+    """
+
+    def key(self, entry):
+        return entry['Node']['Node'], entry['Service']['ID']
+
+    def version(self, entry):
+        return (entry['Node'].get('ModifyIndex'),
+                entry['Service'].get('ModifyIndex'),
+                tuple(sorted(check.get('ModifyIndex', 0)
+                             for check in entry.get('Checks') or ())))
+
+
+class CatalogServiceDiff(Differ):
+    """
+    A :class:`Differ` of ``catalog.service`` results, keyed by (node, service
+    id).
+    """
+
+    def key(self, entry):
+        return entry['Node'], entry['ServiceID']
+
+    def version(self, entry):
+        return entry.get('ModifyIndex')
+
+
+class CatalogServicesDiff(Differ):
+    """
+    A :class:`Differ` of ``catalog.services`` results, keyed by service
+    name: a service changes when its tags do. The entries are the tags.
+    """
+
+    def items(self, data):
+        return (data or {}).items()
+
+    def version(self, entry):
+        return tuple(sorted(entry))
+
+
+class Instance(object):
+    """
+    A healthy instance of a service as kept by :class:`Discovery`, built
+    from a ``health.service`` entry. *weight* is the service's passing
+    weight and *inflight* counts the requests acquired and not yet
+    released, see :meth:`Discovery.acquire`.
+    """
+
+    __slots__ = ('node', 'id', 'address', 'port', 'tags', 'meta', 'weight',
+                 'inflight')
+
+    def __init__(self, entry):
+        self.inflight = 0
+        self.update(entry)
+
+    def update(self, entry):
+        node, service = entry['Node'], entry['Service']
+        self.node = node['Node']
+        self.id = service['ID']
+        self.address = service.get('Address') or node.get('Address')
+        self.port = service.get('Port')
+        self.tags = service.get('Tags') or []
+        self.meta = service.get('Meta') or {}
+        self.weight = (service.get('Weights') or {}).get('Passing', 1)
+
+    def __repr__(self):
+        return '<Instance %s on %s at %s:%s>' % (
+            self.id, self.node, self.address, self.port)
+
+
+class InstanceView(object):
+    """
+    An immutable snapshot of the instances of a service with a tag, along
+    with the state strategies keep about it.
+    """
+
+    __slots__ = ('instances', 'counter', '_weights')
+
+    def __init__(self, instances):
+        self.instances = instances
+        self.counter = itertools.count()
+        self._weights = None
+
+    @property
+    def weights(self):
+        """
+        The running totals of the weights of the instances.
+        """
+        if self._weights is None:
+            total = 0
+            self._weights = []
+            for instance in self.instances:
+                total += max(instance.weight, 0)
+                self._weights.append(total)
+        return self._weights
+
+
+class RoundRobin(object):
+    """
+    Picks the instances of a view in turn.
+    """
+
+    def choose(self, view):
+        instances = view.instances
+        return instances[next(view.counter) % len(instances)]
+
+
+class RandomChoice(object):
+    """
+    Picks an instance at random.
+    """
+
+    def choose(self, view):
+        return random.choice(view.instances)
+
+
+class LeastInflight(object):
+    """
+    Power of two choices: picks two instances at random and keeps the one
+    with the fewest requests in flight.
+    """
+
+    def choose(self, view):
+        instances = view.instances
+        if len(instances) == 1:
+            return instances[0]
+        a, b = random.sample(instances, 2)
+        return a if a.inflight <= b.inflight else b
+
+
+class Weighted(object):
+    """
+    Picks an instance at random in proportion to its ``Weights.Passing``.
+    """
+
+    def choose(self, view):
+        weights = view.weights
+        if not weights[-1]:
+            return random.choice(view.instances)
+        return view.instances[
+            bisect.bisect_right(weights, random.random() * weights[-1])]
+
+
+class Discovery(object):
+    """
+    Keeps the healthy instances of services in memory and picks one of them
+    for each request, without a request to the agent.
+
+    The backends feed it with blocking ``health.service`` queries, so that
+    the instances are refreshed as soon as they change; see
+    :meth:`update`. *strategy* is an object with a ``choose(view)``
+    method, or the name of one of :attr:`strategies`.
+    """
+
+    strategies = {
+        'round_robin': RoundRobin,
+        'random': RandomChoice,
+        'least_inflight': LeastInflight,
+        'weighted': Weighted,
+    }
+
+    def __init__(self, strategy='round_robin'):
+        if isinstance(strategy, six.string_types):
+            strategy = self.strategies[strategy]()
+        self.strategy = strategy
+        # service -> {(node, service id): Instance}
+        self.instances = {}
+        # (service, tag) -> InstanceView
+        self.views = {}
+        self.lock = threading.Lock()
+
+    def update(self, service, nodes):
+        """
+        Replaces the instances of *service* with the ``health.service``
+        entries *nodes*. Instances that remain keep their in flight counts.
+        """
+        if nodes is UNCHANGED:
+            return
+        previous = self.instances.get(service, {})
+        instances = {}
+        for entry in nodes or ():
+            key = entry['Node']['Node'], entry['Service']['ID']
+            instance = previous.get(key)
+            if instance is None:
+                instance = Instance(entry)
+            else:
+                instance.update(entry)
+            instances[key] = instance
+        with self.lock:
+            self.instances[service] = instances
+            for key in [key for key in self.views if key[0] == service]:
+                del self.views[key]
+
+    def forget(self, service):
+        """
+        Drops the instances of *service*.
+        """
+        with self.lock:
+            self.instances.pop(service, None)
+            for key in [key for key in self.views if key[0] == service]:
+                del self.views[key]
+
+    def view(self, service, tag=None):
+        """
+        Returns the :class:`InstanceView` of the instances of *service*,
+        only those tagged *tag* if set.
+        """
+        key = (service, tag)
+        view = self.views.get(key)
+        if view is None:
+            with self.lock:
+                instances = sorted(
+                    self.instances.get(service, {}).values(),
+                    key=lambda i: (i.node, i.id))
+                if tag is not None:
+                    instances = [i for i in instances if tag in i.tags]
+                view = self.views.setdefault(key, InstanceView(instances))
+        return view
+
+    def pick(self, service, tag=None):
+        """
+        Returns an :class:`Instance` of *service*, tagged *tag* if set, as
+        chosen by the strategy. Raises NotFound when there is none.
+        """
+        view = self.view(service, tag)
+        if not view.instances:
+            raise NotFound('no healthy instance of %s' % service)
+        return self.strategy.choose(view)
+
+    def acquire(self, service, tag=None):
+        """
+        Like :meth:`pick`, and counts a request in flight to the instance
+        until it is handed to :meth:`release`.
+        """
+        instance = self.pick(service, tag)
+        with self.lock:
+            instance.inflight += 1
+        return instance
+
+    def release(self, instance):
+        with self.lock:
+            instance.inflight -= 1
+
+
+class RTTEstimator(object):
+    """
+    Estimates round trip times from the network coordinates of
+    ``coordinate.nodes`` and ``coordinate.datacenters``, locally, the way
+    Consul does for its *near* parameter.
+
+    Estimates are in seconds. The coordinates are copied into NumPy arrays
+    when NumPy is installed, so that whole rows and matrices are computed
+    at once; *use_numpy* False forces the pure Python implementation.
+    """
+
+    def __init__(self, nodes=None, datacenters=None, use_numpy=None):
+        self.np = None
+        if use_numpy is not False:
+            try:
+                import numpy
+                self.np = numpy
+            except ImportError:
+                if use_numpy:
+                    raise
+        # node -> (vec, height, adjustment) of the LAN coordinates
+        self.coords = {}
+        # datacenter -> [(vec, height, adjustment)] of its servers' WAN ones
+        self.servers = {}
+        self._arrays = None
+        if nodes is not None:
+            self.update(nodes)
+        if datacenters is not None:
+            self.update_datacenters(datacenters)
+
+    @staticmethod
+    def _coord(entry):
+        coord = entry['Coord']
+        return (list(coord['Vec']), coord.get('Height', 0.0),
+                coord.get('Adjustment', 0.0))
+
+    def update(self, nodes):
+        """
+        Replaces the LAN coordinates with the result of
+        ``coordinate.nodes``. Nodes in several network segments keep the
+        coordinate of the default one.
+        """
+        if nodes is UNCHANGED:
+            return
+        coords = {}
+        for entry in nodes or ():
+            if entry['Node'] in coords and entry.get('Segment'):
+                continue
+            coords[entry['Node']] = self._coord(entry)
+        self.coords = coords
+        self._arrays = None
+
+    def update_datacenters(self, datacenters):
+        """
+        Replaces the WAN coordinates with the result of
+        ``coordinate.datacenters``.
+        """
+        self.servers = dict(
+            (dc['Datacenter'],
+             [self._coord(entry) for entry in dc.get('Coordinates') or ()])
+            for dc in datacenters or ())
+
+    @staticmethod
+    def distance(a, b):
+        """
+        Returns the estimated round trip time between the coordinates *a*
+        and *b*, given as (vec, height, adjustment).
+        """
+        rtt = math.sqrt(sum((x - y) ** 2 for x, y in zip(a[0], b[0])))
+        rtt += a[1] + b[1]
+        adjusted = rtt + a[2] + b[2]
+        return adjusted if adjusted > 0 else rtt
+
+    def rtt(self, a, b):
+        """
+        Returns the estimated round trip time between the nodes *a* and *b*,
+        or None when one of them has no coordinate.
+        """
+        if a not in self.coords or b not in self.coords:
+            return None
+        return self.distance(self.coords[a], self.coords[b])
+
+    def arrays(self):
+        """
+        Returns the node names, and NumPy arrays of their vectors, heights
+        and adjustments, in the same order.
+        """
+        if self._arrays is None:
+            np = self.np
+            names = sorted(self.coords)
+            coords = [self.coords[name] for name in names]
+            self._arrays = (
+                names,
+                np.array([c[0] for c in coords], dtype=float).reshape(
+                    len(names), -1),
+                np.array([c[1] for c in coords], dtype=float),
+                np.array([c[2] for c in coords], dtype=float))
+        return self._arrays
+
+    def _adjust(self, rtt, adjustments):
+        adjusted = rtt + adjustments
+        return self.np.where(adjusted > 0, adjusted, rtt)
+
+    def estimates(self, origin):
+        """
+        Returns a dict of the estimated round trip times from the node
+        *origin* to every node with a coordinate, *origin* included.
+        """
+        if origin not in self.coords:
+            return {}
+        if self.np is None:
+            source = self.coords[origin]
+            return dict((name, self.distance(source, coord))
+                        for name, coord in self.coords.items())
+        names, vecs, heights, adjustments = self.arrays()
+        i = names.index(origin)
+        rtt = self.np.sqrt(((vecs - vecs[i]) ** 2).sum(axis=1))
+        rtt += heights + heights[i]
+        rtt = self._adjust(rtt, adjustments + adjustments[i])
+        return dict(zip(names, rtt.tolist()))
+
+    def matrix(self):
+        """
+        Returns the node names and the matrix of the estimated round trip
+        times between them, a NumPy array or a list of lists.
+        """
+        if self.np is None:
+            names = sorted(self.coords)
+            coords = [self.coords[name] for name in names]
+            return names, [[self.distance(a, b) for b in coords]
+                           for a in coords]
+        np = self.np
+        names, vecs, heights, adjustments = self.arrays()
+        # |a - b|^2 = |a|^2 + |b|^2 - 2 a.b keeps the memory in n^2
+        squares = (vecs ** 2).sum(axis=1)
+        distances = squares[:, None] + squares[None, :] - 2 * vecs.dot(vecs.T)
+        rtt = np.sqrt(np.maximum(distances, 0))
+        rtt += heights[:, None] + heights[None, :]
+        return names, self._adjust(
+            rtt, adjustments[:, None] + adjustments[None, :])
+
+    def nearest(self, origin, n=None):
+        """
+        Returns the (node, estimated round trip time) of the *n* nodes
+        nearest to *origin*, or of all of them, nearest first. *origin* is
+        left out.
+        """
+        estimates = self.estimates(origin)
+        estimates.pop(origin, None)
+        nodes = sorted(estimates.items(), key=lambda x: (x[1], x[0]))
+        return nodes if n is None else nodes[:n]
+
+    def sort(self, origin, nodes):
+        """
+        Returns the entries of a ``health.service`` or ``catalog.service``
+        result *nodes* sorted by estimated round trip time from the node
+        *origin*, as the *near* parameter would. Entries of nodes without a
+        coordinate come last, in their original order.
+        """
+        estimates = self.estimates(origin)
+
+        def key(entry):
+            node = entry['Node']
+            if isinstance(node, dict):
+                node = node['Node']
+            rtt = estimates.get(node)
+            return (rtt is None, rtt or 0)
+
+        return sorted(nodes or (), key=key)
+
+    def datacenter_rtt(self, a, b):
+        """
+        Returns the median of the estimated round trip times between the
+        servers of the datacenters *a* and *b*, or None when either has no
+        coordinate.
+        """
+        rtts = sorted(self.distance(x, y)
+                      for x in self.servers.get(a, ())
+                      for y in self.servers.get(b, ()))
+        if not rtts:
+            return None
+        middle = len(rtts) // 2
+        if len(rtts) % 2:
+            return rtts[middle]
+        return (rtts[middle - 1] + rtts[middle]) / 2.0
+
+    def nearest_datacenters(self, origin):
+        """
+        Returns the (datacenter, estimated round trip time) of every
+        datacenter, *origin* first and then the nearest ones. Datacenters
+        without a coordinate come last with a time of None.
+        """
+        others = []
+        for dc in self.servers:
+            if dc != origin:
+                others.append((dc, self.datacenter_rtt(origin, dc)))
+        others.sort(key=lambda x: (x[1] is None, x[1] or 0, x[0]))
+        return [(origin, 0.0)] + others
+
+
+class Resolver(object):
+    """
+    Resolves a service to the passing instances of the nearest datacenter
+    which has any, failing over to the next nearest ones.
+
+    The datacenters of ``catalog.datacenters`` are ranked by the estimated
+    round trip time from *origin*, the datacenter of the agent by default,
+    using ``coordinate.datacenters``; see :class:`RTTEstimator`. The ranking
+    is cached and refreshed in the background every *refresh* seconds.
+    Datacenters without coordinates are tried last.
+    """
+
+    def __init__(self, consul, origin=None, refresh=60, clock=time.time):
+        self.consul = consul
+        self.origin = origin or consul.dc
+        self.refresh = refresh
+        self.clock = clock
+        self.ranking = None
+        self.ranked = None
+        self.refreshing = False
+
+    def rank(self, origin, datacenters, coordinates):
+        """
+        Stores and returns the ranking of the *datacenters* from *origin*
+        given their *coordinates*.
+        """
+        rtt = RTTEstimator(datacenters=coordinates, use_numpy=False)
+        known = set(datacenters)
+        ranking = [dc for dc, _ in rtt.nearest_datacenters(origin)
+                   if dc in known]
+        ranking += sorted(known.difference(ranking))
+        self.origin = origin
+        self.ranking = ranking
+        self.ranked = self.clock()
+        self.refreshing = False
+        return ranking
+
+    def stale(self):
+        """
+        Whether the ranking should be refreshed.
+        """
+        return (not self.refreshing and self.ranked is not None and
+                self.clock() - self.ranked >= self.refresh)
+
+
+class FanOut(collections.namedtuple('FanOut', ['results', 'errors'])):
+    """
+    The outcome of an endpoint call fanned out to several datacenters, see
+    ``Consul.fanout``: the *results* of the datacenters which answered and
+    the *errors* of the others, both dicts keyed by datacenter in the order
+    the datacenters were given. Datacenters which did not answer in time
+    have a Timeout error.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def collect(klass, outcomes):
+        """
+        Builds a FanOut from (datacenter, result, error) triples.
+        """
+        results = collections.OrderedDict()
+        errors = collections.OrderedDict()
+        for dc, result, error in outcomes:
+            if error is None:
+                results[dc] = result
+            else:
+                errors[dc] = error
+        return klass(results, errors)
+
+    @staticmethod
+    def timeout(dc, timeout):
+        return Timeout('%s did not answer within %ss' % (dc, timeout))
+
+    @property
+    def complete(self):
+        """
+        Whether every datacenter answered.
+        """
+        return not self.errors
+
+    def merged(self):
+        """
+        Returns the (datacenter, entry) pairs of the results. The data of
+        (*index*, *data*) results is used; lists contribute their entries,
+        None nothing and anything else is a single entry.
+        """
+        merged = []
+        for dc, result in self.results.items():
+            if isinstance(result, tuple):
+                result = result[1]
+            if result is None:
+                continue
+            if not isinstance(result, list):
+                result = [result]
+            merged.extend((dc, entry) for entry in result)
+        return merged
+
 
+# Consul rejects transactions with more operations or a larger body
+TXN_MAX_OPS = 64
+TXN_MAX_BYTES = 512 * 1024
 
-Response = collections.namedtuple(
-    'Response', ['code', 'headers', 'body', 'content'])
 
+def txn_batches(operations, max_ops=TXN_MAX_OPS, max_bytes=TXN_MAX_BYTES):
+    """
+    Packs the (key, operation) pairs *operations* into as few transactions
+    as allowed by *max_ops* and *max_bytes*, keeping their order. Returns
+    the list of (keys, operations) of each transaction, and the keys of the
+    operations too large for any.
+    """
+    batches = []
+    oversize = []
+    keys, ops, size = [], [], 2
+    for key, op in operations:
+        # the json codec's separators are the widest
+        length = len(json.dumps(op)) + 2
+        if length + 2 > max_bytes:
+            oversize.append(key)
+            continue
+        if ops and (len(ops) == max_ops or size + length > max_bytes):
+            batches.append((keys, ops))
+            keys, ops, size = [], [], 2
+        keys.append(key)
+        ops.append(op)
+        size += length
+    if ops:
+        batches.append((keys, ops))
+    return batches, oversize
+
+
+class BulkResult(collections.namedtuple(
+        'BulkResult', ['applied', 'rolled_back', 'errors'])):
+    """
+    The outcome of ``kv.put_many`` or ``kv.delete_many``: the keys whose
+    operations were *applied*, those *rolled_back* with a transaction which
+    failed because of other keys, and the *errors* of the others, a dict
+    keyed by key of the reason a transaction gave or of the exception its
+    request raised.
+    """
 
-#
-# Conveniences to create consistent callback handlers for endpoints
+    __slots__ = ()
 
-class CB(object):
     @classmethod
-    def _status(klass, response, allow_404=True):
-        # status checking
-        if 400 <= response.code < 500:
-            if response.code == 400:
-                raise BadRequest('%d %s' % (response.code, response.body))
-            elif response.code == 401:
-                raise ACLDisabled(response.body)
-            elif response.code == 403:
-                raise ACLPermissionDenied(response.body)
-            elif response.code == 404:
-                if not allow_404:
-                    raise NotFound(response.body)
-            else:
-                raise ClientError("%d %s" % (response.code, response.body))
-        elif 500 <= response.code < 600:
-            raise ConsulException("%d %s" % (response.code, response.body))
+    def collect(klass, batches, outcomes, oversize=()):
+        """
+        Builds a BulkResult from the (keys, operations) *batches* and the
+        (result, exception) *outcomes* of their transactions.
+        """
+        applied, rolled_back = [], []
+        errors = collections.OrderedDict(
+            (key, 'operation larger than a transaction') for key in oversize)
+        for (keys, ops), (result, error) in zip(batches, outcomes):
+            if error is not None:
+                errors.update((key, error) for key in keys)
+                continue
+            failed = isinstance(result, dict) and result.get('Errors')
+            if not failed:
+                applied.extend(keys)
+                continue
+            reasons = dict((e.get('OpIndex'), e.get('What')) for e in failed)
+            for i, key in enumerate(keys):
+                if i in reasons:
+                    errors[key] = reasons[i]
+                else:
+                    rolled_back.append(key)
+        return klass(applied, rolled_back, errors)
 
-    @classmethod
-    def bool(klass):
-        # returns True on successful response
-        def cb(response):
-            CB._status(response)
-            return response.code == 200
+    @property
+    def ok(self):
+        """
+        Whether every operation was applied.
+        """
+        return not self.rolled_back and not self.errors
 
-        return cb
 
-    @classmethod
-    def json(
-            klass,
-            map=None,
-            allow_404=True,
-            one=False,
-            decode=False,
-            is_id=False,
-            index=False):
-        """
-        *map* is a function to apply to the final result.
+class Subscription(object):
+    def __init__(self, key, callback, errback=None):
+        self.key = key
+        self.callback = callback
+        self.errback = errback
 
-        *allow_404* if set, None will be returned on 404, instead of raising
-        NotFound.
 
-        *index* if set, a tuple of index, data will be returned.
+class Subscriptions(object):
+    """
+    A reference counted registry sharing one upstream watch between all the
+    subscribers to identical requests.
+
+    Requests are identical when they call the same endpoint with the same
+    arguments, token and datacenter; the *wait* of the first subscriber is
+    used for all. The upstream watch should be stopped once its last
+    subscriber leaves, and reported with :meth:`fail` if it stops on an
+    error.
+    """
 
-        *one* returns only the first item of the list of items. empty lists are
-        coerced to None.
+    def __init__(self):
+        # key -> [upstream watch, subscriptions, last (index, data)]
+        self.upstreams = {}
+        self._lock = threading.Lock()
 
-        *decode* if specified this key will be base64 decoded.
+    @classmethod
+    def freeze(klass, value):
+        if isinstance(value, dict):
+            return tuple(sorted(
+                (k, klass.freeze(v)) for k, v in value.items()))
+        if isinstance(value, (list, tuple, set)):
+            return tuple(klass.freeze(v) for v in value)
+        return value
 
-        *is_id* only the 'ID' field of the json object will be returned.
+    @classmethod
+    def key(klass, call, args, kwargs):
+        """
+        Returns the key identifying the request of *call* with *args* and
+        *kwargs*, falling back to the token and datacenter of the client
+        *call* belongs to.
+        """
+        endpoint = getattr(call, '__self__', None)
+        agent = getattr(endpoint, 'agent', None)
+        kwargs = dict(kwargs)
+        kwargs.pop('wait', None)
+        kwargs['token'] = kwargs.get('token') or getattr(agent, 'token', None)
+        kwargs['dc'] = kwargs.get('dc') or getattr(agent, 'dc', None)
+        return (getattr(call, '__func__', call), endpoint,
+                klass.freeze(args), klass.freeze(kwargs))
+
+    def subscribe(self, callback, call, args, kwargs, errback=None):
         """
+        Registers *callback* for the request of *call* and returns the
+        subscription, whether it is the first one for that request, in
+        which case the caller starts the upstream watch and attaches it,
+        and the last result published for that request or None.
+        *errback*, if set, is called with the error the upstream watch
+        stopped on.
+        """
+        key = self.key(call, args, kwargs)
+        subscription = Subscription(key, callback, errback)
+        with self._lock:
+            upstream = self.upstreams.setdefault(key, [None, [], None])
+            upstream[1].append(subscription)
+            return subscription, len(upstream[1]) == 1, upstream[2]
 
-        def cb(response):
-            CB._status(response, allow_404=allow_404)
-            if response.code == 404:
-                return response.headers.get('X-Consul-Index'), None
+    def attach(self, key, watch):
+        self.upstreams[key][0] = watch
 
-            data = json.loads(response.body)
+    def publish(self, key, index, data):
+        """
+        Hands a change to every subscriber of *key* and returns what their
+        callbacks returned.
+        """
+        with self._lock:
+            upstream = self.upstreams.get(key)
+            if upstream is None:
+                return []
+            upstream[2] = (index, data)
+            subscriptions = list(upstream[1])
+        results = []
+        for subscription in subscriptions:
+            try:
+                results.append(subscription.callback(index, data))
+            except Exception:
+                log.exception('consul subscription callback failed')
+        return results
 
-            if decode:
-                for item in data:
-                    if item.get(decode) is not None:
-                        item[decode] = base64.b64decode(item[decode])
-            if is_id:
-                data = data['ID']
-            if one:
-                if not data:
-                    data = None
-                if data is not None:
-                    data = data[0]
-            if map:
-                data = map(data)
-            if index:
-                return response.headers['X-Consul-Index'], data
-            return data
+    def fail(self, key, error):
+        """
+        Drops the upstream of *key*, whose watch stopped on *error*, and
+        hands the error to its subscribers. The next subscriber to the same
+        request starts a new upstream watch.
+        """
+        with self._lock:
+            upstream = self.upstreams.pop(key, None)
+        if upstream is None:
+            return
+        for subscription in upstream[1]:
+            if subscription.errback is None:
+                continue
+            try:
+                subscription.errback(error)
+            except Exception:
+                log.exception('consul subscription errback failed')
 
-        return cb
+    def unsubscribe(self, subscription):
+        """
+        Removes *subscription* and returns the upstream watch to stop when it
+        was the last subscriber, None otherwise.
+        """
+        with self._lock:
+            upstream = self.upstreams.get(subscription.key)
+            if upstream is None or subscription not in upstream[1]:
+                # its upstream failed
+                return None
+            upstream[1].remove(subscription)
+            if upstream[1]:
+                return None
+            del self.upstreams[subscription.key]
+            return upstream[0]
+
+    def __len__(self):
+        return len(self.upstreams)
+
+
+class Coalescer(object):
+    """
+    Shares one in-flight GET between all the concurrent callers of the same
+    path with the same params and headers.
+
+    The backends register a *flight*, whatever their callers can wait on,
+    with :meth:`join` and drop it with :meth:`land` once the request is done.
+    The callers share the raw response, each parsing it with its own
+    callback, as identical requests may still want different results, such
+    as with *meta* or *index*. *calls* counts the GETs seen and *coalesced*
+    those which joined a request already in flight.
+    """
 
-    @classmethod
-    def binary(klass):
+    def __init__(self):
+        self.flights = {}
+        self.calls = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(path, params=None, headers=None):
+        if isinstance(params, dict):
+            params = params.items()
+        return (path,
+                tuple(sorted((k, str(v)) for k, v in params or ())),
+                tuple(sorted((headers or {}).items())))
+
+    def join(self, key, factory):
         """
-        This method simply returns response body, usefull for snapshot
+        Returns the flight for *key* and whether it was just started by
+        calling *factory*.
         """
+        with self._lock:
+            self.calls += 1
+            flight = self.flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                return flight, False
+            flight = self.flights[key] = factory()
+            return flight, True
+
+    def land(self, key):
+        with self._lock:
+            self.flights.pop(key, None)
+
+
+class CacheEntry(object):
+    __slots__ = ('response', 'path', 'index', 'size', 'stored', 'ttl',
+                 'refreshing')
+
+    def __init__(self, response, path, index, size, stored, ttl):
+        self.response = response
+        self.path = path
+        self.index = index
+        self.size = size
+        self.stored = stored
+        self.ttl = ttl
+        self.refreshing = False
+
+
+class ResponseCache(object):
+    """
+    An LRU cache of the agent's responses to GETs of data which rarely
+    changes, keyed by path, params and headers, the token included.
+
+    *ttls* maps path prefixes to the number of seconds their responses stay
+    fresh, extending and overriding :attr:`ttls`; the longest matching prefix
+    wins and paths matching none, or a ttl of 0, are not cached. Neither are
+    paths matching one of :attr:`uncached`, by default the execution and
+    explanation of prepared queries whose definitions are cached, nor blocking
+    and consistent reads.
+
+    Once past its ttl a response is still served for *stale_while_revalidate*
+    seconds while a single request refreshes it in the background.
+
+    At most *max_entries* responses and *max_bytes* bytes of content are kept,
+    the least recently used are evicted first. A response carrying a higher
+    X-Consul-Index than the cached responses for the same path invalidates
+    them, and so does any write to the same endpoint family.
+
+    *hits*, *stale*, *misses*, *evictions* and *invalidations* count what the
+    cache did.
+    """
 
-        def cb(response):
-            CB._status(response)
-            return response.content
+    ttls = {
+        '/v1/catalog/datacenters': 60.0,
+        '/v1/catalog/services': 5.0,
+        '/v1/config/': 10.0,
+        '/v1/query': 10.0,
+        '/v1/acl/token/': 10.0,
+    }
+
+    uncached = (
+        re.compile(r'^/v1/query/[^/]+/(execute|explain)$'),
+    )
+
+    def __init__(self,
+                 ttls=None,
+                 max_entries=1024,
+                 max_bytes=16 * 1024 * 1024,
+                 stale_while_revalidate=0.0,
+                 clock=time.time):
+        self.ttls = dict(self.ttls)
+        self.ttls.update(ttls or {})
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.stale_while_revalidate = stale_while_revalidate
+        self.clock = clock
+        self.entries = collections.OrderedDict()
+        # path -> keys of its cached responses
+        self.paths = {}
+        self.size = 0
+        self.hits = 0
+        self.stale = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+    def ttl(self, path):
+        if any(pattern.match(path) for pattern in self.uncached):
+            return 0
+        matches = [prefix for prefix in self.ttls if path.startswith(prefix)]
+        if not matches:
+            return 0
+        return self.ttls[max(matches, key=len)]
+
+    def key(self, path, params=None, headers=None):
+        """
+        Returns the key to cache a GET of *path* under, or None if it must
+        not be cached.
+        """
+        if not self.ttl(path):
+            return None
+        names = params.keys() if isinstance(params, dict) else \
+            [name for name, value in params or ()]
+        if 'index' in names or 'consistent' in names:
+            return None
+        return Coalescer.key(path, params, headers)
+
+    def get(self, key):
+        """
+        Returns the response cached under *key*, or None, and whether the
+        caller should refresh it.
+        """
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, False
+            age = self.clock() - entry.stored
+            if age < entry.ttl + self.stale_while_revalidate:
+                # most recently used last
+                self.entries[key] = self.entries.pop(key)
+                if age < entry.ttl:
+                    self.hits += 1
+                    return entry.response, False
+                self.stale += 1
+                refresh = not entry.refreshing
+                entry.refreshing = True
+                return entry.response, refresh
+            self._remove(key)
+            self.misses += 1
+            return None, False
+
+    def put(self, key, path, response):
+        """
+        Caches *response* to a GET of *path* under *key*, unless *key* is
+        None, after invalidating the responses of *path* it supersedes.
+        """
+        try:
+            index = int(response.headers.get('X-Consul-Index') or 0)
+        except ValueError:
+            index = 0
+        with self._lock:
+            for other in list(self.paths.get(path, ())):
+                if other != key and self.entries[other].index < index:
+                    self._remove(other)
+                    self.invalidations += 1
+            if key is None or response.code != 200:
+                return
+            size = len(response.content or b'')
+            if size > self.max_bytes:
+                return
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = CacheEntry(
+                response, path, index, size, self.clock(), self.ttl(path))
+            self.paths.setdefault(path, set()).add(key)
+            self.size += size
+            while len(self.entries) > self.max_entries or \
+                    self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self, path=None):
+        """
+        Drops the cached responses of the endpoint family of *path*, all of
+        them by default.
+        """
+        prefix = '/v1/%s/' % path.split('/')[2] if path else '/'
+        with self._lock:
+            for key, entry in list(self.entries.items()):
+                if (entry.path + '/').startswith(prefix):
+                    self._remove(key)
+                    self.invalidations += 1
 
-        return cb
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.size -= entry.size
+        keys = self.paths[entry.path]
+        keys.discard(key)
+        if not keys:
+            del self.paths[entry.path]
+
+    def __len__(self):
+        return len(self.entries)
 
 
 class HTTPClient(six.with_metaclass(abc.ABCMeta, object)):
+    # seconds a blocking query may take past its wait and the agent's jitter
+    blocking_margin = 5.0
+
     def __init__(self, host='127.0.0.1', port=8500, scheme='http',
-                 verify=True, cert=None, timeout=None):
-        self.host = host
-        self.port = port
-        self.scheme = scheme
+                 verify=True, cert=None, timeout=None, endpoints=None):
+        self.socket_path = None
+        if scheme == 'unix':
+            # *host* is the path of the agent's unix domain socket, requests
+            # are plain http sent over that socket
+            self.socket_path = host
+            self.endpoints = EndpointPool([Endpoint('localhost', None)])
+        elif isinstance(endpoints, EndpointPool):
+            self.endpoints = endpoints
+        else:
+            self.endpoints = EndpointPool(endpoints or [(host, port)],
+                                          scheme=scheme)
+        if not self.endpoints.endpoints:
+            raise ConsulException('at least one endpoint is required')
+        # the first endpoint is the agent of backends without failover
+        primary = self.endpoints.endpoints[0]
+        self.host = host if self.socket_path else primary.host
+        self.port = primary.port
+        self.scheme = scheme if self.socket_path else primary.scheme
+        self.base_uri = primary.base_uri
         self.verify = verify
-        self.base_uri = '%s://%s:%s' % (self.scheme, self.host, self.port)
         self.cert = cert
         self.timeout = timeout
+        self.codec = JSONCodec()
+        self.retry = None
+        self.breaker = None
+        self.coalesce = None
+        self.cache = None
+
+    def response(self, code, headers, content, elapsed=None):
+        return Response(code, headers, content=content, codec=self.codec,
+                        elapsed=elapsed)
+
+    def retry_delay(self, attempt, method, params=None, status=None):
+        """
+        Returns the number of seconds to wait before retrying a request
+        according to the client's :class:`RetryPolicy`, or None if it must
+        not be retried. See :meth:`RetryPolicy.delay`.
+        """
+        if self.retry is None:
+            return None
+        return self.retry.delay(attempt, method, params, status)
+
+    def request_timeout(self, params=None):
+        """
+        Returns the timeout of a request with *params*: *timeout*, or None
+        for the backend's default, except for blocking queries which are
+        given their *wait*, 5 minutes by default, plus the up to wait/16 of
+        jitter the agent adds and :attr:`blocking_margin`.
+        """
+        params = dict(params or ())
+        if 'index' not in params:
+            return self.timeout
+        wait = Watch.seconds(params.get('wait') or '5m')
+        blocking = wait + wait / 16 + self.blocking_margin
+        if isinstance(self.timeout, tuple):
+            # a (connect, read) pair, as requests takes
+            connect, read = self.timeout
+            return connect, max(read or 0, blocking)
+        return max(self.timeout or 0, blocking)
+
+    def circuit_enter(self, path, endpoint=None):
+        """
+        Passes a request to *path* on *endpoint*, the first endpoint by
+        default, through the client's :class:`CircuitBreaker`. Raises
+        :class:`CircuitOpen` when it must not be sent; otherwise returns the
+        key to hand to :meth:`circuit_exit` with the outcome.
+        """
+        if self.breaker is None:
+            return None
+        endpoint = endpoint or self.endpoints.endpoints[0]
+        key = (endpoint.address, self.breaker.family(path))
+        self.breaker.acquire(key)
+        return key
+
+    def circuit_exit(self, key, failed):
+        if key is not None:
+            self.breaker.release(key, failed)
+
+    @staticmethod
+    def raw(response):
+        """
+        The callback of coalesced requests: their callers share the
+        response, each parsing it with its own callback.
+        """
+        return response
+
+    def cache_lookup(self, callback, path, params=None, headers=None):
+        """
+        Looks a GET of *path* up in the client's :class:`ResponseCache`.
+        Returns the cached :class:`Response` or None, and the callback to
+        request it with, which also feeds the cache, or None when no request
+        is needed. A response along with a callback is stale and should be
+        refreshed in the background.
+        """
+        if self.cache is None:
+            return None, callback
+        key = self.cache.key(path, params, headers)
+        response, refresh = None, False
+        if key is not None:
+            response, refresh = self.cache.get(key)
+        if response is not None and not refresh:
+            return response, None
+
+        def store(response):
+            self.cache.put(key, path, response)
+            return callback(response)
+
+        return response, store
+
+    def cache_invalidate(self, method, path):
+        """
+        Drops the cached responses a *method* request to *path* may have made
+        stale.
+        """
+        if self.cache is not None and method.upper() != 'GET':
+            self.cache.invalidate(path)
 
-    def uri(self, path, params=None):
-        uri = self.base_uri + urllib.parse.quote(path, safe='/:')
+    def uri(self, path, params=None, endpoint=None):
+        base_uri = endpoint.base_uri if endpoint else self.base_uri
+        uri = base_uri + urllib.parse.quote(path, safe='/:')
         if params:
             uri = '%s?%s' % (uri, urllib.parse.urlencode(params))
         return uri
@@ -329,6 +2381,11 @@ class Consul(object):
             dc=None,
             verify=True,
             cert=None,
+            codec=None,
+            retry=None,
+            breaker=None,
+            coalesce=None,
+            cache=None,
             **kwargs):
         """
         *token* is an optional `ACL token`_. If supplied it will be used by
@@ -347,11 +2404,37 @@ class Consul(object):
         *verify* is whether to verify the SSL certificate for HTTPS requests
 
         *cert* client side certificates for HTTPS requests
+
+        *scheme* can be set to 'unix' to talk to an agent listening on a unix
+        domain socket, *host* is then the path of the socket. The same is
+        achieved by setting *CONSUL_HTTP_ADDR* to unix:///path/to/socket.
+
+        *codec* is the JSON codec used to encode request payloads and decode
+        responses: 'json', 'orjson', 'ujson' or any object with *dumps* and
+        *loads* methods. By default orjson is used when it is installed.
+
+        *retry* retries failed idempotent requests with exponential backoff:
+        either True for the defaults or a :class:`RetryPolicy`.
+
+        *breaker* fails requests fast while an agent keeps failing them:
+        either True for the defaults or a :class:`CircuitBreaker`.
+
+        *coalesce* shares one in-flight GET between the concurrent callers of
+        identical requests: either True or a :class:`Coalescer`, whose
+        counters tell how many calls were coalesced. Supported by the
+        standard, asyncio and tornado clients.
+
+        *cache* serves repeated reads of rarely changing data from memory:
+        either True for the defaults or a :class:`ResponseCache`.
         """
 
         # TODO: Status
 
-        if os.getenv('CONSUL_HTTP_ADDR'):
+        if os.getenv('CONSUL_HTTP_ADDR', '').startswith('unix://'):
+            scheme = 'unix'
+            host = os.getenv('CONSUL_HTTP_ADDR')[len('unix://'):]
+            port = None
+        elif os.getenv('CONSUL_HTTP_ADDR'):
             try:
                 host, port = os.getenv('CONSUL_HTTP_ADDR').split(':')
                 scheme = 'http'
@@ -362,11 +2445,12 @@ class Consul(object):
                     host = host.lstrip('//')
                 except ValueError:
                     raise ConsulException('CONSUL_HTTP_ADDR (%s) invalid, '
-                                          'does not match <host>:<port> or '
-                                          '<protocol>:<host>:<port>'
+                                          'does not match <host>:<port>, '
+                                          '<protocol>:<host>:<port> or '
+                                          'unix://<path>'
                                           % os.getenv('CONSUL_HTTP_ADDR'))
         use_ssl = os.getenv('CONSUL_HTTP_SSL')
-        if use_ssl == 'true':
+        if use_ssl == 'true' and scheme != 'unix':
             scheme = 'https'
         if os.getenv('CONSUL_HTTP_SSL_VERIFY') is not None:
             verify = os.getenv('CONSUL_HTTP_SSL_VERIFY') == 'true'
@@ -390,6 +2474,12 @@ class Consul(object):
                                       verify,
                                       cert,
                                       **kwargs)
+        self.codec = get_codec(codec)
+        self.http.codec = self.codec
+        self.http.retry = RetryPolicy() if retry is True else retry
+        self.http.breaker = CircuitBreaker() if breaker is True else breaker
+        self.http.coalesce = Coalescer() if coalesce is True else coalesce
+        self.http.cache = ResponseCache() if cache is True else cache
         self.kv = Consul.KV(self)
         self.operator = Consul.Operator(self)
         self.query = Consul.Query(self)
@@ -400,6 +2490,21 @@ class Consul(object):
         self.token = os.getenv('CONSUL_HTTP_TOKEN', token)
         self.txn = Consul.Txn(self)
 
+    def _gather(self, calls, concurrency, done):
+        """
+        Runs *calls*, at most *concurrency* at once, and returns what
+        *done* makes of their (result, exception) outcomes, in order. The
+        backends returning futures run them concurrently; here they run one
+        after the other.
+        """
+        outcomes = []
+        for call in calls:
+            try:
+                outcomes.append((call(), None))
+            except Exception as e:
+                outcomes.append((None, e))
+        return done(outcomes)
+
     class ACL(object):
         def __init__(self, agent):
             self.agent = agent
@@ -509,7 +2614,7 @@ class Consul(object):
                 payload['ID'] = acl_id
 
             if payload:
-                data = json.dumps(payload)
+                data = self.agent.codec.dumps(payload)
             else:
                 data = ''
 
@@ -557,7 +2662,7 @@ class Consul(object):
                     'Only HCL or JSON encoded strings supported for the moment'
                 payload['Rules'] = rules
 
-            data = json.dumps(payload)
+            data = self.agent.codec.dumps(payload)
 
             return self.agent.http.put(
                 CB.json(is_id=True),
@@ -701,7 +2806,7 @@ class Consul(object):
             return self.agent.http.post(CB.json(),
                                         path='/v1/acl/login',
                                         headers=headers,
-                                        data=json.dumps(payload))
+                                        data=self.agent.codec.dumps(payload))
 
         def logout(self, token=None):
             headers = {}
@@ -725,10 +2830,11 @@ class Consul(object):
                 token = token or self.agent.token
                 if token:
                     headers['X-Consul-Token'] = token
+                data = self.agent.codec.dumps(payload)
                 return self.agent.http.put(CB.json(),
                                            path='/v1/acl/token',
                                            headers=headers,
-                                           data=json.dumps(payload))
+                                           data=data)
 
             def get(self, accessor_id, token=None):
                 path = '/v1/acl/token/%s' % accessor_id
@@ -755,10 +2861,11 @@ class Consul(object):
                 token = token or self.agent.token
                 if token:
                     headers['X-Consul-Token'] = token
+                data = self.agent.codec.dumps(payload)
                 return self.agent.http.put(CB.json(),
                                            path=path,
                                            headers=headers,
-                                           data=json.dumps(payload))
+                                           data=data)
 
             def clone(self,
                       description='',
@@ -772,10 +2879,11 @@ class Consul(object):
                 token = token or self.agent.token
                 if token:
                     headers['X-Consul-Token'] = token
+                data = self.agent.codec.dumps(payload)
                 return self.agent.http.put(CB.json(),
                                            path=path,
                                            headers=headers,
-                                           data=json.dumps(payload))
+                                           data=data)
 
             def delete(self, accessor_id, token=None):
                 path = '/v1/acl/token/%s' % accessor_id
@@ -865,7 +2973,7 @@ class Consul(object):
                     payload['ID'] = acl_id
 
                 if payload:
-                    data = json.dumps(payload)
+                    data = self.agent.codec.dumps(payload)
                 else:
                     data = ''
 
@@ -897,7 +3005,7 @@ class Consul(object):
                         ' supported for the moment'
                     payload['Rules'] = rules
 
-                data = json.dumps(payload)
+                data = self.agent.codec.dumps(payload)
 
                 return self.agent.http.put(
                     CB.json(is_id=True),
@@ -952,10 +3060,11 @@ class Consul(object):
                 if token:
                     headers['X-Consul-Token'] = token
 
+                data = self.agent.codec.dumps(payload)
                 return self.agent.http.put(CB.json(),
                                            path='/v1/acl/policy',
                                            headers=headers,
-                                           data=json.dumps(payload))
+                                           data=data)
 
             def get(self, policy_id=None, name=None, token=None):
                 path = '/v1/acl/policy/%s' % (policy_id or 'name/' + name)
@@ -983,10 +3092,11 @@ class Consul(object):
                 token = token or self.agent.token
                 if token:
                     headers['X-Consul-Token'] = token
+                data = self.agent.codec.dumps(payload)
                 return self.agent.http.put(CB.json(),
                                            path=path,
                                            headers=headers,
-                                           data=json.dumps(payload))
+                                           data=data)
 
             def delete(self, policy_id, token=None):
                 path = '/v1/acl/policy/%s' % policy_id
@@ -1017,10 +3127,11 @@ class Consul(object):
                 token = token or self.agent.token
                 if token:
                     headers['X-Consul-Token'] = token
+                data = self.agent.codec.dumps(payload)
                 return self.agent.http.put(CB.json(),
                                            path='/v1/acl/role',
                                            headers=headers,
-                                           data=json.dumps(payload))
+                                           data=data)
 
             def get(self, role_id, token=None):
                 path = '/v1/acl/role/%s' % role_id
@@ -1048,10 +3159,11 @@ class Consul(object):
                 token = token or self.agent.token
                 if token:
                     headers['X-Consul-Token'] = token
+                data = self.agent.codec.dumps(payload)
                 return self.agent.http.put(CB.json(),
                                            path=path,
                                            headers=headers,
-                                           data=json.dumps(payload))
+                                           data=data)
 
             def delete(self, role_id, token=None):
                 path = '/v1/acl/role/%s' % role_id
@@ -1083,10 +3195,11 @@ class Consul(object):
                 token = token or self.agent.token
                 if token:
                     headers['X-Consul-Token'] = token
+                data = self.agent.codec.dumps(payload)
                 return self.agent.http.put(CB.json(),
                                            path='/v1/acl/auth-method',
                                            headers=headers,
-                                           data=json.dumps(payload))
+                                           data=data)
 
             def get(self, auth_method_name, token=None):
                 path = '/v1/acl/auth-method/%s' % auth_method_name
@@ -1104,10 +3217,11 @@ class Consul(object):
                 token = token or self.agent.token
                 if token:
                     headers['X-Consul-Token'] = token
+                data = self.agent.codec.dumps(payload)
                 return self.agent.http.put(CB.json(),
                                            path=path,
                                            headers=headers,
-                                           data=json.dumps(payload))
+                                           data=data)
 
             def delete(self, name, token=None):
                 path = '/v1/acl/auth-method/%s' % name
@@ -1138,10 +3252,11 @@ class Consul(object):
                 token = token or self.agent.token
                 if token:
                     headers['X-Consul-Token'] = token
+                data = self.agent.codec.dumps(payload)
                 return self.agent.http.put(CB.json(),
                                            path='/v1/acl/binding-rule',
                                            headers=headers,
-                                           data=json.dumps(payload))
+                                           data=data)
 
             def get(self, binding_rule_id, token=None):
                 path = '/v1/acl/binding-rule/%s' % binding_rule_id
@@ -1159,10 +3274,11 @@ class Consul(object):
                 token = token or self.agent.token
                 if token:
                     headers['X-Consul-Token'] = token
+                data = self.agent.codec.dumps(payload)
                 return self.agent.http.put(CB.json(),
                                            path=path,
                                            headers=headers,
-                                           data=json.dumps(payload))
+                                           data=data)
 
             def delete(self, binding_rule_id, token=None):
                 path = '/v1/acl/binding-rule/%s' % binding_rule_id
@@ -1209,7 +3325,7 @@ class Consul(object):
             return self.agent.http.get(CB.json(),
                                        path='/v1/agent/self', headers=headers)
 
-        def services(self, token=None):
+        def services(self, token=None, filter=None):
             """
             Returns all the services that are registered with the local agent.
             These services were either provided through configuration files, or
@@ -1219,16 +3335,23 @@ class Consul(object):
             while there is no leader elected. The agent performs active
             anti-entropy, so in most situations everything will be in sync
             within a few seconds.
+
+            *filter* is a `filter expression`_ evaluated by the agent, so that
+            only the matching services are returned.
             """
+            params = []
             headers = {}
             token = token or self.agent.token
             if token:
                 headers['X-Consul-Token'] = token
+            if filter:
+                params.append(('filter', str(filter)))
             return self.agent.http.get(CB.json(),
                                        path='/v1/agent/services',
+                                       params=params,
                                        headers=headers)
 
-        def checks(self, token=None):
+        def checks(self, token=None, filter=None):
             """
             Returns all the checks that are registered with the local agent.
             These checks were either provided through configuration files, or
@@ -1238,13 +3361,20 @@ class Consul(object):
             while there is no leader elected. The agent performs active
             anti-entropy, so in most situations everything will be in sync
             within a few seconds.
+
+            *filter* is a `filter expression`_ evaluated by the agent, so that
+            only the matching checks are returned.
             """
+            params = []
             headers = {}
             token = token or self.agent.token
             if token:
                 headers['X-Consul-Token'] = token
+            if filter:
+                params.append(('filter', str(filter)))
             return self.agent.http.get(CB.json(),
                                        path='/v1/agent/checks',
+                                       params=params,
                                        headers=headers)
 
         def members(self, wan=False, token=None):
@@ -1429,7 +3559,7 @@ class Consul(object):
                     CB.bool(),
                     path='/v1/agent/service/register',
                     headers=headers,
-                    data=json.dumps(payload))
+                    data=self.agent.codec.dumps(payload))
 
             def deregister(self, service_id, token=None):
                 """
@@ -1554,7 +3684,7 @@ class Consul(object):
                     CB.bool(),
                     path='/v1/agent/check/register',
                     headers=headers,
-                    data=json.dumps(payload))
+                    data=self.agent.codec.dumps(payload))
 
             def deregister(self, check_id, token=None):
                 """
@@ -1652,7 +3782,7 @@ class Consul(object):
                     CB.json(),
                     path='/v1/agent/connect/authorize',
                     headers=headers,
-                    data=json.dumps(payload))
+                    data=self.agent.codec.dumps(payload))
 
             def root_certificates(self, token=None):
                 """
@@ -1786,7 +3916,7 @@ class Consul(object):
             return self.agent.http.put(
                 CB.bool(),
                 path='/v1/catalog/register',
-                data=json.dumps(data),
+                data=self.agent.codec.dumps(data),
                 params=params,
                 headers=headers)
 
@@ -1832,7 +3962,7 @@ class Consul(object):
                 path='/v1/catalog/deregister',
                 params=params,
                 headers=headers,
-                data=json.dumps(data))
+                data=self.agent.codec.dumps(data))
 
         def datacenters(self):
             """
@@ -1849,7 +3979,10 @@ class Consul(object):
                 dc=None,
                 near=None,
                 token=None,
-                node_meta=None):
+                node_meta=None,
+                max_stale=None,
+                meta=False,
+                filter=None):
             """
             Returns a tuple of (*index*, *nodes*) of all nodes known
             about in the *dc* datacenter. *dc* defaults to the current
@@ -1886,6 +4019,14 @@ class Consul(object):
                         "Address": "10.1.10.12"
                     }
                 ])
+
+            *max_stale* bounds how old a stale read may be, see
+            :func:`max_stale_param`.
+
+            *meta* returns a :class:`QueryMeta` in place of the index.
+
+            *filter* is a `filter expression`_ evaluated by the servers, so
+            that only the matching entries are returned.
             """
             params = []
             headers = {}
@@ -1904,13 +4045,17 @@ class Consul(object):
             consistency = consistency or self.agent.consistency
             if consistency in ('consistent', 'stale'):
                 params.append((consistency, '1'))
+            if max_stale is not None:
+                max_stale_param(params, max_stale)
             if node_meta:
                 for nodemeta_name, nodemeta_value in node_meta.items():
                     params.append(('node-meta', '{0}:{1}'.
                                    format(nodemeta_name, nodemeta_value)))
+            if filter:
+                params.append(('filter', str(filter)))
             return self.agent.http.get(
-                CB.json(index=True), path='/v1/catalog/nodes',
-                params=params, headers=headers)
+                CB.json(index=True, meta=meta, since=index),
+                path='/v1/catalog/nodes', params=params, headers=headers)
 
         def services(self,
                      index=None,
@@ -1918,7 +4063,13 @@ class Consul(object):
                      consistency=None,
                      dc=None,
                      token=None,
-                     node_meta=None):
+                     node_meta=None,
+                     cached=False,
+                     max_age=None,
+                     stale_if_error=None,
+                     max_stale=None,
+                     meta=False,
+                     filter=None):
             """
             Returns a tuple of (*index*, *services*) of all services known
             about in the *dc* datacenter. *dc* defaults to the current
@@ -1940,6 +4091,11 @@ class Consul(object):
             *node_meta* is an optional meta data used for filtering, a
             dictionary formatted as {k1:v1, k2:v2}.
 
+            *cached* serves the request from the local agent's cache, bounded
+            by *max_age* and *stale_if_error*, in seconds or durations like
+            '30s', which imply it; see :func:`agent_cache`. A
+            :class:`CacheInfo` is then appended to the result.
+
             The response looks like this::
 
                 (index, {
@@ -1953,6 +4109,14 @@ class Consul(object):
 
             The main keys are the service names and the list provides all the
             known tags for a given service.
+
+            *max_stale* bounds how old a stale read may be, see
+            :func:`max_stale_param`.
+
+            *meta* returns a :class:`QueryMeta` in place of the index.
+
+            *filter* is a `filter expression`_ evaluated by the servers, so
+            that only the matching entries are returned.
             """
             params = []
             headers = {}
@@ -1969,12 +4133,21 @@ class Consul(object):
             consistency = consistency or self.agent.consistency
             if consistency in ('consistent', 'stale'):
                 params.append((consistency, '1'))
+            if max_stale is not None:
+                max_stale_param(params, max_stale)
             if node_meta:
                 for nodemeta_name, nodemeta_value in node_meta.items():
                     params.append(('node-meta', '{0}:{1}'.
                                    format(nodemeta_name, nodemeta_value)))
+            if filter:
+                params.append(('filter', str(filter)))
+            cached = cached or max_age is not None or \
+                stale_if_error is not None
+            if cached:
+                agent_cache(params, headers, max_age, stale_if_error)
             return self.agent.http.get(
-                CB.json(index=True), path='/v1/catalog/services',
+                CB.json(index=True, meta=meta, since=index, cache=cached),
+                path='/v1/catalog/services',
                 params=params, headers=headers)
 
         def node(self,
@@ -1983,7 +4156,10 @@ class Consul(object):
                  wait=None,
                  consistency=None,
                  dc=None,
-                 token=None):
+                 token=None,
+                 max_stale=None,
+                 meta=False,
+                 filter=None):
             """
             Returns a tuple of (*index*, *services*) of all services provided
             by *node*.
@@ -2028,6 +4204,14 @@ class Consul(object):
                         }
                     }
                 })
+
+            *max_stale* bounds how old a stale read may be, see
+            :func:`max_stale_param`.
+
+            *meta* returns a :class:`QueryMeta` in place of the index.
+
+            *filter* is a `filter expression`_ evaluated by the servers, so
+            that only the matching entries are returned.
             """
             params = []
             headers = {}
@@ -2044,8 +4228,12 @@ class Consul(object):
             consistency = consistency or self.agent.consistency
             if consistency in ('consistent', 'stale'):
                 params.append((consistency, '1'))
+            if max_stale is not None:
+                max_stale_param(params, max_stale)
+            if filter:
+                params.append(('filter', str(filter)))
             return self.agent.http.get(
-                CB.json(index=True),
+                CB.json(index=True, meta=meta, since=index),
                 path='/v1/catalog/node/%s' % node,
                 params=params,
                 headers=headers)
@@ -2060,7 +4248,10 @@ class Consul(object):
                 dc=None,
                 near=None,
                 token=None,
-                node_meta=None):
+                node_meta=None,
+                max_stale=None,
+                meta=False,
+                filter=None):
             """
             Returns a tuple of (*index*, *nodes*) of the nodes providing
             *service* in the *dc* datacenter. *dc* defaults to the current
@@ -2100,6 +4291,14 @@ class Consul(object):
                         "ServicePort": 8000
                     }
                 ])
+
+            *max_stale* bounds how old a stale read may be, see
+            :func:`max_stale_param`.
+
+            *meta* returns a :class:`QueryMeta` in place of the index.
+
+            *filter* is a `filter expression`_ evaluated by the servers, so
+            that only the matching entries are returned.
             """
             params = []
             headers = {}
@@ -2120,12 +4319,16 @@ class Consul(object):
             consistency = consistency or self.agent.consistency
             if consistency in ('consistent', 'stale'):
                 params.append((consistency, '1'))
+            if max_stale is not None:
+                max_stale_param(params, max_stale)
             if node_meta:
                 for nodemeta_name, nodemeta_value in node_meta.items():
                     params.append(('node-meta', '{0}:{1}'.
                                    format(nodemeta_name, nodemeta_value)))
+            if filter:
+                params.append(('filter', str(filter)))
             return self.agent.http.get(
-                CB.json(index=True),
+                CB.json(index=True, meta=meta, since=index),
                 path='/v1/catalog/service/%s' % service,
                 params=params,
                 headers=headers)
@@ -2167,7 +4370,7 @@ class Consul(object):
                 params.append(('cas', cas))
 
             if data:
-                data = json.dumps(data)
+                data = self.agent.codec.dumps(data)
             else:
                 data = ''
             return self.agent.http.put(CB.json(),
@@ -2339,10 +4542,11 @@ class Consul(object):
                 token = token or self.agent.token
                 if token:
                     headers['X-Consul-Token'] = token
+                data = self.agent.codec.dumps(payload)
                 return self.agent.http.put(CB.bool(),
                                            path=path,
                                            headers=headers,
-                                           data=json.dumps(payload))
+                                           data=data)
 
         class Intentions:
             """
@@ -2386,10 +4590,11 @@ class Consul(object):
                 token = token or self.agent.token
                 if token:
                     headers['X-Consul-Token'] = token
+                data = self.agent.codec.dumps(payload)
                 return self.agent.http.post(CB.json(),
                                             path=path,
                                             headers=headers,
-                                            data=json.dumps(payload))
+                                            data=data)
 
             def get(self, intention_id, token=None):
                 path = '/v1/connect/intentions/%s' % intention_id
@@ -2447,7 +4652,7 @@ class Consul(object):
                 headers = {}
                 token = token or self.agent.token
                 if payload:
-                    data = json.dumps(payload)
+                    data = self.agent.codec.dumps(payload)
                 else:
                     data = ''
                 if token:
@@ -2507,7 +4712,8 @@ class Consul(object):
             return self.agent.http.get(CB.json(),
                                        path='/v1/coordinate/datacenters')
 
-        def nodes(self, dc=None, index=None, wait=None, consistency=None):
+        def nodes(self, dc=None, index=None, wait=None, consistency=None,
+                  max_stale=None, meta=False):
             """
             *dc* is the datacenter that this agent will communicate with. By
             default the datacenter of the host is used.
@@ -2522,6 +4728,11 @@ class Consul(object):
             *consistency* can be either 'default', 'consistent' or 'stale'. if
             not specified *consistency* will the consistency level this client
             was configured with.
+
+            *max_stale* bounds how old a stale read may be, see
+            :func:`max_stale_param`.
+
+            *meta* returns a :class:`QueryMeta` in place of the index.
             """
             params = []
             if dc:
@@ -2533,8 +4744,10 @@ class Consul(object):
             consistency = consistency or self.agent.consistency
             if consistency in ('consistent', 'stale'):
                 params.append((consistency, '1'))
+            if max_stale is not None:
+                max_stale_param(params, max_stale)
             return self.agent.http.get(
-                CB.json(index=True),
+                CB.json(index=True, meta=meta, since=index),
                 path='/v1/coordinate/nodes', params=params)
 
     class DiscoveryChain(object):
@@ -2624,7 +4837,8 @@ class Consul(object):
                 self,
                 name=None,
                 index=None,
-                wait=None, token=None):
+                wait=None, token=None,
+                meta=False):
             """
             Returns a tuple of (*index*, *events*)
                 Note: Since Consul's event protocol uses gossip, there is no
@@ -2659,6 +4873,8 @@ class Consul(object):
                         "LTime": 19
                       },
                 }
+
+            *meta* returns a :class:`QueryMeta` in place of the index.
             """
             params = []
             headers = {}
@@ -2672,11 +4888,10 @@ class Consul(object):
                 if wait:
                     params.append(('wait', wait))
             return self.agent.http.get(
-                CB.json(index=True, decode=True),
+                CB.json(index=True, meta=meta, since=index, decode=True),
                 path='/v1/event/list', params=params, headers=headers)
 
     class Health(object):
-        # TODO: All of the health endpoints support all consistency modes
         def __init__(self, agent):
             self.agent = agent
 
@@ -2689,7 +4904,14 @@ class Consul(object):
                     dc=None,
                     near=None,
                     token=None,
-                    node_meta=None):
+                    node_meta=None,
+                    consistency=None,
+                    cached=False,
+                    max_age=None,
+                    stale_if_error=None,
+                    max_stale=None,
+                    meta=False,
+                    filter=None):
             """
             Returns a tuple of (*index*, *nodes*)
 
@@ -2705,7 +4927,8 @@ class Consul(object):
             Calling with *passing* set to True will filter results to only
             those nodes whose checks are currently passing.
 
-            Calling with *tag* will filter the results by tag.
+            Calling with *tag* will filter the results by tag, a list of tags
+            only returns the nodes having all of them.
 
             *dc* is the datacenter of the node and defaults to this agents
             datacenter.
@@ -2717,11 +4940,29 @@ class Consul(object):
 
             *node_meta* is an optional meta data used for filtering, a
             dictionary formatted as {k1:v1, k2:v2}.
+
+            *filter* is a `filter expression`_ evaluated by the servers, so
+            that only the matching entries are returned.
+
+            *consistency* can be either 'default', 'consistent' or 'stale'. if
+            not specified *consistency* will the consistency level this client
+            was configured with.
+
+            *cached* serves the request from the local agent's cache, bounded
+            by *max_age* and *stale_if_error*, in seconds or durations like
+            '30s', which imply it; see :func:`agent_cache`. A
+            :class:`CacheInfo` is then appended to the result.
+
+            *max_stale* bounds how old a stale read may be, see
+            :func:`max_stale_param`.
+
+            *meta* returns a :class:`QueryMeta` in place of the index.
             """
             params = []
             headers = {}
             dc = dc or self.agent.dc
             token = token or self.agent.token
+            consistency = consistency or self.agent.consistency
 
             if index:
                 params.append(('index', index))
@@ -2729,7 +4970,9 @@ class Consul(object):
                     params.append(('wait', wait))
             if passing:
                 params.append(('passing', '1'))
-            if tag is not None:
+            if isinstance(tag, (list, tuple)):
+                params.extend(('tag', t) for t in tag)
+            elif tag is not None:
                 params.append(('tag', tag))
             if dc:
                 params.append(('dc', dc))
@@ -2737,12 +4980,22 @@ class Consul(object):
                 params.append(('near', near))
             if token:
                 headers['X-Consul-Token'] = token
+            if consistency in ('consistent', 'stale'):
+                params.append((consistency, '1'))
+            if max_stale is not None:
+                max_stale_param(params, max_stale)
+            if filter:
+                params.append(('filter', str(filter)))
             if node_meta:
                 for nodemeta_name, nodemeta_value in node_meta.items():
                     params.append(('node-meta', '{0}:{1}'.
                                    format(nodemeta_name, nodemeta_value)))
+            cached = cached or max_age is not None or \
+                stale_if_error is not None
+            if cached:
+                agent_cache(params, headers, max_age, stale_if_error)
             return self.agent.http.get(
-                CB.json(index=True),
+                CB.json(index=True, meta=meta, since=index, cache=cached),
                 path='/v1/health/service/%s' % service,
                 params=params, headers=headers)
 
@@ -2754,7 +5007,11 @@ class Consul(object):
                 dc=None,
                 near=None,
                 token=None,
-                node_meta=None):
+                node_meta=None,
+                meta=False,
+                consistency=None,
+                max_stale=None,
+                filter=None):
             """
             Returns a tuple of (*index*, *checks*) with *checks* being the
             checks associated with the service.
@@ -2778,6 +5035,18 @@ class Consul(object):
 
             *node_meta* is an optional meta data used for filtering, a
             dictionary formatted as {k1:v1, k2:v2}.
+
+            *meta* returns a :class:`QueryMeta` in place of the index.
+
+            *consistency* can be either 'default', 'consistent' or 'stale'. if
+            not specified *consistency* will the consistency level this client
+            was configured with.
+
+            *max_stale* bounds how old a stale read may be, see
+            :func:`max_stale_param`.
+
+            *filter* is a `filter expression`_ evaluated by the servers, so
+            that only the matching entries are returned.
             """
             params = []
             headers = {}
@@ -2793,12 +5062,19 @@ class Consul(object):
             token = token or self.agent.token
             if token:
                 headers['X-Consul-Token'] = token
+            consistency = consistency or self.agent.consistency
+            if consistency in ('consistent', 'stale'):
+                params.append((consistency, '1'))
+            if max_stale is not None:
+                max_stale_param(params, max_stale)
+            if filter:
+                params.append(('filter', str(filter)))
             if node_meta:
                 for nodemeta_name, nodemeta_value in node_meta.items():
                     params.append(('node-meta', '{0}:{1}'.
                                    format(nodemeta_name, nodemeta_value)))
             return self.agent.http.get(
-                CB.json(index=True),
+                CB.json(index=True, meta=meta, since=index),
                 path='/v1/health/checks/%s' % service,
                 params=params, headers=headers)
 
@@ -2809,7 +5085,11 @@ class Consul(object):
                   dc=None,
                   near=None,
                   token=None,
-                  node_meta=None):
+                  node_meta=None,
+                  meta=False,
+                  consistency=None,
+                  max_stale=None,
+                  filter=None):
             """
             Returns a tuple of (*index*, *nodes*)
 
@@ -2838,6 +5118,18 @@ class Consul(object):
             dictionary formatted as {k1:v1, k2:v2}.
 
             *nodes* are the nodes providing the given service.
+
+            *meta* returns a :class:`QueryMeta` in place of the index.
+
+            *consistency* can be either 'default', 'consistent' or 'stale'. if
+            not specified *consistency* will the consistency level this client
+            was configured with.
+
+            *max_stale* bounds how old a stale read may be, see
+            :func:`max_stale_param`.
+
+            *filter* is a `filter expression`_ evaluated by the servers, so
+            that only the matching entries are returned.
             """
             assert name in ['any', 'unknown', 'passing', 'warning', 'critical']
             params = []
@@ -2855,16 +5147,24 @@ class Consul(object):
                 params.append(('near', near))
             if token:
                 headers['X-Consul-Token'] = token
+            consistency = consistency or self.agent.consistency
+            if consistency in ('consistent', 'stale'):
+                params.append((consistency, '1'))
+            if max_stale is not None:
+                max_stale_param(params, max_stale)
+            if filter:
+                params.append(('filter', str(filter)))
             if node_meta:
                 for nodemeta_name, nodemeta_value in node_meta.items():
                     params.append(('node-meta', '{0}:{1}'.
                                    format(nodemeta_name, nodemeta_value)))
             return self.agent.http.get(
-                CB.json(index=True),
+                CB.json(index=True, meta=meta, since=index),
                 path='/v1/health/state/%s' % name,
                 params=params, headers=headers)
 
-        def node(self, node, index=None, wait=None, dc=None, token=None):
+        def node(self, node, index=None, wait=None, dc=None, token=None,
+                 meta=False, consistency=None, max_stale=None, filter=None):
             """
             Returns a tuple of (*index*, *checks*)
 
@@ -2881,6 +5181,18 @@ class Consul(object):
             *token* is an optional `ACL token`_ to apply to this request.
 
             *nodes* are the nodes providing the given service.
+
+            *meta* returns a :class:`QueryMeta` in place of the index.
+
+            *consistency* can be either 'default', 'consistent' or 'stale'. if
+            not specified *consistency* will the consistency level this client
+            was configured with.
+
+            *max_stale* bounds how old a stale read may be, see
+            :func:`max_stale_param`.
+
+            *filter* is a `filter expression`_ evaluated by the servers, so
+            that only the matching entries are returned.
             """
             params = []
             headers = {}
@@ -2894,9 +5206,16 @@ class Consul(object):
             token = token or self.agent.token
             if token:
                 headers['X-Consul-Token'] = token
+            consistency = consistency or self.agent.consistency
+            if consistency in ('consistent', 'stale'):
+                params.append((consistency, '1'))
+            if max_stale is not None:
+                max_stale_param(params, max_stale)
+            if filter:
+                params.append(('filter', str(filter)))
 
             return self.agent.http.get(
-                CB.json(index=True),
+                CB.json(index=True, meta=meta, since=index),
                 path='/v1/health/node/%s' % node,
                 params=params, headers=headers)
 
@@ -2920,7 +5239,9 @@ class Consul(object):
                 consistency=None,
                 keys=False,
                 separator=None,
-                dc=None):
+                dc=None,
+                max_stale=None,
+                meta=False):
             """
             Returns a tuple of (*index*, *value[s]*)
 
@@ -2959,6 +5280,11 @@ class Consul(object):
             Note, if the requested key does not exists *(index, None)* is
             returned. It's then possible to long poll on the index for when the
             key is created.
+
+            *max_stale* bounds how old a stale read may be, see
+            :func:`max_stale_param`.
+
+            *meta* returns a :class:`QueryMeta` in place of the index.
             """
             assert not key.startswith('/'), \
                 'keys should not start with a forward slash'
@@ -2983,6 +5309,8 @@ class Consul(object):
             consistency = consistency or self.agent.consistency
             if consistency in ('consistent', 'stale'):
                 params.append((consistency, '1'))
+            if max_stale is not None:
+                max_stale_param(params, max_stale)
 
             one = False
             decode = False
@@ -2992,8 +5320,8 @@ class Consul(object):
             if not recurse and not keys:
                 one = True
             return self.agent.http.get(
-                CB.json(index=True, decode=decode, one=one,
-                        map=lambda x: x if x else None),
+                CB.json(index=True, meta=meta, since=index, decode=decode,
+                        one=one, map=lambda x: x if x else None),
                 path='/v1/kv/%s' % key,
                 params=params, headers=headers)
 
@@ -3108,6 +5436,84 @@ class Consul(object):
                 CB.json(), path='/v1/kv/%s' % key,
                 params=params, headers=headers)
 
+        def put_many(self,
+                     items,
+                     flags=None,
+                     token=None,
+                     dc=None,
+                     concurrency=1):
+            """
+            Sets many keys with as few transactions as possible, each within
+            Consul's limits of 64 operations and 512KB. Transactions are
+            atomic, so when a key fails the others of its transaction are
+            rolled back.
+
+            *items* is a dict or an iterable of (key, value) pairs, each
+            value being None or any string type, as for :meth:`put`.
+
+            *flags*, *token* and *dc* apply to every key. *concurrency*
+            bounds the number of transactions in flight at once.
+
+            Returns a :class:`consul.base.BulkResult`.
+            """
+            if isinstance(items, dict):
+                items = items.items()
+            operations = []
+            for key, value in items:
+                assert not key.startswith('/'), \
+                    'keys should not start with a forward slash'
+                op = {'Verb': 'set', 'Key': key}
+                if value is not None:
+                    if isinstance(value, six.text_type):
+                        value = value.encode('utf-8')
+                    op['Value'] = base64.b64encode(value).decode('ascii')
+                if flags is not None:
+                    op['Flags'] = flags
+                operations.append((key, {'KV': op}))
+            return self._apply(operations, token, dc, concurrency)
+
+        def delete_many(self,
+                        keys,
+                        recurse=False,
+                        token=None,
+                        dc=None,
+                        concurrency=1):
+            """
+            Deletes many keys, or with *recurse* all the keys sharing each of
+            the prefixes *keys*, with as few transactions as possible; see
+            :meth:`put_many`.
+
+            Returns a :class:`consul.base.BulkResult`.
+            """
+            verb = 'delete-tree' if recurse else 'delete'
+            operations = []
+            for key in keys:
+                assert not key.startswith('/'), \
+                    'keys should not start with a forward slash'
+                operations.append((key, {'KV': {'Verb': verb, 'Key': key}}))
+            return self._apply(operations, token, dc, concurrency)
+
+        def _apply(self, operations, token, dc, concurrency):
+            params = []
+            headers = {}
+            token = token or self.agent.token
+            dc = dc or self.agent.dc
+            if token:
+                headers['X-Consul-Token'] = token
+            if dc:
+                params.append(('dc', dc))
+            batches, oversize = txn_batches(operations)
+
+            def call(ops):
+                return lambda: self.agent.http.put(
+                    CB.txn(), path='/v1/txn', params=params,
+                    headers=headers, data=self.agent.codec.dumps(ops))
+
+            return self.agent._gather(
+                [call(ops) for keys, ops in batches], concurrency,
+                lambda outcomes: BulkResult.collect(
+                    batches, outcomes, oversize))
+
     class Operator(object):
         def __init__(self, agent):
             self.agent = agent
@@ -3165,11 +5571,12 @@ class Consul(object):
                     params.append(('dc', dc))
                 if cas:
                     params.append(('cas', cas))
+                data = self.agent.codec.dumps(payload)
                 return self.agent.http.put(CB.json(),
                                            path=path,
                                            params=params,
                                            headers=headers,
-                                           data=json.dumps(payload))
+                                           data=data)
 
             def health(self, dc=None, token=None):
                 path = '/v1/operator/autopilot/health'
@@ -3201,11 +5608,12 @@ class Consul(object):
                     headers['X-Consul-Token'] = token
                 if relay_factor:
                     params.append(('relay-factor', relay_factor))
+                data = self.agent.codec.dumps(payload)
                 return self.agent.http.post(CB.bool(),
                                             path=path,
                                             params=params,
                                             headers=headers,
-                                            data=json.dumps(payload))
+                                            data=data)
 
             def update(self, key, relay_factor=None, token=None):
                 path = '/v1/operator/keyring'
@@ -3217,11 +5625,12 @@ class Consul(object):
                     headers['X-Consul-Token'] = token
                 if relay_factor:
                     params.append(('relay-factor', relay_factor))
+                data = self.agent.codec.dumps(payload)
                 return self.agent.http.put(CB.bool(),
                                            path=path,
                                            params=params,
                                            headers=headers,
-                                           data=json.dumps(payload))
+                                           data=data)
 
             def delete(self, key, token=None):
                 path = '/v1/operator/keyring'
@@ -3230,10 +5639,11 @@ class Consul(object):
                 token = token or self.agent.token
                 if token:
                     headers['X-Consul-Token'] = token
+                data = self.agent.codec.dumps(payload)
                 return self.agent.http.delete(CB.bool(),
                                               path=path,
                                               headers=headers,
-                                              data=json.dumps(payload))
+                                              data=data)
 
             def list(self, relay_factor=None, local_only=None, token=None):
                 params = []
@@ -3399,7 +5809,7 @@ class Consul(object):
                     'service': service_body
                 }.items() if v is not None
             ])
-            return json.dumps(data)
+            return self.agent.codec.dumps(data)
 
         def create(self, service,
                    name=None,
@@ -3561,7 +5971,10 @@ class Consul(object):
                     token=None,
                     dc=None,
                     near=None,
-                    limit=None):
+                    limit=None,
+                    cached=False,
+                    max_age=None,
+                    stale_if_error=None):
             """
             This endpoint will execute certain query
 
@@ -3577,6 +5990,11 @@ class Consul(object):
 
             *limit* is used to limit the size of the list to the given number
             of nodes. This is applied after any sorting or shuffling.
+
+            *cached* serves the request from the local agent's cache, bounded
+            by *max_age* and *stale_if_error*, in seconds or durations like
+            '30s', which imply it; see :func:`agent_cache`. A
+            :class:`CacheInfo` is then appended to the result.
             """
             params = []
             headers = {}
@@ -3589,8 +6007,12 @@ class Consul(object):
                 params.append(('near', near))
             if limit:
                 params.append(('limit', limit))
+            cached = cached or max_age is not None or \
+                stale_if_error is not None
+            if cached:
+                agent_cache(params, headers, max_age, stale_if_error)
             return self.agent.http.get(
-                CB.json(), path='/v1/query/%s/execute' % query,
+                CB.json(cache=cached), path='/v1/query/%s/execute' % query,
                 params=params, headers=headers)
 
         def explain(self,
@@ -3692,7 +6114,7 @@ class Consul(object):
                 assert 10 <= ttl <= 86400
                 data['ttl'] = '%ss' % ttl
             if data:
-                data = json.dumps(data)
+                data = self.agent.codec.dumps(data)
             else:
                 data = ''
 
@@ -3729,7 +6151,10 @@ class Consul(object):
                  wait=None,
                  consistency=None,
                  dc=None,
-                 token=None):
+                 token=None,
+                 max_stale=None,
+                 meta=False,
+                 filter=None):
             """
             Returns a tuple of (*index*, *sessions*) of all active sessions in
             the *dc* datacenter. *dc* defaults to the current datacenter of
@@ -3760,6 +6185,14 @@ class Consul(object):
                     },
                   pass
                ])
+
+            *max_stale* bounds how old a stale read may be, see
+            :func:`max_stale_param`.
+
+            *meta* returns a :class:`QueryMeta` in place of the index.
+
+            *filter* is a `filter expression`_ evaluated by the servers, so
+            that only the matching entries are returned.
             """
             params = []
             headers = {}
@@ -3779,9 +6212,13 @@ class Consul(object):
             consistency = consistency or self.agent.consistency
             if consistency in ('consistent', 'stale'):
                 params.append((consistency, '1'))
+            if max_stale is not None:
+                max_stale_param(params, max_stale)
+            if filter:
+                params.append(('filter', str(filter)))
             return self.agent.http.get(
-                CB.json(index=True), path='/v1/session/list',
-                params=params, headers=headers)
+                CB.json(index=True, meta=meta, since=index),
+                path='/v1/session/list', params=params, headers=headers)
 
         def node(self,
                  node,
@@ -3789,7 +6226,9 @@ class Consul(object):
                  wait=None,
                  consistency=None,
                  dc=None,
-                 token=None):
+                 token=None,
+                 max_stale=None,
+                 meta=False):
             """
             Returns a tuple of (*index*, *sessions*) as per *session.list*, but
             filters the sessions returned to only those active for *node*.
@@ -3804,6 +6243,11 @@ class Consul(object):
             *consistency* can be either 'default', 'consistent' or 'stale'. if
             not specified *consistency* will the consistency level this client
             was configured with.
+
+            *max_stale* bounds how old a stale read may be, see
+            :func:`max_stale_param`.
+
+            *meta* returns a :class:`QueryMeta` in place of the index.
             """
             params = []
             headers = {}
@@ -3821,8 +6265,10 @@ class Consul(object):
             consistency = consistency or self.agent.consistency
             if consistency in ('consistent', 'stale'):
                 params.append((consistency, '1'))
+            if max_stale is not None:
+                max_stale_param(params, max_stale)
             return self.agent.http.get(
-                CB.json(index=True),
+                CB.json(index=True, meta=meta, since=index),
                 path='/v1/session/node/%s' % node,
                 params=params, headers=headers)
 
@@ -3832,7 +6278,9 @@ class Consul(object):
                  wait=None,
                  consistency=None,
                  dc=None,
-                 token=None):
+                 token=None,
+                 max_stale=None,
+                 meta=False):
             """
             Returns a tuple of (*index*, *session*) for the session
             *session_id* in the *dc* datacenter. *dc* defaults to the current
@@ -3848,6 +6296,11 @@ class Consul(object):
             *consistency* can be either 'default', 'consistent' or 'stale'. if
             not specified *consistency* will the consistency level this client
             was configured with.
+
+            *max_stale* bounds how old a stale read may be, see
+            :func:`max_stale_param`.
+
+            *meta* returns a :class:`QueryMeta` in place of the index.
             """
             params = []
             headers = {}
@@ -3865,8 +6318,10 @@ class Consul(object):
             consistency = consistency or self.agent.consistency
             if consistency in ('consistent', 'stale'):
                 params.append((consistency, '1'))
+            if max_stale is not None:
+                max_stale_param(params, max_stale)
             return self.agent.http.get(
-                CB.json(index=True, one=True),
+                CB.json(index=True, meta=meta, since=index, one=True),
                 path='/v1/session/info/%s' % session_id,
                 params=params, headers=headers)
 
@@ -3980,6 +6435,25 @@ class Consul(object):
             """
             return self.agent.http.get(CB.json(), path='/v1/status/peers')
 
+        def seed_endpoints(self, port=None):
+            """
+            Adds the Raft peers of the datacenter to the endpoints the client
+            balances its requests over and returns their addresses.
+
+            Peers are advertised with their server RPC port, which is replaced
+            by *port*, the HTTP port of the client's first endpoint by default.
+            """
+            endpoints = self.agent.http.endpoints
+            if port is None:
+                port = self.agent.http.port
+
+            def callback(response):
+                peers = CB.json()(response) or []
+                return [endpoints.add((peer.rpartition(':')[0], port)).address
+                        for peer in peers]
+
+            return self.agent.http.get(callback, path='/v1/status/peers')
+
     class Txn(object):
         """
         The Transactions endpoints manage updates or fetches of multiple keys
@@ -4017,4 +6491,4 @@ class Consul(object):
                 headers['X-Consul-Token'] = token
             return self.agent.http.put(CB.json(), path="/v1/txn",
                                        headers=headers,
-                                       data=json.dumps(payload))
+                                       data=self.agent.codec.dumps(payload))
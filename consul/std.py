@@ -1,65 +1,839 @@
+import logging
+import socket
+import threading
+import time
+
 import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.connection import HTTPConnection
+from requests.packages.urllib3.connectionpool import HTTPConnectionPool
+from six.moves import queue
 
 from consul import base
 
 __all__ = ['Consul']
 
+log = logging.getLogger(__name__)
 
-class HTTPClient(base.HTTPClient):
+
+class PoolAdapter(HTTPAdapter):
+    """
+    A requests transport adapter which can enable TCP keep-alive probes on
+    the pooled connections. *tcp_keepalive* is the number of idle seconds
+    after which the kernel starts probing a connection.
+    """
+
+    def __init__(self, tcp_keepalive=None, **kwargs):
+        self.tcp_keepalive = tcp_keepalive
+        super(PoolAdapter, self).__init__(**kwargs)
+
+    def socket_options(self):
+        options = list(HTTPConnection.default_socket_options)
+        options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            options.append(
+                (socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, self.tcp_keepalive))
+        elif hasattr(socket, 'TCP_KEEPALIVE'):
+            # macOS names the idle time option TCP_KEEPALIVE
+            options.append(
+                (socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, self.tcp_keepalive))
+        return options
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.tcp_keepalive:
+            kwargs['socket_options'] = self.socket_options()
+        super(PoolAdapter, self).init_poolmanager(*args, **kwargs)
+
+
+class UnixHTTPConnection(HTTPConnection):
     def __init__(self, *args, **kwargs):
-        super(HTTPClient, self).__init__(*args, **kwargs)
-        self.session = requests.session()
+        self.socket_path = kwargs.pop('socket_path')
+        super(UnixHTTPConnection, self).__init__(*args, **kwargs)
 
-    @staticmethod
-    def response(response):
-        response.encoding = 'utf-8'
-        return base.Response(
-            response.status_code,
-            response.headers,
-            response.text,
-            response.content)
+    def _new_conn(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if isinstance(self.timeout, (int, float)):
+            sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except socket.error:
+            sock.close()
+            raise
+        return sock
+
+
+class UnixHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = UnixHTTPConnection
+
+
+class UnixAdapter(PoolAdapter):
+    """
+    A transport adapter sending every request over the unix domain socket
+    *socket_path*, whatever the host of the request url.
+    """
+
+    def __init__(self, socket_path, **kwargs):
+        self.socket_path = socket_path
+        super(UnixAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **kwargs):
+        super(UnixAdapter, self).init_poolmanager(
+            connections, maxsize, block, **kwargs)
+        self.pool = UnixHTTPConnectionPool('localhost',
+                                           maxsize=maxsize,
+                                           block=block,
+                                           socket_path=self.socket_path)
+
+    def get_connection(self, url, proxies=None):
+        return self.pool
+
+    def get_connection_with_tls_context(self, request, verify, proxies=None,
+                                        cert=None):
+        return self.pool
+
+    def close(self):
+        super(UnixAdapter, self).close()
+        self.pool.close()
+
+
+class Flight(object):
+    """
+    A GET shared by several threads, see :class:`consul.base.Coalescer`.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class HTTPClient(base.HTTPClient):
+    """
+    Blocking client based on requests.
+
+    The client is safe to share across threads: every thread gets its own
+    requests session, while all of them draw connections from one shared,
+    thread-safe connection pool.
+
+    *pool_connections* is the number of distinct agents to keep pools for and
+    *pool_maxsize* the number of connections kept alive per agent; it should
+    be at least the number of threads sharing the client. When *pool_block*
+    is set, threads wait for a free connection instead of opening throwaway
+    connections beyond *pool_maxsize*.
+
+    *max_retries* is passed to the transport adapter and is either a number
+    of retries on connection failures or a urllib3 ``Retry`` object.
+
+    *keep_alive* set to False closes the connection after every request.
+    *tcp_keepalive* enables TCP keep-alive probes after the given number of
+    idle seconds.
+
+    With the 'unix' *scheme* all requests go through the agent's unix domain
+    socket instead of TCP.
+
+    *endpoints* is a list of agent addresses, or a
+    :class:`consul.base.EndpointPool`, to balance requests over instead of
+    *host* and *port*. A request failing to connect is retried on the next
+    best endpoint, and ejected endpoints are probed again in a background
+    thread once their ejection time has passed.
+
+    *hedge* enables hedged stale reads across the endpoints: either True or
+    a :class:`consul.base.HedgePolicy`. The legs of hedged reads run in a
+    pool of threads kept by the client, so that their sessions and
+    connections are reused; the losing leg can't be interrupted and finishes
+    in the background, its response only feeding the endpoint statistics.
+    """
+
+    def __init__(self,
+                 host='127.0.0.1',
+                 port=8500,
+                 scheme='http',
+                 verify=True,
+                 cert=None,
+                 timeout=None,
+                 pool_connections=10,
+                 pool_maxsize=10,
+                 pool_block=False,
+                 max_retries=0,
+                 keep_alive=True,
+                 tcp_keepalive=None,
+                 endpoints=None,
+                 hedge=None):
+        super(HTTPClient, self).__init__(
+            host, port, scheme, verify, cert, timeout, endpoints)
+        self.hedge = base.HedgePolicy() if hedge is True else hedge
+        self.keep_alive = keep_alive
+        pool_kwargs = dict(pool_connections=pool_connections,
+                           pool_maxsize=pool_maxsize,
+                           pool_block=pool_block,
+                           max_retries=max_retries)
+        if self.socket_path:
+            self.adapter = UnixAdapter(self.socket_path, **pool_kwargs)
+        else:
+            self.adapter = PoolAdapter(tcp_keepalive=tcp_keepalive,
+                                       **pool_kwargs)
+        self._local = threading.local()
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        # up to two legs per hedged read of every pooled connection
+        self._hedge_workers = 2 * pool_maxsize
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self._hedge_workers)
+        return self._executor
+
+    @property
+    def session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.session()
+            session.mount('http://', self.adapter)
+            session.mount('https://', self.adapter)
+            if not self.keep_alive:
+                session.headers['Connection'] = 'close'
+            self._local.session = session
+        return session
+
+    def _probe(self, endpoint):
+        try:
+            response = self.session.get(
+                self.uri('/v1/status/leader', endpoint=endpoint),
+                verify=self.verify,
+                cert=self.cert,
+                timeout=self.endpoints.probe_timeout)
+        except requests.exceptions.RequestException:
+            self.endpoints.failed(endpoint)
+        else:
+            self.endpoints.responded(
+                endpoint, error=response.status_code >= 500)
+
+    def _send(self, endpoint, method, path, params=None, data=None,
+              headers=None):
+        # the duration of a blocking query says nothing about the agent
+        timed = 'index' not in dict(params or ())
+        timeout = self.request_timeout(params)
+        circuit = self.circuit_enter(path, endpoint)
+        start = time.time()
+        try:
+            response = self.session.request(method,
+                                            self.uri(path, params, endpoint),
+                                            data=data,
+                                            headers=headers,
+                                            verify=self.verify,
+                                            cert=self.cert,
+                                            timeout=timeout)
+        except Exception as e:
+            if isinstance(e, requests.exceptions.ConnectionError):
+                self.endpoints.failed(endpoint)
+            self.circuit_exit(circuit, failed=True)
+            raise
+        error = response.status_code >= 500
+        self.endpoints.responded(endpoint,
+                                 time.time() - start if timed else None,
+                                 error=error)
+        self.circuit_exit(circuit, failed=error)
+        return response
+
+    def _failover(self, method, path, params=None, data=None, headers=None):
+        tried = []
+        endpoint = self.endpoints.select()
+        while True:
+            try:
+                return self._send(endpoint, method, path, params, data,
+                                  headers)
+            except (requests.exceptions.ConnectionError, base.CircuitOpen):
+                tried.append(endpoint)
+                endpoint = self.endpoints.select(exclude=tried)
+                if endpoint is None:
+                    raise
+
+    def _hedged(self, path, params=None, headers=None):
+        results = queue.Queue()
+        tried = []
+
+        def leg(endpoint):
+            start = time.time()
+            try:
+                response = self._send(endpoint, 'GET', path, params,
+                                      headers=headers)
+            except Exception as e:
+                results.put((None, e))
+            else:
+                self.hedge.record(time.time() - start)
+                results.put((response, None))
+
+        def launch():
+            endpoint = self.endpoints.select(exclude=tried)
+            if endpoint is None:
+                return 0
+            tried.append(endpoint)
+            self.executor.submit(leg, endpoint)
+            return 1
+
+        pending = launch()
+        timeout = self.hedge.delay()
+        while pending:
+            try:
+                response, error = results.get(timeout=timeout)
+            except queue.Empty:
+                # the first endpoint is slow, race it against another one
+                timeout = None
+                pending += launch()
+                continue
+            pending -= 1
+            if error is None and not self.hedge.failed(response.status_code):
+                return response
+            pending += launch()
+        # every leg failed, the last answer goes to the retry policy
+        if error is not None:
+            raise error
+        return response
+
+    def _request(self, callback, method, path, params=None, data=None,
+                 headers=None):
+        for endpoint in self.endpoints.due():
+            # requests never wait on the probe of an unresponsive agent
+            probe = threading.Thread(target=self._probe, args=(endpoint,))
+            probe.daemon = True
+            probe.start()
+        hedged = self.hedge is not None and \
+            len(self.endpoints.endpoints) > 1 and \
+            self.hedge.applies(method, path, params)
+        start = time.time()
+        attempt = 0
+        while True:
+            try:
+                if hedged:
+                    response = self._hedged(path, params, headers)
+                else:
+                    response = self._failover(
+                        method, path, params, data, headers)
+            except requests.exceptions.ConnectionError:
+                delay = self.retry_delay(attempt, method, params)
+                if delay is None:
+                    raise
+            else:
+                delay = self.retry_delay(
+                    attempt, method, params, response.status_code)
+                if delay is None:
+                    self.cache_invalidate(method, path)
+                    return callback(self.response(response.status_code,
+                                                  response.headers,
+                                                  response.content,
+                                                  time.time() - start))
+            attempt += 1
+            time.sleep(delay)
 
     def get(self, callback, path, params=None, headers=None):
-        uri = self.uri(path, params)
-        return callback(self.response(
-            self.session.get(uri,
-                             headers=headers,
-                             verify=self.verify,
-                             cert=self.cert,
-                             timeout=self.timeout)))
+        response, request = self.cache_lookup(callback, path, params, headers)
+        if response is not None:
+            if request is not None:
+                self._refresh(request, path, params, headers)
+            return callback(response)
+        return self._get(request, path, params, headers)
+
+    def _refresh(self, callback, path, params, headers):
+        # refreshes a stale cached response in the background
+        def refresh():
+            try:
+                self._get(callback, path, params, headers)
+            except Exception:
+                log.warning('consul: refreshing %s failed', path,
+                            exc_info=True)
+
+        thread = threading.Thread(target=refresh)
+        thread.daemon = True
+        thread.start()
+
+    def _get(self, callback, path, params, headers):
+        if self.coalesce is None:
+            return self._request(
+                callback, 'GET', path, params, headers=headers)
+        key = self.coalesce.key(path, params, headers)
+        flight, leader = self.coalesce.join(key, Flight)
+        if not leader:
+            return callback(flight.wait())
+        try:
+            flight.result = self._request(
+                self.raw, 'GET', path, params, headers=headers)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            self.coalesce.land(key)
+            flight.done.set()
+        return callback(flight.result)
 
     def put(self, callback, path, params=None, data='', headers=None):
-        uri = self.uri(path, params)
-        return callback(self.response(
-            self.session.put(uri,
-                             data=data,
-                             headers=headers,
-                             verify=self.verify,
-                             cert=self.cert,
-                             timeout=self.timeout)))
+        return self._request(callback, 'PUT', path, params,
+                             data=data, headers=headers)
 
     def delete(self, callback, path, params=None, data='', headers=None):
-        uri = self.uri(path, params)
-        return callback(self.response(
-            self.session.delete(uri,
-                                data=data,
-                                headers=headers,
-                                verify=self.verify,
-                                cert=self.cert,
-                                timeout=self.timeout)))
+        return self._request(callback, 'DELETE', path, params,
+                             data=data, headers=headers)
 
     def post(self, callback, path, params=None, headers=None, data=''):
-        uri = self.uri(path, params)
-        return callback(self.response(
-            self.session.post(uri,
-                              data=data,
-                              headers=headers,
-                              verify=self.verify,
-                              cert=self.cert,
-                              timeout=self.timeout)))
+        return self._request(callback, 'POST', path, params,
+                             data=data, headers=headers)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self.adapter.close()
+
+
+class Watch(base.Watch):
+    """
+    A :class:`consul.base.Watch` iterated over as a blocking generator.
+    """
+
+    errors = (base.ConsulException, requests.exceptions.RequestException)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while True:
+            try:
+                result = self.request()
+            except Exception as e:
+                delay = self.failed(e)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            if self.update(result):
+                return result
+
+    next = __next__
+
+
+class WatchManager(object):
+    """
+    Runs many watches without parking a thread per blocking query.
+
+    The blocking queries are multiplexed by a :class:`consul.aio.WatchManager`
+    on an event loop running in a single background thread, so aiohttp must
+    be installed. It talks to the same agents as *consul* with the same
+    token, datacenter and consistency. At most *concurrency* queries are in
+    flight at once; see :class:`consul.aio.WatchManager`.
+
+    Callbacks run in *workers* threads, each watch always being dispatched
+    to the same worker so that its changes are handled in order.
+    """
+
+    def __init__(self, consul, concurrency=100, workers=4, min_wait='1s'):
+        import asyncio
+        from consul import aio
+
+        http = consul.http
+        kwargs = dict(token=consul.token,
+                      dc=consul.dc,
+                      consistency=consul.consistency,
+                      verify=http.verify,
+                      cert=http.cert,
+                      codec=consul.codec,
+                      connections_limit=concurrency + 10)
+        if http.socket_path:
+            kwargs.update(host=http.socket_path, scheme='unix')
+        else:
+            kwargs['endpoints'] = [
+                e.base_uri for e in http.endpoints.endpoints]
+
+        self.loop = asyncio.new_event_loop()
+        self.consul = aio.Consul(loop=self.loop, **kwargs)
+        self.manager = aio.WatchManager(self.consul, concurrency, min_wait)
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.queues = [queue.Queue() for _ in range(workers)]
+        self.workers = [threading.Thread(target=self._work, args=(q,))
+                        for q in self.queues]
+        for worker in self.workers:
+            worker.daemon = True
+            worker.start()
+        self._count = 0
+
+    def _work(self, jobs):
+        while True:
+            callback, index, data = jobs.get()
+            if callback is None:
+                return
+            try:
+                callback(index, data)
+            except Exception:
+                log.exception('consul watch callback failed')
+
+    def _call(self, func, *args, **kwargs):
+        # runs func in the event loop thread and waits for its result
+        from concurrent.futures import Future
+        future = Future()
+
+        def call():
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+
+        self.loop.call_soon_threadsafe(call)
+        return future.result()
+
+    def _dispatcher(self, callback, endpoint, errback=None):
+        # resolves the endpoint name on the aio client and returns it along
+        # with functions queueing calls to callback and errback on a worker
+        # thread
+        call = self.consul
+        for name in endpoint.split('.'):
+            call = getattr(call, name)
+        jobs = self.queues[self._count % len(self.queues)]
+        self._count += 1
+
+        def dispatch(index, data):
+            jobs.put((callback, index, data))
+
+        def fail(error):
+            jobs.put((lambda index, data: errback(error), None, None))
+
+        return call, dispatch, fail if errback is not None else None
+
+    def watch(self, callback, endpoint, *args, **kwargs):
+        """
+        Starts watching an endpoint and returns the watch.
+
+        *endpoint* names the endpoint method, such as 'kv.get' or
+        'health.service', called with *args* and *kwargs* as
+        :class:`consul.base.Watch` does. *callback* is called with the
+        (*index*, *data*) of every change and *errback*, if passed, with the
+        error the watch stopped on.
+        """
+        call, dispatch, fail = self._dispatcher(
+            callback, endpoint, kwargs.pop('errback', None))
+        return self._call(self.manager.watch, dispatch, call, *args,
+                          errback=fail, **kwargs)
+
+    def unwatch(self, watch):
+        """
+        Stops *watch*.
+        """
+        self._call(self.manager.unwatch, watch)
+
+    def subscribe(self, callback, endpoint, *args, **kwargs):
+        """
+        Like :meth:`watch`, except that all the subscribers to identical
+        requests share a single upstream watch; see
+        :meth:`consul.aio.WatchManager.subscribe`. Returns the subscription.
+        """
+        call, dispatch, fail = self._dispatcher(
+            callback, endpoint, kwargs.pop('errback', None))
+        return self._call(self.manager.subscribe, dispatch, call, *args,
+                          errback=fail, **kwargs)
+
+    def unsubscribe(self, subscription):
+        """
+        Removes *subscription*, stopping the upstream watch if it was the
+        last subscriber.
+        """
+        self._call(self.manager.unsubscribe, subscription)
+
+    def close(self):
+        """
+        Stops every watch, the event loop and the worker threads.
+        """
+        import asyncio
+        for coro in (self.manager.close(), self.consul.close()):
+            asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        for jobs in self.queues:
+            jobs.put((None, None, None))
+        for worker in self.workers:
+            worker.join()
+
+
+class Discovery(base.Discovery):
+    """
+    A :class:`consul.base.Discovery` following each service it is asked
+    for with a blocking ``health.service`` query of *consul*, passing
+    instances only, and *kwargs* such as *dc* or *wait*.
+
+    The queries run in a thread per service, or on *manager*, a
+    :class:`WatchManager`, when there are many services. The first pick of
+    a service waits up to *timeout* seconds for its instances and raises
+    Timeout if they did not come, or the error its query stopped on, in
+    which case the next pick follows it again.
+    """
+
+    def __init__(self, consul, strategy='round_robin', timeout=10,
+                 manager=None, **kwargs):
+        super(Discovery, self).__init__(strategy)
+        self.consul = consul
+        self.timeout = timeout
+        self.manager = manager
+        self.kwargs = kwargs
+        # service -> (ready event, subscription or None, [error])
+        self.watches = {}
+        self.closed = False
+
+    def _follow(self, service, ready, errors):
+        try:
+            for index, nodes in self.consul.watch(
+                    self.consul.health.service, service, passing=True,
+                    **self.kwargs):
+                if self.closed:
+                    return
+                self.update(service, nodes)
+                ready.set()
+        except Exception as e:
+            log.exception('consul discovery of %s stopped', service)
+            self._failed(service, ready, errors, e)
+
+    def _failed(self, service, ready, errors, error):
+        # drops the watch of service so that the next pick starts another
+        with self.lock:
+            if self.watches.get(service, (None,))[0] is ready:
+                del self.watches[service]
+        errors.append(error)
+        ready.set()
+
+    def watch(self, service):
+        """
+        Starts following *service* if it is not yet, and waits for its
+        instances.
+        """
+        with self.lock:
+            watched = self.watches.get(service)
+            if watched is None:
+                ready = threading.Event()
+                errors = []
+                subscription = None
+                if self.manager is None:
+                    thread = threading.Thread(
+                        target=self._follow, args=(service, ready, errors))
+                    thread.daemon = True
+                    thread.start()
+                else:
+                    def changed(index, nodes):
+                        self.update(service, nodes)
+                        ready.set()
+
+                    def failed(error):
+                        self._failed(service, ready, errors, error)
+
+                    subscription = self.manager.subscribe(
+                        changed, 'health.service', service, passing=True,
+                        errback=failed, **self.kwargs)
+                self.watches[service] = watched = (
+                    ready, subscription, errors)
+        if not watched[0].wait(self.timeout):
+            raise base.Timeout(
+                'no answer about %s in %ss' % (service, self.timeout))
+        if watched[2]:
+            raise watched[2][0]
+
+    def pick(self, service, tag=None):
+        watched = self.watches.get(service)
+        if watched is None or not watched[0].is_set() or watched[2]:
+            # not followed yet, or still waiting for its first answer
+            self.watch(service)
+        return super(Discovery, self).pick(service, tag)
+
+    def close(self):
+        """
+        Stops following services.
+        """
+        self.closed = True
+        if self.manager is not None:
+            for ready, subscription, errors in self.watches.values():
+                if subscription is not None:
+                    self.manager.unsubscribe(subscription)
+        self.watches.clear()
+
+
+class Resolver(base.Resolver):
+    """
+    A :class:`consul.base.Resolver` querying the datacenters one after the
+    other, nearest first. The ranking is refreshed in a background thread.
+    """
+
+    errors = (base.ConsulException, requests.RequestException)
+
+    def datacenters(self):
+        """
+        Returns the datacenters, nearest first.
+        """
+        if self.ranking is None:
+            return self.update()
+        if self.stale():
+            self.refreshing = True
+            thread = threading.Thread(target=self._refresh)
+            thread.daemon = True
+            thread.start()
+        return self.ranking
+
+    def _refresh(self):
+        try:
+            self.update()
+        except Exception:
+            self.refreshing = False
+            log.exception('consul datacenter ranking failed')
+
+    def update(self):
+        """
+        Ranks the datacenters again and returns them.
+        """
+        origin = self.origin
+        if origin is None:
+            origin = self.consul.agent.self()['Config']['Datacenter']
+        return self.rank(origin, self.consul.catalog.datacenters(),
+                         self.consul.coordinate.datacenters())
+
+    def resolve(self, service, **kwargs):
+        """
+        Returns the datacenter and the passing instances of *service* in
+        the nearest datacenter which has any, or (None, []). *kwargs* are
+        passed on to ``health.service``.
+
+        Datacenters which can't be queried are skipped; when none could be,
+        the last error is raised.
+        """
+        errors = []
+        ranking = self.datacenters()
+        for dc in ranking:
+            try:
+                nodes = self.consul.health.service(
+                    service, passing=True, dc=dc, **kwargs)[1]
+            except self.errors as e:
+                log.warning('consul resolve of %s in %s failed: %s',
+                            service, dc, e)
+                errors.append(e)
+                continue
+            if nodes:
+                return dc, nodes
+        if ranking and len(errors) == len(ranking):
+            raise errors[-1]
+        return None, []
 
 
 class Consul(base.Consul):
     @staticmethod
-    def http_connect(host, port, scheme, verify=True, cert=None, timeout=None):
-        return HTTPClient(host, port, scheme, verify, cert, timeout)
+    def http_connect(host, port, scheme, verify=True, cert=None, timeout=None,
+                     **kwargs):
+        return HTTPClient(host, port, scheme, verify, cert, timeout, **kwargs)
+
+    def watch(self, call, *args, **kwargs):
+        """
+        Returns an endless iterator over the changes of an endpoint returning
+        (*index*, *data*), such as ``c.kv.get``::
+
+            for index, data in c.watch(c.kv.get, 'foo', wait='1m'):
+                print(data)
+
+        See :class:`consul.base.Watch` for the arguments.
+        """
+        return Watch(call, *args, **kwargs)
+
+    def fanout(self, call, args=(), kwargs=None, datacenters=None,
+               timeout=None, workers=16):
+        """
+        Calls the endpoint method *call* with *args* and *kwargs* in each
+        of *datacenters*, all of those of ``catalog.datacenters`` by default,
+        concurrently, at most *workers* at once, and returns a
+        :class:`consul.base.FanOut`::
+
+            fanout = c.fanout(c.health.service, ('api',), {'passing': True})
+            for dc, node in fanout.merged():
+                print(dc, node['Node']['Node'])
+
+        Each datacenter has *timeout* seconds from the moment its call
+        starts rather than from the call to fanout, so that those queued
+        behind *workers* busy ones get as long as the first. Those which
+        did not answer in time are reported as errors and their calls are
+        left to finish in the background, in a thread of their own, while
+        the next datacenter takes their place: the pool holds up to
+        *workers* threads plus one per call which timed out.
+        """
+        from concurrent.futures import (
+            FIRST_COMPLETED, ThreadPoolExecutor, wait)
+        if datacenters is None:
+            datacenters = self.catalog.datacenters()
+        kwargs = kwargs or {}
+        workers = max(workers, 1)
+        # threads are only started as calls are submitted
+        executor = ThreadPoolExecutor(max_workers=max(len(datacenters), 1))
+        queued = list(datacenters)
+        futures = {}
+        started = {}
+        # future -> datacenter of the calls which have not timed out
+        running = {}
+        expired = set()
+        while queued or running:
+            while queued and len(running) < workers:
+                dc = queued.pop(0)
+                started[dc] = time.time()
+                futures[dc] = executor.submit(call, *args, dc=dc, **kwargs)
+                running[futures[dc]] = dc
+            deadline = None
+            if timeout is not None:
+                deadline = max(min(started[dc] for dc in running.values()) +
+                               timeout - time.time(), 0)
+            wait(running, deadline, return_when=FIRST_COMPLETED)
+            now = time.time()
+            for future, dc in list(running.items()):
+                if future.done():
+                    del running[future]
+                elif timeout is not None and now - started[dc] >= timeout:
+                    expired.add(dc)
+                    del running[future]
+        executor.shutdown(wait=False)
+        outcomes = []
+        for dc in datacenters:
+            future = futures[dc]
+            if dc in expired:
+                outcomes.append((dc, None, base.FanOut.timeout(dc, timeout)))
+            elif future.exception() is not None:
+                outcomes.append((dc, None, future.exception()))
+            else:
+                outcomes.append((dc, future.result(), None))
+        return base.FanOut.collect(outcomes)
+
+    def _gather(self, calls, concurrency, done):
+        if concurrency <= 1 or len(calls) <= 1:
+            return super(Consul, self)._gather(calls, concurrency, done)
+        from concurrent.futures import ThreadPoolExecutor
+
+        def attempt(call):
+            try:
+                return call(), None
+            except Exception as e:
+                return None, e
+
+        with ThreadPoolExecutor(
+                max_workers=min(concurrency, len(calls))) as executor:
+            return done(list(executor.map(attempt, calls)))
+
+    def close(self):
+        """
+        Closes all pooled connections of this client.
+        """
+        self.http.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
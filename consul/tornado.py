@@ -1,5 +1,9 @@
 from __future__ import absolute_import
 
+import datetime
+import logging
+import time
+
 from tornado import gen
 from tornado import httpclient
 
@@ -7,37 +11,90 @@ from consul import base
 
 __all__ = ['Consul']
 
+log = logging.getLogger(__name__)
+
 
 class HTTPClient(base.HTTPClient):
     def __init__(self, *args, **kwargs):
         super(HTTPClient, self).__init__(*args, **kwargs)
+        if self.socket_path:
+            raise base.ConsulException(
+                'unix domain sockets are not supported by consul.tornado')
+        if len(self.endpoints.endpoints) > 1:
+            raise base.ConsulException(
+                'multiple endpoints are not supported by consul.tornado')
         self.client = httpclient.AsyncHTTPClient()
 
-    @staticmethod
-    def response(response):
-        return base.Response(
-            response.code,
-            response.headers,
-            response.body.decode('utf-8'),
-            response.body)
-
     @gen.coroutine
-    def _request(self, callback, request):
-        try:
-            response = yield self.client.fetch(request)
-        except httpclient.HTTPError as e:
-            if e.code == 599:
-                raise base.Timeout
-            response = e.response
-        raise gen.Return(callback(self.response(response)))
+    def _request(self, callback, request, path, params=None):
+        start = time.time()
+        attempt = 0
+        while True:
+            circuit = self.circuit_enter(path)
+            try:
+                try:
+                    response = yield self.client.fetch(request)
+                except httpclient.HTTPError as e:
+                    if e.code == 599:
+                        raise base.Timeout
+                    response = e.response
+            except Exception as e:
+                self.circuit_exit(circuit, failed=True)
+                if not isinstance(e, (IOError, OSError)):
+                    raise
+                # the connection was refused or reset
+                delay = self.retry_delay(attempt, request.method, params)
+                if delay is None:
+                    raise
+            else:
+                self.circuit_exit(circuit, failed=response.code >= 500)
+                delay = self.retry_delay(
+                    attempt, request.method, params, response.code)
+                if delay is None:
+                    self.cache_invalidate(request.method, path)
+                    raise gen.Return(callback(self.response(
+                        response.code, response.headers, response.body,
+                        time.time() - start)))
+            attempt += 1
+            yield gen.sleep(delay)
 
+    @gen.coroutine
     def get(self, callback, path, params=None, headers=None):
         uri = self.uri(path, params)
-        request = httpclient.HTTPRequest(uri,
-                                         method='GET',
-                                         validate_cert=self.verify,
-                                         headers=headers)
-        return self._request(callback, request)
+        request = httpclient.HTTPRequest(
+            uri,
+            method='GET',
+            validate_cert=self.verify,
+            headers=headers,
+            request_timeout=self.request_timeout(params))
+        response, fetch = self.cache_lookup(callback, path, params, headers)
+        if response is not None:
+            if fetch is not None:
+                # refresh the stale cached response in the background
+                self._get(fetch, request, path, params, headers) \
+                    .add_done_callback(self._refreshed)
+            raise gen.Return(callback(response))
+        result = yield self._get(fetch, request, path, params, headers)
+        raise gen.Return(result)
+
+    @staticmethod
+    def _refreshed(refresh):
+        if refresh.exception() is not None:
+            log.warning('consul: refreshing a cached response failed',
+                        exc_info=refresh.exception())
+
+    @gen.coroutine
+    def _get(self, callback, request, path, params, headers):
+        if self.coalesce is None:
+            result = yield self._request(callback, request, path, params)
+            raise gen.Return(result)
+        key = self.coalesce.key(path, params, headers)
+        flight, leader = self.coalesce.join(
+            key, lambda: self._request(self.raw, request, path, params))
+        if leader:
+            flight.add_done_callback(lambda f: self.coalesce.land(key))
+        response = yield flight
+        raise gen.Return(callback(response))
 
     def put(self, callback, path, params=None, data='', headers=None):
         uri = self.uri(path, params)
@@ -46,7 +103,7 @@ class HTTPClient(base.HTTPClient):
                                          body='' if data is None else data,
                                          validate_cert=self.verify,
                                          headers=headers)
-        return self._request(callback, request)
+        return self._request(callback, request, path, params)
 
     def delete(self, callback, path, params=None, data='', headers=None):
         uri = self.uri(path, params)
@@ -56,7 +113,7 @@ class HTTPClient(base.HTTPClient):
                                          validate_cert=self.verify,
                                          headers=headers)
         request.allow_nonstandard_methods = True
-        return self._request(callback, request)
+        return self._request(callback, request, path, params)
 
     def post(self, callback, path, params=None, data='', headers=None):
         uri = self.uri(path, params)
@@ -65,10 +122,97 @@ class HTTPClient(base.HTTPClient):
                                          body=data,
                                          validate_cert=self.verify,
                                          headers=headers)
-        return self._request(callback, request)
+        return self._request(callback, request, path, params)
+
+
+class Watch(base.Watch):
+    """
+    A :class:`consul.base.Watch` whose :meth:`next` coroutine resolves to the
+    next change.
+    """
+
+    errors = (base.ConsulException, IOError, OSError)
+
+    @gen.coroutine
+    def next(self):
+        while True:
+            try:
+                result = yield self.request()
+            except Exception as e:
+                delay = self.failed(e)
+                if delay is None:
+                    raise
+                yield gen.sleep(delay)
+                continue
+            if self.update(result):
+                raise gen.Return(result)
 
 
 class Consul(base.Consul):
     @staticmethod
     def http_connect(host, port, scheme, verify=True, cert=None):
         return HTTPClient(host, port, scheme, verify=verify, cert=cert)
+
+    def watch(self, call, *args, **kwargs):
+        """
+        Returns a watch over the changes of an endpoint returning (*index*,
+        *data*), such as ``c.kv.get``::
+
+            watch = c.watch(c.kv.get, 'foo', wait='1m')
+            while True:
+                index, data = yield watch.next()
+
+        See :class:`consul.base.Watch` for the arguments.
+        """
+        return Watch(call, *args, **kwargs)
+
+    @gen.coroutine
+    def fanout(self, call, args=(), kwargs=None, datacenters=None,
+               timeout=None):
+        """
+        Calls the endpoint method *call* with *args* and *kwargs* in each
+        of *datacenters*, all of those of ``catalog.datacenters`` by default,
+        concurrently, and resolves to a :class:`consul.base.FanOut`.
+        Datacenters which did not answer within *timeout* seconds are
+        reported as errors.
+        """
+        if datacenters is None:
+            datacenters = yield self.catalog.datacenters()
+        kwargs = kwargs or {}
+
+        @gen.coroutine
+        def one(dc):
+            try:
+                future = call(*args, dc=dc, **kwargs)
+                if timeout is not None:
+                    future = gen.with_timeout(
+                        datetime.timedelta(seconds=timeout), future)
+                result = yield future
+            except gen.TimeoutError:
+                outcome = dc, None, base.FanOut.timeout(dc, timeout)
+            except Exception as e:
+                outcome = dc, None, e
+            else:
+                outcome = dc, result, None
+            raise gen.Return(outcome)
+
+        outcomes = yield [one(dc) for dc in datacenters]
+        raise gen.Return(base.FanOut.collect(outcomes))
+
+    @gen.coroutine
+    def _gather(self, calls, concurrency, done):
+        calls = list(calls)
+        outcomes = [None] * len(calls)
+
+        @gen.coroutine
+        def worker():
+            while calls:
+                i = len(outcomes) - len(calls)
+                call = calls.pop(0)
+                try:
+                    outcomes[i] = (yield call()), None
+                except Exception as e:
+                    outcomes[i] = None, e
+
+        yield [worker() for _ in range(max(min(concurrency, len(calls)), 1))]
+        raise gen.Return(done(outcomes))
@@ -1,12 +1,16 @@
 from __future__ import absolute_import
 
 from six import b
+from six.moves import urllib
 # noinspection PyUnresolvedReferences
 from treq.client import HTTPClient as TreqHTTPClient
-from twisted.internet import reactor
-from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet import reactor, task
+from twisted.internet.defer import (
+    DeferredList, DeferredSemaphore, TimeoutError, inlineCallbacks,
+    maybeDeferred, returnValue)
 from twisted.internet.error import ConnectError
 from twisted.internet.ssl import ClientContextFactory
+from twisted.python import log
 from twisted.web._newclient import \
     ResponseNeverReceived, RequestTransmissionFailed
 from twisted.web.client import Agent, HTTPConnectionPool
@@ -34,6 +38,12 @@ class InsecureContextFactory(ClientContextFactory):
 class HTTPClient(base.HTTPClient):
     def __init__(self, contextFactory, *args, **kwargs):
         super(HTTPClient, self).__init__(*args, **kwargs)
+        if self.socket_path:
+            raise ConsulException(
+                'unix domain sockets are not supported by consul.twisted')
+        if len(self.endpoints.endpoints) > 1:
+            raise ConsulException(
+                'multiple endpoints are not supported by consul.twisted')
         agent_kwargs = dict(
             reactor=reactor, pool=HTTPConnectionPool(reactor))
         if contextFactory is not None:
@@ -46,10 +56,6 @@ class HTTPClient(base.HTTPClient):
 
         self.client = TreqHTTPClient(Agent(**agent_kwargs))
 
-    @staticmethod
-    def response(code, headers, text, content):
-        return base.Response(code, headers, text, content)
-
     @staticmethod
     def compat_string(value):
         """
@@ -69,9 +75,8 @@ class HTTPClient(base.HTTPClient):
             (self.compat_string(k), ','.join(map(self.compat_string, v)))
             for k, v in dict(response.headers.getAllRawHeaders()).items()
         ])
-        body = yield response.text(encoding='utf-8')
         content = yield response.content()
-        returnValue((response.code, headers, body, content))
+        returnValue((response.code, headers, content))
 
     @inlineCallbacks
     def request(self, callback, method, url, **kwargs):
@@ -81,10 +86,34 @@ class HTTPClient(base.HTTPClient):
             kwargs['data'] = data.encode(encoding='utf-8') \
                 if hasattr(data, 'encode') else b(data)
 
+        split = urllib.parse.urlsplit(url)
+        params = urllib.parse.parse_qsl(split.query)
+        start = reactor.seconds()
+        attempt = 0
         try:
-            response = yield self.client.request(method, url, **kwargs)
-            parsed = yield self._get_resp(response)
-            returnValue(callback(self.response(*parsed)))
+            while True:
+                circuit = self.circuit_enter(split.path)
+                try:
+                    response = yield self.client.request(method, url, **kwargs)
+                    parsed = yield self._get_resp(response)
+                except Exception as e:
+                    self.circuit_exit(circuit, failed=True)
+                    if not isinstance(e, (ConnectError,
+                                          ResponseNeverReceived)):
+                        raise
+                    delay = self.retry_delay(attempt, method, params)
+                    if delay is None:
+                        raise
+                else:
+                    self.circuit_exit(circuit, failed=parsed[0] >= 500)
+                    delay = self.retry_delay(
+                        attempt, method, params, parsed[0])
+                    if delay is None:
+                        self.cache_invalidate(method, split.path)
+                        returnValue(callback(self.response(
+                            *parsed, elapsed=reactor.seconds() - start)))
+                attempt += 1
+                yield task.deferLater(reactor, delay, lambda: None)
         except ConnectError as e:
             raise ConsulException(
                 '{}: {}'.format(e.__class__.__name__, e.message))
@@ -102,7 +131,18 @@ class HTTPClient(base.HTTPClient):
     @inlineCallbacks
     def get(self, callback, path, params=None, headers=None):
         uri = self.uri(path, params)
-        response = yield self.request(callback,
+        cached, request = self.cache_lookup(callback, path, params, headers)
+        if cached is not None:
+            if request is not None:
+                # refresh the stale cached response in the background
+                self.request(request,
+                             'get',
+                             uri,
+                             params=params,
+                             headers=headers).addErrback(
+                    log.err, 'consul: refreshing %s failed' % path)
+            returnValue(callback(cached))
+        response = yield self.request(request,
                                       'get',
                                       uri,
                                       params=params,
@@ -141,6 +181,27 @@ class HTTPClient(base.HTTPClient):
         returnValue(response)
 
 
+class Watch(base.Watch):
+    """
+    A :class:`consul.base.Watch` whose :meth:`next` returns a Deferred firing
+    with the next change.
+    """
+
+    @inlineCallbacks
+    def next(self):
+        while True:
+            try:
+                result = yield self.request()
+            except Exception as e:
+                delay = self.failed(e)
+                if delay is None:
+                    raise
+                yield task.deferLater(reactor, delay, lambda: None)
+                continue
+            if self.update(result):
+                returnValue(result)
+
+
 class Consul(base.Consul):
     @staticmethod
     def http_connect(host,
@@ -153,3 +214,54 @@ class Consul(base.Consul):
         return HTTPClient(
             contextFactory, host, port, scheme, verify=verify, cert=cert,
             **kwargs)
+
+    def watch(self, call, *args, **kwargs):
+        """
+        Returns a watch over the changes of an endpoint returning (*index*,
+        *data*), such as ``c.kv.get``::
+
+            watch = c.watch(c.kv.get, 'foo', wait='1m')
+            while True:
+                index, data = yield watch.next()
+
+        See :class:`consul.base.Watch` for the arguments.
+        """
+        return Watch(call, *args, **kwargs)
+
+    @inlineCallbacks
+    def fanout(self, call, args=(), kwargs=None, datacenters=None,
+               timeout=None):
+        """
+        Calls the endpoint method *call* with *args* and *kwargs* in each
+        of *datacenters*, all of those of ``catalog.datacenters`` by default,
+        concurrently, and returns a Deferred firing with a
+        :class:`consul.base.FanOut`. Datacenters which did not answer within
+        *timeout* seconds are reported as errors.
+        """
+        if datacenters is None:
+            datacenters = yield self.catalog.datacenters()
+        kwargs = kwargs or {}
+        deferreds = []
+        for dc in datacenters:
+            d = maybeDeferred(call, *args, dc=dc, **kwargs)
+            if timeout is not None:
+                d.addTimeout(timeout, reactor)
+            deferreds.append(d)
+        answers = yield DeferredList(deferreds, consumeErrors=True)
+        outcomes = []
+        for dc, (success, value) in zip(datacenters, answers):
+            if success:
+                outcomes.append((dc, value, None))
+            elif value.check(TimeoutError):
+                outcomes.append((dc, None, base.FanOut.timeout(dc, timeout)))
+            else:
+                outcomes.append((dc, None, value.value))
+        returnValue(base.FanOut.collect(outcomes))
+
+    @inlineCallbacks
+    def _gather(self, calls, concurrency, done):
+        slots = DeferredSemaphore(max(concurrency, 1))
+        answers = yield DeferredList(
+            [slots.run(call) for call in calls], consumeErrors=True)
+        returnValue(done([(value, None) if success else (None, value.value)
+                          for success, value in answers]))
@@ -7,12 +7,14 @@ import socket
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 import uuid
 
 import py
 import pytest
 import requests
+from six.moves import BaseHTTPServer, socketserver, urllib
 
 collect_ignore = []
 sys.path.insert(0,
@@ -222,3 +224,120 @@ def acl_consul_policy_allow(acl_consul_policy_allow_instance):
     port, token = acl_consul_policy_allow_instance
     yield ACLConsul(port, token)
     clean_consul(port)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn,
+                     socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class AgentHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        time.sleep(getattr(self.server, 'delay', 0))
+        if getattr(self.server, 'failures', 0):
+            self.server.failures -= 1
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+        if 'index' in query:
+            # park blocking queries briefly, as if nothing changed
+            time.sleep(0.1)
+        if self.path == '/v1/status/peers':
+            body = json.dumps(['127.0.0.2:8300', '127.0.0.3:8300'])
+        else:
+            body = json.dumps({'path': self.path})
+        headers = {}
+        if 'cached' in urllib.parse.urlsplit(self.path).query:
+            headers = {'X-Cache': 'HIT', 'Age': '3'}
+        self.reply(body, headers)
+
+    def do_PUT(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.reply('true')
+
+    def reply(self, body, headers=None):
+        body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-Consul-Index', '1')
+        self.send_header('X-Consul-KnownLeader', 'true')
+        self.send_header('X-Consul-LastContact', '0')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        return 'unix'
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def unix_agent():
+    """
+    A minimal agent listening on a unix domain socket, answering every GET
+    with the requested path and every PUT with true
+    """
+    path = os.path.join(tempfile.mkdtemp(), 'consul.sock')
+    server = UnixHTTPServer(path, AgentHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield path
+    server.shutdown()
+    server.server_close()
+    os.remove(path)
+
+
+class TCPHTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def serve_tcp_agent(delay=0, failures=0):
+    server = TCPHTTPServer(('127.0.0.1', 0), AgentHandler)
+    server.delay = delay
+    server.failures = failures
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+@pytest.fixture
+def tcp_agent():
+    """
+    The same minimal agent as *unix_agent* listening on a local TCP port
+    """
+    server = serve_tcp_agent()
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def slow_tcp_agent():
+    """
+    A *tcp_agent* taking a second to answer every request
+    """
+    server = serve_tcp_agent(delay=1)
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def flaky_tcp_agent():
+    """
+    A *tcp_agent* answering its first two requests with a 503
+    """
+    server = serve_tcp_agent(failures=2)
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
@@ -2,13 +2,14 @@ import asyncio
 import base64
 import collections
 import json
+import socket
 import struct
 import sys
 
 import aiohttp
 import pytest
 import six
-from pytest_httpserver import RequestHandler
+from pytest_httpserver import HTTPServer, RequestHandler
 
 import consul
 import consul.aio
@@ -41,6 +42,15 @@ async def local_timeout_server(httpserver):
     return LocalServer(httpserver.port, httpserver)
 
 
+@pytest.fixture
+def agent_server():
+    server = HTTPServer()
+    server.start()
+    yield server
+    server.clear()
+    server.stop()
+
+
 @pytest.fixture
 def loop(request):
     asyncio.set_event_loop(None)
@@ -300,3 +310,339 @@ class TestAsyncioConsul(object):
             ...
 
         loop.run_until_complete(test_session_close())
+
+    def test_http_session_reused(self, loop, agent_server):
+        httpserver = agent_server
+        httpserver.expect_request('/v1/agent/services').respond_with_json(
+            {"foo": "bar"})
+
+        async def main():
+            async with consul.aio.Consul(port=httpserver.port, loop=loop,
+                                         connections_limit=5) as c:
+                assert await c.agent.services() == {"foo": "bar"}
+                session = c.http._session
+                assert session.connector.limit == 5
+                assert await c.agent.services() == {"foo": "bar"}
+                assert c.http._session is session
+            assert session.closed
+
+        loop.run_until_complete(main())
+
+    def test_unix_socket(self, loop, unix_agent):
+        async def main():
+            async with consul.aio.Consul(host=unix_agent, scheme='unix',
+                                         loop=loop) as c:
+                assert isinstance(c.http.session.connector,
+                                  aiohttp.UnixConnector)
+                assert await c.agent.self() == {'path': '/v1/agent/self'}
+
+        loop.run_until_complete(main())
+
+    def test_endpoints_failover(self, loop, tcp_agent):
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.bind(('127.0.0.1', 0))
+        dead = s.getsockname()[1]
+        s.close()
+
+        async def main():
+            async with consul.aio.Consul(
+                    endpoints=['127.0.0.1:%s' % dead,
+                               '127.0.0.1:%s' % tcp_agent],
+                    loop=loop) as c:
+                for _ in range(3):
+                    assert await c.agent.self() == {'path': '/v1/agent/self'}
+                down, up = c.http.endpoints.endpoints
+                assert down.ejected
+                assert not up.ejected
+
+        loop.run_until_complete(main())
+
+    def test_hedge(self, loop, tcp_agent, slow_tcp_agent):
+        async def main():
+            async with consul.aio.Consul(
+                    endpoints=['127.0.0.1:%s' % slow_tcp_agent,
+                               '127.0.0.1:%s' % tcp_agent],
+                    hedge=consul.base.HedgePolicy(delay=0.05),
+                    loop=loop) as c:
+                slow, fast = c.http.endpoints.endpoints
+                c.http.endpoints.responded(slow, 0.001)
+                c.http.endpoints.responded(fast, 0.01)
+
+                start = loop.time()
+                index, data = await c.health.service(
+                    'foo', consistency='stale')
+                assert loop.time() - start < 0.5
+                assert data == {'path': '/v1/health/service/foo?stale=1'}
+                assert len(c.http.hedge.samples) == 1
+
+        loop.run_until_complete(main())
+
+    def test_hedge_failed_status(self, loop, flaky_tcp_agent, slow_tcp_agent):
+        async def main():
+            async with consul.aio.Consul(
+                    endpoints=['127.0.0.1:%s' % flaky_tcp_agent,
+                               '127.0.0.1:%s' % slow_tcp_agent],
+                    hedge=consul.base.HedgePolicy(delay=5),
+                    loop=loop) as c:
+                flaky, slow = c.http.endpoints.endpoints
+                c.http.endpoints.responded(flaky, 0.001)
+                c.http.endpoints.responded(slow, 0.01)
+
+                # the fast 503 does not win over the slow 200
+                index, data = await c.health.service(
+                    'foo', consistency='stale')
+                assert data == {'path': '/v1/health/service/foo?stale=1'}
+
+        loop.run_until_complete(main())
+
+    def test_coalesce(self, loop, slow_tcp_agent):
+        async def main():
+            async with consul.aio.Consul(port=slow_tcp_agent,
+                                         coalesce=True,
+                                         loop=loop) as c:
+                results = await asyncio.gather(
+                    *[c.catalog.nodes() for _ in range(5)])
+                assert results == [('1', {'path': '/v1/catalog/nodes'})] * 5
+                assert c.http.coalesce.coalesced == 4
+                assert not c.http.coalesce.flights
+
+        loop.run_until_complete(main())
+
+    def test_coalesce_callbacks(self, loop, slow_tcp_agent):
+        async def main():
+            async with consul.aio.Consul(port=slow_tcp_agent,
+                                         coalesce=True,
+                                         loop=loop) as c:
+                index, since = await asyncio.gather(
+                    c.catalog.nodes(index='1'),
+                    c.catalog.nodes(index=consul.base.Index('1')))
+                assert c.http.coalesce.coalesced == 1
+                assert index == ('1', {'path': '/v1/catalog/nodes?index=1'})
+                assert since[1] is consul.base.UNCHANGED
+
+        loop.run_until_complete(main())
+
+    def test_cache(self, loop, tcp_agent):
+        async def main():
+            async with consul.aio.Consul(port=tcp_agent, cache=True,
+                                         loop=loop) as c:
+                for _ in range(2):
+                    data = await c.catalog.datacenters()
+                    assert data == {'path': '/v1/catalog/datacenters'}
+                assert c.http.cache.hits == 1
+
+        loop.run_until_complete(main())
+
+    def test_retry(self, loop, flaky_tcp_agent):
+        async def main():
+            async with consul.aio.Consul(port=flaky_tcp_agent,
+                                         loop=loop) as c:
+                with pytest.raises(consul.ConsulException):
+                    await c.agent.self()
+
+            retry = consul.base.RetryPolicy(backoff=0.001)
+            async with consul.aio.Consul(port=flaky_tcp_agent, retry=retry,
+                                         loop=loop) as c:
+                assert await c.agent.self() == {'path': '/v1/agent/self'}
+
+        loop.run_until_complete(main())
+
+    def test_blocking_timeout(self, loop, slow_tcp_agent):
+        async def main():
+            async with consul.aio.Consul(port=slow_tcp_agent,
+                                         loop=loop) as c:
+                # a session timing out before the agent answers
+                c.http._session = aiohttp.ClientSession(
+                    connector=c.http._connector(),
+                    timeout=aiohttp.ClientTimeout(total=0.5))
+                with pytest.raises(asyncio.TimeoutError):
+                    await c.catalog.nodes()
+                # blocking queries are given their wait and some
+                index, data = await c.catalog.nodes(index=1, wait='1s')
+                assert data == {
+                    'path': '/v1/catalog/nodes?index=1&wait=1s'}
+
+        loop.run_until_complete(main())
+
+    def test_watch(self, loop):
+        results = [consul.Timeout(), ('1', 'a'), ('2', 'a'), ('3', 'b')]
+
+        async def call(key, index=None, wait=None):
+            result = results.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        async def main():
+            async with consul.aio.Consul(loop=loop) as c:
+                watch = c.watch(call, 'foo')
+                watch.backoff = 0.001
+                changes = []
+                async for index, data in watch:
+                    changes.append(data)
+                    if len(changes) == 2:
+                        break
+                assert changes == ['a', 'b']
+
+        loop.run_until_complete(main())
+
+    def test_subscribe(self, loop):
+        calls = []
+
+        async def call(key, index=None, wait=None):
+            calls.append(index)
+            if index:
+                await asyncio.sleep(10)
+            return '1', key
+
+        async def main():
+            async with consul.aio.Consul(loop=loop) as c:
+                manager = consul.aio.WatchManager(c)
+                one, two = asyncio.Queue(), asyncio.Queue()
+                a = manager.subscribe(
+                    lambda *args: one.put_nowait(args), call, 'foo')
+                assert await one.get() == ('1', 'foo')
+
+                async def second(index, data):
+                    await two.put((index, data))
+
+                b = manager.subscribe(second, call, 'foo')
+                assert await two.get() == ('1', 'foo')
+                assert len(manager.watches) == 1
+                manager.unsubscribe(a)
+                manager.unsubscribe(b)
+                assert len(manager.watches) == 0
+                await manager.close()
+                assert calls[0] is None
+
+        loop.run_until_complete(main())
+
+    def test_discovery(self, loop):
+        async def service(name, index=None, wait=None, passing=None):
+            if index:
+                await asyncio.sleep(10)
+            node = {'Node': {'Node': 'n1', 'Address': '10.0.0.1'},
+                    'Service': {'ID': name, 'Port': 80, 'Tags': []}}
+            return '1', [node]
+
+        async def main():
+            async with consul.aio.Consul(loop=loop) as c:
+                c.health.service = service
+                discovery = consul.aio.Discovery(c)
+                with pytest.raises(consul.NotFound):
+                    discovery.pick('api')
+                await discovery.watch('api')
+                assert discovery.pick('api').port == 80
+                discovery.close()
+                assert len(discovery.manager.watches) == 0
+                with pytest.raises(consul.NotFound):
+                    discovery.pick('api')
+                await discovery.manager.close()
+
+        async def denied(name, index=None, wait=None, passing=None):
+            raise consul.ACLPermissionDenied()
+
+        async def slow(name, index=None, wait=None, passing=None):
+            await asyncio.sleep(10)
+
+        async def failing():
+            async with consul.aio.Consul(loop=loop) as c:
+                c.health.service = denied
+                discovery = consul.aio.Discovery(c)
+                with pytest.raises(consul.ACLPermissionDenied):
+                    await discovery.watch('api')
+                assert 'api' not in discovery.watches
+                assert len(discovery.manager.watches) == 0
+                # the next call watches it again
+                c.health.service = service
+                await discovery.watch('api')
+                assert discovery.pick('api').port == 80
+                discovery.close()
+
+                c.health.service = slow
+                discovery = consul.aio.Discovery(c, timeout=0.1)
+                with pytest.raises(consul.Timeout):
+                    await discovery.watch('db')
+                discovery.close()
+                await discovery.manager.close()
+
+        loop.run_until_complete(main())
+        loop.run_until_complete(failing())
+
+    def test_resolver(self, loop):
+        calls = []
+
+        async def datacenters():
+            return ['dc1', 'dc2', 'dc3']
+
+        async def coordinates():
+            return [{'Datacenter': dc, 'Coordinates': [{'Node': 's', 'Coord': {
+                'Vec': vec, 'Height': 0, 'Adjustment': 0}}]}
+                for dc, vec in (('dc1', [0, 0]), ('dc2', [0.05, 0]),
+                                ('dc3', [0.01, 0]))]
+
+        async def service(name, passing=None, dc=None):
+            calls.append(dc)
+            if dc == 'dc3':
+                raise consul.Timeout()
+            return '1', [{'Node': {'Node': 'n2'}}] if dc == 'dc2' else []
+
+        async def main():
+            async with consul.aio.Consul(loop=loop, dc='dc1') as c:
+                c.catalog.datacenters = datacenters
+                c.coordinate.datacenters = coordinates
+                c.health.service = service
+                resolver = consul.aio.Resolver(c)
+                dc, nodes = await resolver.resolve('api')
+                assert (dc, len(nodes)) == ('dc2', 1)
+                assert calls[0] == 'dc1'
+                assert sorted(calls[1:]) == ['dc2', 'dc3']
+                assert resolver.ranking == ['dc1', 'dc3', 'dc2']
+
+        loop.run_until_complete(main())
+
+    def test_fanout(self, loop, tcp_agent):
+        async def main():
+            async with consul.aio.Consul(port=tcp_agent, loop=loop) as c:
+                async def nodes(dc=None):
+                    if dc == 'dc3':
+                        raise consul.ACLPermissionDenied()
+                    if dc == 'dc4':
+                        await asyncio.sleep(5)
+                    return await c.catalog.nodes(dc=dc)
+
+                fanout = await c.fanout(
+                    nodes, datacenters=['dc1', 'dc2', 'dc3', 'dc4'],
+                    timeout=0.5)
+                assert fanout.merged() == [
+                    ('dc1', {'path': '/v1/catalog/nodes?dc=dc1'}),
+                    ('dc2', {'path': '/v1/catalog/nodes?dc=dc2'})]
+                assert isinstance(
+                    fanout.errors['dc3'], consul.ACLPermissionDenied)
+                assert isinstance(fanout.errors['dc4'], consul.Timeout)
+
+        loop.run_until_complete(main())
+
+    def test_put_many(self, loop, tcp_agent):
+        async def main():
+            async with consul.aio.Consul(port=tcp_agent, loop=loop) as c:
+                keys = ['bulk/%d' % i for i in range(150)]
+                result = await c.kv.put_many(
+                    [(key, 'v') for key in keys], concurrency=2)
+                assert result.ok and result.applied == keys
+
+        loop.run_until_complete(main())
+
+    def test_breaker(self, loop, flaky_tcp_agent):
+        async def main():
+            breaker = consul.base.CircuitBreaker(failure_threshold=2)
+            async with consul.aio.Consul(port=flaky_tcp_agent,
+                                         breaker=breaker,
+                                         loop=loop) as c:
+                for _ in range(2):
+                    with pytest.raises(consul.ConsulException):
+                        await c.agent.self()
+                with pytest.raises(consul.CircuitOpen):
+                    await c.agent.self()
+
+        loop.run_until_complete(main())
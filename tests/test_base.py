@@ -45,6 +45,8 @@ def _should_support(c):
         c.catalog.services,
         lambda **kw: c.catalog.node('foo', **kw),
         lambda **kw: c.catalog.service('foo', **kw),
+        # health
+        lambda **kw: c.health.service('foo', **kw),
         # session
         c.session.list,
         lambda **kw: c.session.info('foo', **kw),
@@ -74,6 +76,37 @@ def _should_support_meta(c):
     )
 
 
+def _should_support_cached(c):
+    return (
+        # catalog
+        c.catalog.services,
+        # health
+        lambda **kw: c.health.service('foo', **kw),
+        # query
+        lambda **kw: c.query.execute('foo', **kw),
+    )
+
+
+def _should_support_filter(c):
+    return (
+        # agent
+        c.agent.services,
+        c.agent.checks,
+        # catalog
+        c.catalog.nodes,
+        c.catalog.services,
+        lambda **kw: c.catalog.service('foo', **kw),
+        lambda **kw: c.catalog.node('foo', **kw),
+        # session
+        c.session.list,
+        # health
+        lambda **kw: c.health.service('foo', **kw),
+        lambda **kw: c.health.checks('foo', **kw),
+        lambda **kw: c.health.state('any', **kw),
+        lambda **kw: c.health.node('foo', **kw),
+    )
+
+
 class TestIndex(object):
     """
     Tests read requests that should support blocking on an index
@@ -128,6 +161,49 @@ class TestNodemeta(object):
             assert r1 == r2
 
 
+class TestFilter(object):
+    """
+    Tests read requests that should support consistency modes and filtering
+    on the servers
+    """
+
+    def test_filter(self):
+        c = Consul()
+        for r in _should_support_filter(c):
+            assert r().params == []
+            assert r(filter='Service.Port == 80').params == \
+                [('filter', 'Service.Port == 80')]
+            port = consul.base.Selector('Service.Port')
+            assert r(filter=port != 80).params == \
+                [('filter', 'Service.Port != 80')]
+
+    def test_consistency(self):
+        c = Consul()
+        for r in _should_support_filter(c)[2:]:
+            assert r(consistency='stale', max_stale=1).params == \
+                [('stale', '1'), ('max_stale', '1000ms')]
+
+    def test_builder(self):
+        Selector = consul.base.Selector
+        port, tags = Selector('Service.Port'), Selector('Service.Tags')
+        meta = Selector('Node.Meta.consul-network-segment')
+        assert str((port == 8080) & tags.not_contains('canary')) == \
+            'Service.Port == 8080 and "canary" not in Service.Tags'
+        assert str(~((port == 1) | meta.is_empty()) & (port != 1.5)) == \
+            'not (Service.Port == 1 or Node.Meta.consul-network-segment ' \
+            'is empty) and Service.Port != 1.5'
+        assert str(Selector('Node.Node').matches('a"b\\')) == \
+            'Node.Node matches "a\\"b\\\\"'
+        assert str(tags.contains(b'v2')) == '"v2" in Service.Tags'
+        with pytest.raises(ValueError):
+            Selector('Service.Port == 1 or 1')
+
+    def test_tags(self):
+        c = Consul()
+        assert c.health.service('foo', tag=['a', 'b']).params == \
+            [('tag', 'a'), ('tag', 'b')]
+
+
 class TestMeta(object):
     """
     Tests read requests that should support meta
@@ -140,8 +216,797 @@ class TestMeta(object):
             assert sorted(d['meta']) == sorted({'env': 'prod', 'net': 1})
 
 
+class TestCached(object):
+    """
+    Tests read requests that should support the agent's cache
+    """
+
+    def test_cached(self):
+        c = Consul()
+        for r in _should_support_cached(c):
+            assert r().params == []
+            assert r(cached=True).params == [('cached', '')]
+            assert 'Cache-Control' not in r(cached=True).headers
+            request = r(max_age='1m', stale_if_error=30)
+            assert request.params == [('cached', '')]
+            assert request.headers['Cache-Control'] == \
+                'max-age=60, stale-if-error=30'
+
+
+class TestQueryMeta(object):
+    """
+    Tests read requests that should support query metadata
+    """
+
+    def test_max_stale(self):
+        c = Consul()
+        for r in _should_support(c):
+            assert r(max_stale='5s').params == [('max_stale', '5000ms')]
+
+    def test_meta(self):
+        response = Response(200, {'X-Consul-Index': '5',
+                                  'X-Consul-LastContact': '12',
+                                  'X-Consul-KnownLeader': 'true'},
+                            content=b'[]', elapsed=0.5)
+        assert CB.json(index=True, meta=True)(response) == (
+            consul.base.QueryMeta('5', 12, True, None, None, None, 0.5), [])
+        watch = consul.base.Watch(None)
+        assert watch.update(CB.json(index=True, meta=True)(response))
+        assert watch.index == 5
+
+
+class TestResponse(object):
+
+    def test_body_is_decoded_lazily(self):
+        response = Response(200, {}, content=u'caf\xe9'.encode('utf-8'))
+        assert response._body is None
+        assert response.body == u'caf\xe9'
+        assert response.body is response.body
+
+    def test_json_from_content(self):
+        response = Response(200, {}, content=b'{"foo": [1, 2]}')
+        assert response.json() == {'foo': [1, 2]}
+        assert response._body is None
+
+    def test_json_from_body(self):
+        response = Response(200, {}, '{"foo": "bar"}', None)
+        assert response.json() == {'foo': 'bar'}
+
+
+class TestCodec(object):
+
+    def test_default(self):
+        codec = consul.base.get_codec()
+        try:
+            import orjson  # noqa
+        except ImportError:
+            assert codec.name == 'json'
+        else:
+            assert codec.name == 'orjson'
+
+    @pytest.mark.parametrize('name', ['json', 'orjson', 'ujson'])
+    def test_roundtrip(self, name):
+        try:
+            codec = consul.base.get_codec(name)
+        except ImportError:
+            pytest.skip('%s is not installed' % name)
+        payload = {'Service': 'foo', 'Tags': ['a', u'\xe9'], 'Port': 80}
+        encoded = codec.dumps(payload)
+        assert json.loads(encoded) == payload
+        assert codec.loads(json.dumps(payload).encode('utf-8')) == payload
+
+    def test_unknown(self):
+        with pytest.raises(consul.ConsulException):
+            consul.base.get_codec('yaml')
+
+    def test_custom(self):
+        class Codec(consul.base.JSONCodec):
+            def loads(self, data):
+                return 'decoded'
+
+        c = Consul(codec=Codec())
+        assert c.codec is c.http.codec
+        response = Response(200, {}, content=b'{}', codec=c.codec)
+        assert CB.json()(response) == 'decoded'
+
+    def test_payloads(self):
+        c = Consul(codec='json')
+        data = c.agent.service.register('foo', tags=['a']).data
+        assert data == json.dumps({'name': 'foo', 'tags': ['a']})
+
+
+class TestEndpointPool(object):
+
+    def test_parse(self):
+        pool = consul.base.EndpointPool(
+            ['10.0.0.1:8500', 'https://10.0.0.2:8501', ('10.0.0.3', 8500)])
+        assert [e.base_uri for e in pool.endpoints] == [
+            'http://10.0.0.1:8500',
+            'https://10.0.0.2:8501',
+            'http://10.0.0.3:8500']
+        assert pool.add('10.0.0.1:8500') is pool.endpoints[0]
+        assert pool.add('10.0.0.4', 8500).address == '10.0.0.4:8500'
+
+    def test_select(self):
+        pool = consul.base.EndpointPool(['a:1', 'b:1'])
+        a, b = pool.endpoints
+        pool.responded(a, 0.1)
+        pool.responded(b, 0.01)
+        assert pool.select() is b
+        assert pool.select(exclude=[b]) is a
+        assert pool.select(exclude=[a, b]) is None
+
+        pool.responded(b, 0.01, error=True)
+        assert b.error_rate > 0
+        assert pool.select() is a
+
+    def test_eject(self):
+        now = [0]
+        pool = consul.base.EndpointPool(
+            ['a:1', 'b:1'], max_failures=2, eject_time=10,
+            clock=lambda: now[0])
+        a, b = pool.endpoints
+        pool.failed(a)
+        assert not a.ejected
+        pool.failed(a)
+        assert a.ejected
+        assert pool.select() is b
+        assert pool.due() == []
+
+        now[0] = 10
+        assert pool.due() == [a]
+        assert pool.due() == []
+        pool.responded(a)
+        assert not a.ejected
+        assert a.failures == 0
+
+    def test_all_ejected(self):
+        now = [0]
+        pool = consul.base.EndpointPool(['a:1', 'b:1'], clock=lambda: now[0])
+        a, b = pool.endpoints
+        pool.failed(b)
+        now[0] = 1
+        pool.failed(a)
+        assert pool.select() is b
+
+
+class TestHedgePolicy(object):
+
+    def test_applies(self):
+        hedge = consul.base.HedgePolicy()
+        assert hedge.applies('GET', '/v1/health/service/foo', [('stale', 1)])
+        assert hedge.applies('GET', '/v1/kv/foo', {'stale': 1})
+        assert not hedge.applies('GET', '/v1/kv/foo', [])
+        assert not hedge.applies(
+            'GET', '/v1/kv/foo', [('stale', 1), ('index', 5)])
+        assert not hedge.applies('PUT', '/v1/kv/foo', [('stale', 1)])
+        assert not hedge.applies('GET', '/v1/agent/self', [('stale', 1)])
+
+    def test_delay(self):
+        hedge = consul.base.HedgePolicy(min_samples=10, max_delay=1)
+        assert hedge.delay() == 1
+        for i in range(1, 101):
+            hedge.record(i / 1000.0)
+        assert hedge.delay() == 0.095
+
+        assert consul.base.HedgePolicy(delay=0.01).delay() == 0.01
+
+
+class TestRetryPolicy(object):
+
+    def test_retryable(self):
+        retry = consul.base.RetryPolicy()
+        assert retry.retryable('GET')
+        assert retry.retryable('get', [('index', 1)])
+        assert retry.retryable('PUT', [('cas', 0)])
+        assert not retry.retryable('PUT', [('flags', 1)])
+        assert not retry.retryable('DELETE', [('cas', 0)])
+        assert not retry.retryable('POST')
+
+    def test_delay(self):
+        retry = consul.base.RetryPolicy(retries=3, backoff=0.1)
+        assert retry.delay(0, 'GET', status=200) is None
+        assert retry.delay(0, 'GET', status=404) is None
+        assert 0 <= retry.delay(0, 'GET', status=503) <= 0.1
+        assert 0 <= retry.delay(2, 'GET') <= 0.4
+        assert retry.delay(3, 'GET') is None
+        assert retry.delay(0, 'PUT', status=503) is None
+
+    def test_budget(self):
+        retry = consul.base.RetryPolicy(retries=10, budget=0.5, burst=2)
+        assert retry.delay(0, 'GET') is not None
+        assert retry.delay(1, 'GET') is not None
+        assert retry.delay(2, 'GET') is None
+        # every request earns half a retry
+        assert retry.delay(0, 'GET') is None
+        assert retry.delay(0, 'GET') is not None
+        assert retry.delay(1, 'GET') is None
+
+
+class TestCircuitBreaker(object):
+
+    def test_family(self):
+        family = consul.base.CircuitBreaker.family
+        assert family('/v1/kv/foo/bar') == 'kv'
+        assert family('/v1/health/service/foo') == 'health'
+
+    def test_transitions(self):
+        now = [0]
+        transitions = []
+        breaker = consul.base.CircuitBreaker(
+            failure_threshold=2,
+            reset_timeout=10,
+            listener=lambda *args: transitions.append(args),
+            clock=lambda: now[0])
+        key = ('127.0.0.1:8500', 'kv')
+
+        for _ in range(2):
+            breaker.acquire(key)
+            breaker.release(key, failed=True)
+        assert breaker.state(key) == 'open'
+        pytest.raises(consul.base.CircuitOpen, breaker.acquire, key)
+
+        now[0] = 10
+        breaker.acquire(key)
+        assert breaker.state(key) == 'half-open'
+        pytest.raises(consul.base.CircuitOpen, breaker.acquire, key)
+        breaker.release(key, failed=True)
+        assert breaker.state(key) == 'open'
+
+        now[0] = 20
+        breaker.acquire(key)
+        breaker.release(key, failed=False)
+        assert breaker.state(key) == 'closed'
+        assert breaker.state(('127.0.0.1:8500', 'health')) == 'closed'
+
+        assert [t[2] for t in transitions] == [
+            'open', 'half-open', 'open', 'half-open', 'closed']
+
+    def test_abandoned_trial(self):
+        breaker = consul.base.CircuitBreaker(
+            failure_threshold=1, reset_timeout=0)
+        key = ('127.0.0.1:8500', 'kv')
+        breaker.acquire(key)
+        breaker.release(key, failed=True)
+        breaker.acquire(key)
+        breaker.release(key, failed=None)
+        assert breaker.state(key) == 'half-open'
+        breaker.acquire(key)
+
+
+class TestWatch(object):
+
+    def test_request(self):
+        calls = []
+        watch = consul.base.Watch(
+            lambda *args, **kwargs: calls.append((args, kwargs)),
+            'foo', recurse=True, wait='10s')
+        watch.request()
+        watch.update(('5', 'a'))
+        watch.request()
+        assert calls[0][0] == ('foo',)
+        assert calls[0][1]['index'] is None
+        assert calls[0][1]['recurse'] is True
+        assert calls[1][1]['index'] == '5'
+        assert 9000 <= int(calls[1][1]['wait'][:-2]) <= 10000
+
+    def test_seconds(self):
+        seconds = consul.base.Watch.seconds
+        assert seconds('150ms') == 0.15
+        assert seconds('10s') == 10
+        assert seconds('5m') == 300
+        assert seconds(2) == 2
+
+    def test_update(self):
+        watch = consul.base.Watch(None)
+        assert watch.update(('5', 'a'))
+        assert not watch.update(('5', 'a'))
+        assert not watch.update(('6', 'a'))
+        assert watch.update(('7', 'b'))
+        assert watch.index == 7
+        # the index went backwards
+        assert not watch.update(('3', 'b'))
+        assert watch.index == 0
+        assert watch.update(('0', 'c'))
+        assert watch.index == 1
+
+    def test_unchanged(self):
+        watch = consul.base.Watch(None)
+        watch.hashed = True
+        assert watch.update(('5', 'a'))
+        assert not watch.update(
+            (consul.base.Index('5', 'abc'), consul.base.UNCHANGED))
+        assert (watch.index, watch.digest, watch.data) == (5, 'abc', 'a')
+        calls = []
+        watch.call = lambda **kwargs: calls.append(kwargs['index'])
+        watch.request()
+        assert calls[0] == '5' and calls[0].digest == 'abc'
+        assert calls[0].hashed
+
+    def test_failed(self):
+        watch = consul.base.Watch(None)
+        watch.backoff = 1
+        watch.max_backoff = 3
+        assert 0.5 <= watch.failed(consul.base.Timeout()) <= 1
+        assert 1 <= watch.failed(consul.base.ConsulException()) <= 2
+        assert 1.5 <= watch.failed(consul.base.Timeout()) <= 3
+        assert watch.failed(consul.base.ACLPermissionDenied()) is None
+        assert watch.failed(ValueError()) is None
+        watch.update(('1', None))
+        assert watch.failures == 0
+
+
+class TestCoalescer(object):
+
+    def test_key(self):
+        key = consul.base.Coalescer.key
+        assert key('/v1/kv/foo', [('dc', 'a'), ('recurse', 1)]) == \
+            key('/v1/kv/foo', {'recurse': '1', 'dc': 'a'})
+        assert key('/v1/kv/foo') != key('/v1/kv/foo', [('dc', 'a')])
+        assert key('/v1/kv/foo', headers={'X-Consul-Token': 'a'}) != \
+            key('/v1/kv/foo', headers={'X-Consul-Token': 'b'})
+
+    def test_join(self):
+        coalescer = consul.base.Coalescer()
+        flight, leader = coalescer.join('k', object)
+        assert leader
+        assert coalescer.join('k', object) == (flight, False)
+        coalescer.land('k')
+        assert coalescer.join('k', object)[0] is not flight
+        assert (coalescer.calls, coalescer.coalesced) == (3, 1)
+
+
+class TestResponseCache(object):
+
+    def response(self, index, content=b'[]'):
+        return consul.base.Response(
+            200, {'X-Consul-Index': str(index)}, content=content)
+
+    def test_key(self):
+        cache = consul.base.ResponseCache(ttls={'/v1/kv/': 1})
+        assert cache.ttl('/v1/catalog/datacenters') == 60
+        assert cache.key('/v1/kv/foo', [('dc', 'a')])
+        assert cache.key('/v1/health/service/api') is None
+        assert cache.key('/v1/kv/foo', [('index', 5)]) is None
+        assert cache.key('/v1/query')
+        assert cache.key('/v1/query/geo')
+        assert cache.key('/v1/query/geo/execute') is None
+        assert cache.key('/v1/query/geo/explain') is None
+        assert cache.key('/v1/kv/foo', [('consistent', 1)]) is None
+        assert cache.key('/v1/kv/foo', headers={'X-Consul-Token': 'a'}) != \
+            cache.key('/v1/kv/foo', headers={'X-Consul-Token': 'b'})
+
+    def test_ttl(self):
+        now = [0]
+        cache = consul.base.ResponseCache(stale_while_revalidate=5,
+                                          clock=lambda: now[0])
+        path = '/v1/catalog/services'
+        key = cache.key(path)
+        assert cache.get(key) == (None, False)
+        response = self.response(1)
+        cache.put(key, path, response)
+        assert cache.get(key) == (response, False)
+        now[0] = 6
+        # stale, only the first caller refreshes it
+        assert cache.get(key) == (response, True)
+        assert cache.get(key) == (response, False)
+        now[0] = 11
+        assert cache.get(key) == (None, False)
+        assert (cache.hits, cache.stale, cache.misses) == (1, 2, 2)
+
+    def test_lru(self):
+        cache = consul.base.ResponseCache(ttls={'/v1/kv/': 10},
+                                          max_entries=2, max_bytes=10)
+        for key in 'abc':
+            path = '/v1/kv/' + key
+            cache.put(cache.key(path), path, self.response(1, b'1234'))
+        assert len(cache) == 2
+        assert cache.get(cache.key('/v1/kv/a'))[0] is None
+        cache.get(cache.key('/v1/kv/b'))
+        cache.put(cache.key('/v1/kv/d'), '/v1/kv/d',
+                  self.response(1, b'123456'))
+        assert cache.get(cache.key('/v1/kv/b'))[0] is not None
+        assert cache.get(cache.key('/v1/kv/c'))[0] is None
+        assert cache.size == 10
+        assert cache.evictions == 2
+
+    def test_invalidate(self):
+        cache = consul.base.ResponseCache(ttls={'/v1/kv/': 10})
+        path = '/v1/kv/foo'
+        stored = cache.key(path, [('dc', 'a')])
+        cache.put(stored, path, self.response(5))
+        cache.put(None, path, self.response(5))
+        assert len(cache) == 1
+        # a blocking query saw a newer index
+        cache.put(None, path, self.response(6))
+        assert len(cache) == 0
+        cache.put(stored, path, self.response(6))
+        cache.put(cache.key('/v1/kv/bar'), '/v1/kv/bar', self.response(6))
+        cache.invalidate('/v1/kv/baz')
+        assert len(cache) == 0
+        assert cache.invalidations == 3
+
+
+class TestDiffer(object):
+
+    def instance(self, node, service, index=1, check=1):
+        return {'Node': {'Node': node, 'ModifyIndex': 1},
+                'Service': {'ID': service, 'ModifyIndex': index},
+                'Checks': [{'CheckID': 'serfHealth', 'ModifyIndex': check}]}
+
+    def test_health(self):
+        diff = consul.base.HealthDiff()
+        a, b = self.instance('n1', 'api'), self.instance('n2', 'api')
+        changes = diff.update([a, b])
+        assert set(changes.added) == {('n1', 'api'), ('n2', 'api')}
+        assert not changes.removed and not changes.changed
+        assert not diff.update([a, b])
+        assert not diff.update(consul.base.UNCHANGED)
+
+        c = self.instance('n2', 'api', check=2)
+        d = self.instance('n3', 'api')
+        changes = diff.update([c, d])
+        assert changes.added == {('n3', 'api'): d}
+        assert changes.removed == {('n1', 'api'): a}
+        assert changes.changed == {('n2', 'api'): c}
+
+    def test_catalog_service(self):
+        diff = consul.base.CatalogServiceDiff()
+        entry = {'Node': 'n1', 'ServiceID': 'api', 'ModifyIndex': 1}
+        assert diff.update([entry]).added == {('n1', 'api'): entry}
+        entry = dict(entry, ModifyIndex=2)
+        assert diff.update([entry]).changed == {('n1', 'api'): entry}
+
+    def test_catalog_services(self):
+        diff = consul.base.CatalogServicesDiff()
+        diff.update({'api': ['a', 'b'], 'db': []})
+        changes = diff.update({'api': ['b', 'a', 'c'], 'web': []})
+        assert changes == ({'web': []}, {'db': []}, {'api': ['b', 'a', 'c']})
+
+    def test_handler(self):
+        calls = []
+        handle = consul.base.CatalogServicesDiff().handler(
+            lambda *args: calls.append(args))
+        handle('1', {'api': []})
+        handle('2', {'api': []})
+        assert calls == [('1', ({'api': []}, {}, {}))]
+
+
+class TestDiscovery(object):
+
+    def instance(self, node, service='api', tags=(), weight=1, index=1):
+        return {'Node': {'Node': node, 'Address': '10.0.0.1'},
+                'Service': {'ID': service, 'Port': 80, 'Tags': list(tags),
+                            'Weights': {'Passing': weight, 'Warning': 1},
+                            'ModifyIndex': index}}
+
+    def test_pick(self):
+        discovery = consul.base.Discovery()
+        pytest.raises(consul.NotFound, discovery.pick, 'api')
+        discovery.update('api', [self.instance('n1', tags=['v1']),
+                                 self.instance('n2', tags=['v2'])])
+        picks = [discovery.pick('api').node for _ in range(4)]
+        assert picks == ['n1', 'n2', 'n1', 'n2']
+        assert discovery.pick('api', tag='v2').node == 'n2'
+        assert discovery.pick('api').address == '10.0.0.1'
+        pytest.raises(consul.NotFound, discovery.pick, 'api', tag='v3')
+
+        discovery.update('api', [self.instance('n3')])
+        assert discovery.pick('api').node == 'n3'
+        discovery.update('api', consul.base.UNCHANGED)
+        assert discovery.pick('api').node == 'n3'
+        discovery.forget('api')
+        pytest.raises(consul.NotFound, discovery.pick, 'api')
+
+    def test_inflight(self):
+        discovery = consul.base.Discovery('least_inflight')
+        discovery.update('api', [self.instance('n1'), self.instance('n2')])
+        busy = discovery.acquire('api')
+        for _ in range(10):
+            assert discovery.pick('api') is not busy
+        # instances keep their counts across refreshes
+        discovery.update('api', [self.instance('n1', index=2),
+                                 self.instance('n2', index=2)])
+        assert busy.inflight == 1
+        discovery.release(busy)
+        assert busy.inflight == 0
+
+    def test_weighted(self):
+        discovery = consul.base.Discovery('weighted')
+        discovery.update('api', [self.instance('n1', weight=3),
+                                 self.instance('n2', weight=0),
+                                 self.instance('n3', weight=1)])
+        picks = collections.Counter(
+            discovery.pick('api').node for _ in range(2000))
+        assert 'n2' not in picks
+        assert 2 < picks['n1'] / float(picks['n3']) < 4.5
+
+    def test_strategy(self):
+        class First(object):
+            def choose(self, view):
+                return view.instances[0]
+
+        discovery = consul.base.Discovery(First())
+        discovery.update('api', [self.instance('n2'), self.instance('n1')])
+        assert discovery.pick('api').node == 'n1'
+        discovery = consul.base.Discovery('random')
+        discovery.update('api', [self.instance('n1')])
+        assert discovery.pick('api').node == 'n1'
+
+
+class TestRTTEstimator(object):
+
+    def coord(self, node, vec, height=0.0, adjustment=0.0, segment=''):
+        return {'Node': node, 'Segment': segment, 'Coord': {
+            'Vec': vec, 'Height': height, 'Adjustment': adjustment,
+            'Error': 0.5}}
+
+    def nodes(self):
+        return [self.coord('n1', [0.0, 0.0]),
+                self.coord('n2', [0.003, 0.004], height=0.001),
+                self.coord('n3', [0.0, 0.001], adjustment=-0.0005),
+                self.coord('n3', [1.0, 1.0], segment='alpha')]
+
+    def check(self, rtt):
+        assert rtt.rtt('n1', 'n2') == pytest.approx(0.006)
+        assert rtt.rtt('n1', 'n3') == pytest.approx(0.0005)
+        assert rtt.rtt('n1', 'n4') is None
+        assert [n for n, _ in rtt.nearest('n1')] == ['n3', 'n2']
+        assert rtt.nearest('n2', n=1)[0][0] == 'n3'
+        assert rtt.nearest('n4') == []
+        names, matrix = rtt.matrix()
+        assert names == ['n1', 'n2', 'n3']
+        for i, a in enumerate(names):
+            for j, b in enumerate(names):
+                assert matrix[i][j] == pytest.approx(rtt.rtt(a, b))
+
+        health = [{'Node': {'Node': n}} for n in ('n4', 'n2', 'n3')]
+        assert [e['Node']['Node'] for e in rtt.sort('n1', health)] == [
+            'n3', 'n2', 'n4']
+        catalog = [{'Node': n} for n in ('n2', 'n1')]
+        assert rtt.sort('n1', catalog) == [{'Node': 'n1'}, {'Node': 'n2'}]
+
+    def test_python(self):
+        rtt = consul.base.RTTEstimator(self.nodes(), use_numpy=False)
+        self.check(rtt)
+        rtt.update(consul.base.UNCHANGED)
+        assert rtt.rtt('n1', 'n2') == pytest.approx(0.006)
+
+    def test_numpy(self):
+        pytest.importorskip('numpy')
+        rtt = consul.base.RTTEstimator(self.nodes(), use_numpy=True)
+        self.check(rtt)
+
+    def test_datacenters(self):
+        rtt = consul.base.RTTEstimator(datacenters=[
+            {'Datacenter': 'dc1', 'Coordinates': [
+                self.coord('s1', [0.0, 0.0]), self.coord('s2', [0.0, 0.0])]},
+            {'Datacenter': 'dc2', 'Coordinates': [
+                self.coord('s3', [0.03, 0.04]),
+                self.coord('s4', [0.06, 0.08])]},
+            {'Datacenter': 'dc3', 'Coordinates': [
+                self.coord('s5', [0.0, 0.02])]},
+            {'Datacenter': 'dc4', 'Coordinates': []}], use_numpy=False)
+        assert rtt.datacenter_rtt('dc1', 'dc2') == pytest.approx(0.075)
+        assert rtt.datacenter_rtt('dc1', 'dc4') is None
+        assert rtt.nearest_datacenters('dc1') == [
+            ('dc1', 0.0), ('dc3', pytest.approx(0.02)),
+            ('dc2', pytest.approx(0.075)), ('dc4', None)]
+
+
+class TestResolver(object):
+
+    def test_rank(self):
+        now = [0]
+        resolver = consul.base.Resolver(
+            consul.Consul(), refresh=60, clock=lambda: now[0])
+        assert resolver.origin is None and not resolver.stale()
+        coordinates = [
+            {'Datacenter': dc, 'Coordinates': [{'Node': 's', 'Coord': {
+                'Vec': vec, 'Height': 0, 'Adjustment': 0}}]}
+            for dc, vec in (('dc1', [0, 0]), ('dc2', [0.05, 0]),
+                            ('dc3', [0.01, 0]), ('gone', [0.001, 0]))]
+        ranking = resolver.rank(
+            'dc1', ['dc1', 'dc2', 'dc3', 'dc0'], coordinates)
+        assert ranking == ['dc1', 'dc3', 'dc2', 'dc0']
+        assert resolver.origin == 'dc1'
+        assert not resolver.stale()
+        now[0] = 60
+        assert resolver.stale()
+        resolver.refreshing = True
+        assert not resolver.stale()
+
+
+class TestFanOut(object):
+
+    def test_collect(self):
+        error = consul.Timeout()
+        fanout = consul.base.FanOut.collect([
+            ('dc2', ('1', [1, 2]), None),
+            ('dc1', ('3', None), None),
+            ('dc3', None, error),
+            ('dc4', {'a': 1}, None)])
+        assert list(fanout.results) == ['dc2', 'dc1', 'dc4']
+        assert fanout.errors == {'dc3': error}
+        assert not fanout.complete
+        assert fanout.merged() == [('dc2', 1), ('dc2', 2), ('dc4', {'a': 1})]
+        assert consul.base.FanOut.collect([('dc1', 1, None)]).complete
+
+
+class TestBulk(object):
+
+    class HTTPClient(HTTPClient):
+        def __init__(self, *args, **kwargs):
+            self.requests = []
+
+        def put(self, callback, path, params=None, data='', headers=None):
+            ops = json.loads(data)
+            self.requests.append(Request('put', path, params, ops, headers))
+            errors = [{'OpIndex': i, 'What': 'denied'}
+                      for i, op in enumerate(ops)
+                      if op['KV']['Key'].startswith('bad')]
+            body = {'Errors': errors} if errors else {'Results': []}
+            return callback(Response(409 if errors else 200, {},
+                                     content=json.dumps(body).encode()))
+
+    class Consul(Consul):
+        def http_connect(self, *args, **kwargs):
+            return TestBulk.HTTPClient()
+
+    def test_batches(self):
+        ops = [(str(i), {'KV': {'Verb': 'delete', 'Key': str(i)}})
+               for i in range(130)]
+        batches, oversize = consul.base.txn_batches(ops)
+        assert [len(keys) for keys, _ in batches] == [64, 64, 2]
+        assert batches[2] == (['128', '129'], [op for _, op in ops[128:]])
+
+        value = {'KV': {'Verb': 'set', 'Key': 'k', 'Value': 'x' * 100}}
+        size = len(json.dumps(value)) + 2
+        batches, oversize = consul.base.txn_batches(
+            [('a', value), ('b', value), ('c', value),
+             ('big', {'KV': {'Value': 'x' * 1000}})], max_bytes=2 * size + 2)
+        assert [keys for keys, _ in batches] == [['a', 'b'], ['c']]
+        assert oversize == ['big']
+
+    def test_put_many(self):
+        c = TestBulk.Consul(token='t', dc='dc2')
+        items = [('k%d' % i, 'v%d' % i) for i in range(70)]
+        items.insert(3, ('bad', b'\xff'))
+        items.append(('empty', None))
+        result = c.kv.put_many(items, flags=4)
+        requests = c.http.requests
+        assert len(requests) == 2
+        assert requests[0].path == '/v1/txn'
+        assert requests[0].params == [('dc', 'dc2')]
+        assert requests[0].headers == {'X-Consul-Token': 't'}
+        assert requests[0].data[0] == {'KV': {
+            'Verb': 'set', 'Key': 'k0', 'Value': 'djA=', 'Flags': 4}}
+        assert requests[0].data[3]['KV']['Value'] == '/w=='
+        assert 'Value' not in requests[1].data[-1]['KV']
+
+        assert result.errors == {'bad': 'denied'}
+        assert len(result.rolled_back) == 63
+        assert result.applied == ['k%d' % i for i in range(63, 70)] + [
+            'empty']
+        assert not result.ok
+
+    def test_delete_many(self):
+        c = TestBulk.Consul()
+        result = c.kv.delete_many({'a', 'b'}, recurse=True)
+        assert result.ok and sorted(result.applied) == ['a', 'b']
+        assert set(op['KV']['Verb'] for op in c.http.requests[0].data) == {
+            'delete-tree'}
+
+    def test_collect(self):
+        error = consul.ConsulException()
+        result = consul.base.BulkResult.collect(
+            [(['a'], []), (['b'], [])], [(True, None), (None, error)],
+            oversize=['c'])
+        assert result.applied == ['a']
+        assert result.errors == {
+            'c': 'operation larger than a transaction', 'b': error}
+
+
+class TestSubscriptions(object):
+
+    def test_key(self):
+        c = consul.Consul(token='t1', dc='dc1')
+        key = consul.base.Subscriptions.key
+        a = key(c.kv.get, ('foo',), {'recurse': True, 'wait': '10s'})
+        b = key(c.kv.get, ('foo',), {'recurse': True, 'token': 't1'})
+        assert a == b
+        assert a != key(c.kv.get, ('foo',), {'recurse': True, 'dc': 'dc2'})
+        assert a != key(c.kv.get, ('bar',), {'recurse': True})
+        assert key(c.health.service, ('api',), {'node_meta': {'a': 'b'}})
+
+    def test_refcount(self):
+        c = consul.Consul()
+        subscriptions = consul.base.Subscriptions()
+        changes = []
+        one, first, last = subscriptions.subscribe(
+            lambda *args: changes.append(('one',) + args),
+            c.kv.get, ('foo',), {})
+        assert first and last is None
+        subscriptions.attach(one.key, 'watch')
+        subscriptions.publish(one.key, 1, 'a')
+        two, first, last = subscriptions.subscribe(
+            lambda *args: changes.append(('two',) + args),
+            c.kv.get, ('foo',), {})
+        assert not first and last == (1, 'a')
+        assert len(subscriptions) == 1
+        subscriptions.publish(one.key, 2, 'b')
+        assert changes == [('one', 1, 'a'), ('one', 2, 'b'), ('two', 2, 'b')]
+        assert subscriptions.unsubscribe(one) is None
+        assert subscriptions.unsubscribe(two) == 'watch'
+        assert len(subscriptions) == 0
+        assert subscriptions.publish(one.key, 3, 'c') == []
+
+    def test_fail(self):
+        c = consul.Consul()
+        subscriptions = consul.base.Subscriptions()
+        errors = []
+        one, first, last = subscriptions.subscribe(
+            lambda *args: None, c.kv.get, ('foo',), {}, errors.append)
+        two, first, last = subscriptions.subscribe(
+            lambda *args: None, c.kv.get, ('foo',), {})
+        subscriptions.attach(one.key, 'watch')
+        error = consul.ACLPermissionDenied()
+        subscriptions.fail(one.key, error)
+        assert errors == [error]
+        assert len(subscriptions) == 0
+        assert subscriptions.unsubscribe(two) is None
+        # the next subscriber starts another upstream watch
+        three, first, last = subscriptions.subscribe(
+            lambda *args: None, c.kv.get, ('foo',), {})
+        assert first and last is None
+        assert subscriptions.unsubscribe(one) is None
+        assert len(subscriptions) == 1
+
+
 class TestCB(object):
 
+    def test_json(self):
+        response = Response(200, {'X-Consul-Index': '5'},
+                            content=b'[{"Value": "YmFy"}]')
+        cb = CB.json(index=True, one=True, decode='Value')
+        assert cb(response) == ('5', {'Value': b'bar'})
+        assert response._body is None
+
+    def test_json_cache(self):
+        response = Response(200, {'X-Consul-Index': '5', 'X-Cache': 'HIT',
+                                  'Age': '12'}, content=b'[]')
+        assert CB.json(index=True, cache=True)(response) == \
+            ('5', [], consul.base.CacheInfo(True, 12))
+        response = Response(200, {}, content=b'[]')
+        assert CB.json(cache=True)(response) == \
+            ([], consul.base.CacheInfo(None, 0))
+
+    def test_json_unchanged(self):
+        Index = consul.base.Index
+        cb = CB.json(index=True, since=Index('5'))
+        # the body is not even parsed
+        response = Response(200, {'X-Consul-Index': '5'}, content=b'{')
+        assert cb(response) == ('5', consul.base.UNCHANGED)
+        response = Response(200, {'X-Consul-Index': '6'}, content=b'[]')
+        index, data = cb(response)
+        assert (index, data) == ('6', [])
+        assert isinstance(index, Index)
+        assert CB.json(index=True, since='6')(response) == ('6', [])
+
+        index, data = CB.json(index=True, since=Index(hashed=True))(response)
+        assert index.digest
+        cb = CB.json(index=True, since=index)
+        assert cb(response) == ('6', consul.base.UNCHANGED)
+        response = Response(200, {'X-Consul-Index': '6'}, content=b'[1]')
+        assert cb(response) == ('6', [1])
+        meta, data = CB.json(index=True, meta=True, since=index)(response)
+        assert meta.index == '6' and data == [1]
+
+    def test_binary(self):
+        response = Response(200, {}, content=b'\x00\xff')
+        assert CB.binary()(response) == b'\x00\xff'
+        assert response._body is None
+
     def test_status_200_passes(self):
         response = consul.base.Response(200, None, None, None)
         CB._status(response)
@@ -1,6 +1,9 @@
 import base64
+import collections
 import os
+import socket
 import struct
+import threading
 import time
 
 import pytest
@@ -20,6 +23,475 @@ class TestHTTPClient(object):
             '/v1/kv',
             params={'index': 1}) == 'http://127.0.0.1:8500/v1/kv?index=1'
 
+    def test_pool(self):
+        c = consul.Consul(pool_maxsize=32, pool_block=True, tcp_keepalive=30)
+        assert c.http.adapter._pool_maxsize == 32
+        assert c.http.adapter._pool_block is True
+        assert c.http.session.get_adapter('http://x') is c.http.adapter
+
+        sessions = []
+        t = threading.Thread(target=lambda: sessions.append(c.http.session))
+        t.start()
+        t.join()
+        assert sessions[0] is not c.http.session
+        assert sessions[0].get_adapter('http://x') is c.http.adapter
+        c.close()
+
+    def test_unix_socket(self, unix_agent):
+        c = consul.Consul(host=unix_agent, scheme='unix')
+        assert c.http.socket_path == unix_agent
+        assert c.agent.self() == {'path': '/v1/agent/self'}
+        assert c.agent.self() == {'path': '/v1/agent/self'}
+        c.close()
+
+    def test_unix_socket_env(self, unix_agent, monkeypatch):
+        monkeypatch.setenv('CONSUL_HTTP_ADDR', 'unix://' + unix_agent)
+        c = consul.Consul()
+        assert c.http.socket_path == unix_agent
+        assert c.http.base_uri == 'http://localhost'
+        assert c.agent.self() == {'path': '/v1/agent/self'}
+        c.close()
+
+    def test_endpoints_failover(self, tcp_agent):
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.bind(('127.0.0.1', 0))
+        dead = s.getsockname()[1]
+        s.close()
+
+        c = consul.Consul(endpoints=['127.0.0.1:%s' % dead,
+                                     '127.0.0.1:%s' % tcp_agent])
+        for _ in range(3):
+            assert c.agent.self() == {'path': '/v1/agent/self'}
+        down, up = c.http.endpoints.endpoints
+        assert down.ejected
+        assert not up.ejected
+        assert up.latency is not None
+        c.close()
+
+    def test_endpoints_probe(self, tcp_agent):
+        now = [0]
+        pool = consul.base.EndpointPool(['127.0.0.1:%s' % tcp_agent],
+                                        clock=lambda: now[0])
+        c = consul.Consul(endpoints=pool)
+        endpoint, = pool.endpoints
+        pool.failed(endpoint)
+        assert endpoint.ejected
+        now[0] = pool.eject_time
+        assert c.agent.self() == {'path': '/v1/agent/self'}
+        assert not endpoint.ejected
+        c.close()
+
+    def test_endpoints_probe_background(self, tcp_agent):
+        now = [0]
+        pool = consul.base.EndpointPool(['127.0.0.1:%s' % tcp_agent],
+                                        clock=lambda: now[0])
+        c = consul.Consul(endpoints=pool)
+        probed = threading.Event()
+
+        def probe(endpoint):
+            # an agent which never answers its probe
+            time.sleep(1)
+            probed.set()
+
+        c.http._probe = probe
+        pool.failed(pool.endpoints[0])
+        now[0] = pool.eject_time
+        start = time.time()
+        assert c.agent.self() == {'path': '/v1/agent/self'}
+        assert time.time() - start < 0.5
+        assert probed.wait(5)
+        c.close()
+
+    def test_hedge(self, tcp_agent, slow_tcp_agent):
+        c = consul.Consul(endpoints=['127.0.0.1:%s' % slow_tcp_agent,
+                                     '127.0.0.1:%s' % tcp_agent],
+                          hedge=consul.base.HedgePolicy(delay=0.05))
+        slow, fast = c.http.endpoints.endpoints
+        c.http.endpoints.responded(slow, 0.001)
+        c.http.endpoints.responded(fast, 0.01)
+
+        start = time.time()
+        index, data = c.health.service('foo', consistency='stale')
+        assert time.time() - start < 0.5
+        assert data == {'path': '/v1/health/service/foo?stale=1'}
+        assert len(c.http.hedge.samples) == 1
+        c.close()
+
+    def test_hedge_failed_status(self, flaky_tcp_agent, slow_tcp_agent):
+        c = consul.Consul(endpoints=['127.0.0.1:%s' % flaky_tcp_agent,
+                                     '127.0.0.1:%s' % slow_tcp_agent],
+                          hedge=consul.base.HedgePolicy(delay=5))
+        flaky, slow = c.http.endpoints.endpoints
+        c.http.endpoints.responded(flaky, 0.001)
+        c.http.endpoints.responded(slow, 0.01)
+
+        # the fast 503 does not win over the slow 200
+        index, data = c.health.service('foo', consistency='stale')
+        assert data == {'path': '/v1/health/service/foo?stale=1'}
+        executor = c.http.executor
+        c.health.service('foo', consistency='stale')
+        assert c.http.executor is executor
+        c.close()
+
+    def test_coalesce(self, slow_tcp_agent):
+        c = consul.Consul(port=slow_tcp_agent, coalesce=True,
+                          pool_maxsize=5)
+        results = []
+        threads = [threading.Thread(
+            target=lambda: results.append(c.catalog.nodes()))
+            for _ in range(5)]
+        start = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert time.time() - start < 1.9
+        assert results == [('1', {'path': '/v1/catalog/nodes'})] * 5
+        assert c.http.coalesce.calls == 5
+        assert c.http.coalesce.coalesced == 4
+        assert not c.http.coalesce.flights
+        c.close()
+
+    def test_coalesce_callbacks(self, slow_tcp_agent):
+        c = consul.Consul(port=slow_tcp_agent, coalesce=True)
+        results = {}
+        calls = {
+            'plain': lambda: c.catalog.nodes(),
+            'meta': lambda: c.catalog.nodes(meta=True),
+            'index': lambda: c.catalog.nodes(index='1'),
+            'since': lambda: c.catalog.nodes(index=consul.base.Index('1')),
+        }
+        threads = [threading.Thread(
+            target=lambda name=name: results.__setitem__(name, calls[name]()))
+            for name in calls]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert c.http.coalesce.coalesced == 2
+        assert results['plain'] == ('1', {'path': '/v1/catalog/nodes'})
+        meta, data = results['meta']
+        assert isinstance(meta, consul.base.QueryMeta)
+        assert data == {'path': '/v1/catalog/nodes'}
+        assert results['index'] == ('1', {'path': '/v1/catalog/nodes?index=1'})
+        assert results['since'][1] is consul.base.UNCHANGED
+        c.close()
+
+    def test_cache(self, tcp_agent):
+        c = consul.Consul(port=tcp_agent, cache=True)
+        assert c.catalog.datacenters() == {'path': '/v1/catalog/datacenters'}
+        assert c.catalog.datacenters() == {'path': '/v1/catalog/datacenters'}
+        assert (c.http.cache.hits, c.http.cache.misses) == (1, 1)
+        c.catalog.deregister('foo')
+        assert len(c.http.cache) == 0
+
+        cache = consul.base.ResponseCache(ttls={'/v1/catalog/nodes': 0.01},
+                                          stale_while_revalidate=10)
+        c = consul.Consul(port=tcp_agent, cache=cache)
+        c.catalog.nodes()
+        time.sleep(0.02)
+        assert c.catalog.nodes() == ('1', {'path': '/v1/catalog/nodes'})
+        assert cache.stale == 1
+        for _ in range(100):
+            if not cache.entries[next(iter(cache.entries))].refreshing:
+                break
+            time.sleep(0.01)
+        assert c.catalog.nodes() == ('1', {'path': '/v1/catalog/nodes'})
+        assert cache.hits == 1
+        c.close()
+
+    def test_agent_cache(self, tcp_agent):
+        c = consul.Consul(port=tcp_agent)
+        index, data, info = c.health.service('api', max_age=30)
+        assert data == {'path': '/v1/health/service/api?cached='}
+        assert info == consul.base.CacheInfo(True, 3)
+        c.close()
+
+    def test_query_meta(self, tcp_agent):
+        c = consul.Consul(port=tcp_agent)
+        meta, data = c.catalog.nodes(meta=True)
+        assert data == {'path': '/v1/catalog/nodes'}
+        assert meta.index == '1'
+        assert meta.last_contact_ms == 0
+        assert meta.known_leader is True
+        assert meta.request_time > 0
+        c.close()
+
+    def test_retry(self, flaky_tcp_agent):
+        c = consul.Consul(port=flaky_tcp_agent)
+        pytest.raises(consul.ConsulException, c.agent.self)
+        c.close()
+
+        c = consul.Consul(port=flaky_tcp_agent,
+                          retry=consul.base.RetryPolicy(backoff=0.001))
+        assert c.agent.self() == {'path': '/v1/agent/self'}
+        c.close()
+
+    def test_request_timeout(self):
+        http = consul.std.HTTPClient(timeout=2)
+        assert http.request_timeout({'dc': 'dc1'}) == 2
+        assert http.request_timeout([('index', 1)]) == 300 + 300 / 16. + 5
+        assert http.request_timeout({'index': 1, 'wait': '16s'}) == 22
+        http.timeout = (1, 3)
+        assert http.request_timeout({'index': 1, 'wait': '32s'}) == (1, 39)
+        assert consul.std.HTTPClient().request_timeout() is None
+
+    def test_breaker(self, flaky_tcp_agent):
+        now = [0]
+        breaker = consul.base.CircuitBreaker(
+            failure_threshold=2, reset_timeout=10, clock=lambda: now[0])
+        c = consul.Consul(port=flaky_tcp_agent, breaker=breaker)
+        for _ in range(2):
+            pytest.raises(consul.ConsulException, c.agent.self)
+        pytest.raises(consul.CircuitOpen, c.agent.self)
+        # other endpoint families are not affected
+        assert c.catalog.nodes()[1] == {'path': '/v1/catalog/nodes'}
+
+        now[0] = 10
+        assert c.agent.self() == {'path': '/v1/agent/self'}
+        assert breaker.state(('127.0.0.1:%s' % flaky_tcp_agent,
+                              'agent')) == 'closed'
+        c.close()
+
+    def test_watch(self):
+        results = [consul.Timeout(), ('1', 'a'), ('2', 'a'), ('3', 'b')]
+        calls = []
+
+        def call(key, index=None, wait=None):
+            calls.append(index)
+            result = results.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        c = consul.Consul()
+        watch = c.watch(call, 'foo')
+        watch.backoff = 0.001
+        assert next(watch) == ('1', 'a')
+        assert next(watch) == ('3', 'b')
+        assert calls == [None, None, '1', '2']
+
+    def test_watch_manager(self, tcp_agent):
+        c = consul.Consul(port=tcp_agent)
+        manager = consul.std.WatchManager(c, concurrency=2, workers=2)
+        changes = collections.defaultdict(list)
+        done = threading.Event()
+
+        def callback(name):
+            def callback(index, data):
+                changes[name].append(data['path'])
+                if len(changes) == 3:
+                    done.set()
+            return callback
+
+        manager.watch(callback('services'), 'catalog.services')
+        manager.watch(callback('nodes'), 'catalog.nodes')
+        watch = manager.watch(callback('health'), 'health.service', 'api',
+                              passing=True)
+        assert done.wait(5)
+        manager.unwatch(watch)
+        assert len(manager.manager.watches) == 2
+        manager.close()
+
+        assert changes['services'][0] == '/v1/catalog/services'
+        assert changes['nodes'][0] == '/v1/catalog/nodes'
+        assert changes['health'][0] == '/v1/health/service/api?passing=1'
+
+    def test_watch_manager_subscribe(self, tcp_agent):
+        c = consul.Consul(port=tcp_agent)
+        manager = consul.std.WatchManager(c, workers=2)
+        changes = collections.defaultdict(list)
+        done = threading.Event()
+
+        def callback(name):
+            def callback(index, data):
+                changes[name].append(data['path'])
+                if len(changes) == 2:
+                    done.set()
+            return callback
+
+        one = manager.subscribe(callback('one'), 'catalog.nodes')
+        two = manager.subscribe(callback('two'), 'catalog.nodes')
+        assert done.wait(5)
+        assert len(manager.manager.watches) == 1
+        manager.unsubscribe(one)
+        assert len(manager.manager.watches) == 1
+        manager.unsubscribe(two)
+        assert len(manager.manager.watches) == 0
+        manager.close()
+
+        assert changes['one'][0] == changes['two'][0] == '/v1/catalog/nodes'
+
+    def test_watch_manager_errback(self, tcp_agent):
+        c = consul.Consul(port=tcp_agent)
+        manager = consul.std.WatchManager(c, workers=2)
+        errors = []
+        done = threading.Event()
+
+        def errback(error):
+            errors.append(error)
+            done.set()
+
+        # the minimal agent has no kv entries to decode, which is not retried
+        subscription = manager.subscribe(
+            lambda *args: None, 'kv.get', 'foo', errback=errback)
+        assert done.wait(5)
+        assert isinstance(errors[0], AttributeError)
+        assert len(manager.manager.watches) == 0
+        manager.unsubscribe(subscription)
+        manager.close()
+
+    def test_discovery(self):
+        c = consul.Consul()
+        calls = []
+
+        def service(name, index=None, wait=None, passing=None):
+            calls.append((name, index, passing))
+            if index:
+                time.sleep(10)
+            node = {'Node': {'Node': 'n1', 'Address': '10.0.0.1'},
+                    'Service': {'ID': name, 'Port': 80, 'Tags': ['v1']}}
+            return '1', [node]
+
+        c.health.service = service
+        discovery = consul.std.Discovery(c)
+        instance = discovery.pick('api', tag='v1')
+        assert (instance.address, instance.port) == ('10.0.0.1', 80)
+        assert discovery.pick('api') is instance
+        assert calls[0] == ('api', None, True)
+        discovery.close()
+
+        c.health.service = lambda *args, **kwargs: time.sleep(10)
+        discovery = consul.std.Discovery(c, timeout=0.1)
+        pytest.raises(consul.Timeout, discovery.pick, 'db')
+
+        # concurrent first picks all wait for the instances
+        def slow(name, index=None, wait=None, passing=None):
+            if not index:
+                time.sleep(0.3)
+            return service(name, index, wait, passing)
+
+        c.health.service = slow
+        discovery = consul.std.Discovery(c)
+        picks = []
+        threads = [threading.Thread(
+            target=lambda: picks.append(discovery.pick('cache').port))
+            for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert picks == [80] * 4
+        discovery.close()
+
+        # a query stopping on an error is started again by the next pick
+        def denied(name, index=None, wait=None, passing=None):
+            c.health.service = service
+            raise consul.ACLPermissionDenied()
+
+        c.health.service = denied
+        discovery = consul.std.Discovery(c)
+        pytest.raises(consul.ACLPermissionDenied, discovery.pick, 'web')
+        assert 'web' not in discovery.watches
+        assert discovery.pick('web').port == 80
+        discovery.close()
+
+    def test_resolver(self):
+        c = consul.Consul()
+        c.agent.self = lambda: {'Config': {'Datacenter': 'dc1'}}
+        c.catalog.datacenters = lambda: ['dc1', 'dc2', 'dc3']
+        c.coordinate.datacenters = lambda: [
+            {'Datacenter': dc, 'Coordinates': [{'Node': 's', 'Coord': {
+                'Vec': vec, 'Height': 0, 'Adjustment': 0}}]}
+            for dc, vec in (('dc1', [0, 0]), ('dc2', [0.05, 0]),
+                            ('dc3', [0.01, 0]))]
+        instances = {'dc2': [{'Node': {'Node': 'n2'}}]}
+        calls = []
+
+        def service(name, passing=None, dc=None):
+            calls.append(dc)
+            if dc == 'dc3':
+                raise consul.Timeout()
+            return '1', instances.get(dc, [])
+
+        c.health.service = service
+        resolver = consul.std.Resolver(c)
+        assert resolver.resolve('api') == ('dc2', instances['dc2'])
+        assert calls == ['dc1', 'dc3', 'dc2']
+        assert resolver.ranking == ['dc1', 'dc3', 'dc2']
+
+        instances.clear()
+        assert resolver.resolve('api') == (None, [])
+        resolver.ranking = ['dc3']
+        pytest.raises(consul.Timeout, resolver.resolve, 'api')
+
+    def test_fanout(self, tcp_agent):
+        c = consul.Consul(port=tcp_agent)
+
+        def nodes(dc=None):
+            if dc == 'dc3':
+                raise consul.ACLPermissionDenied()
+            if dc == 'dc4':
+                time.sleep(5)
+            return c.catalog.nodes(dc=dc)
+
+        fanout = c.fanout(nodes,
+                          datacenters=['dc1', 'dc2', 'dc3', 'dc4'],
+                          timeout=1)
+        assert fanout.merged() == [
+            ('dc1', {'path': '/v1/catalog/nodes?dc=dc1'}),
+            ('dc2', {'path': '/v1/catalog/nodes?dc=dc2'})]
+        assert isinstance(fanout.errors['dc3'], consul.ACLPermissionDenied)
+        assert isinstance(fanout.errors['dc4'], consul.Timeout)
+        c.close()
+
+    def test_fanout_queued(self):
+        c = consul.Consul()
+
+        def nodes(dc=None):
+            time.sleep(5 if dc == 'dc1' else 0.3)
+            return dc
+
+        # each datacenter gets its timeout once its call starts, and dc1
+        # hands its place to the others when it times out
+        fanout = c.fanout(nodes, datacenters=['dc1', 'dc2', 'dc3', 'dc4'],
+                          timeout=0.5, workers=1)
+        assert list(fanout.results.items()) == [
+            ('dc2', 'dc2'), ('dc3', 'dc3'), ('dc4', 'dc4')]
+        assert isinstance(fanout.errors['dc1'], consul.Timeout)
+
+        running = []
+        most = []
+
+        def count(dc=None):
+            running.append(dc)
+            most.append(len(running))
+            time.sleep(0.05)
+            running.remove(dc)
+            return dc
+
+        datacenters = ['dc%d' % i for i in range(8)]
+        fanout = c.fanout(count, datacenters=datacenters, workers=2)
+        assert list(fanout.results) == datacenters
+        assert max(most) <= 2
+        c.close()
+
+    def test_put_many(self, tcp_agent):
+        c = consul.Consul(port=tcp_agent)
+        keys = ['bulk/%d' % i for i in range(150)]
+        result = c.kv.put_many(dict.fromkeys(keys, 'v'), concurrency=2)
+        assert result.ok and sorted(result.applied) == sorted(keys)
+        result = c.kv.delete_many(keys)
+        assert result.applied == keys
+        c.close()
+
+    def test_seed_endpoints(self, tcp_agent):
+        c = consul.Consul(port=tcp_agent)
+        assert c.status.seed_endpoints() == ['127.0.0.2:%s' % tcp_agent,
+                                             '127.0.0.3:%s' % tcp_agent]
+        assert len(c.http.endpoints.endpoints) == 3
+        c.close()
+
 
 class TestConsul(object):
     def test_kv(self, consul_port):
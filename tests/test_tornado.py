@@ -7,6 +7,7 @@ import time
 import pytest
 import six
 from tornado import gen
+from tornado import httpclient
 from tornado import ioloop
 
 import consul
@@ -401,3 +402,134 @@ class TestConsul(object):
             loop.stop()
 
         loop.run_sync(test_timeout)
+
+    def test_coalesce(self, loop, slow_tcp_agent):
+        @gen.coroutine
+        def main():
+            c = consul.tornado.Consul(port=slow_tcp_agent, coalesce=True)
+            results = yield [c.catalog.nodes() for _ in range(3)]
+            assert results == [('1', {'path': '/v1/catalog/nodes'})] * 3
+            assert c.http.coalesce.coalesced == 2
+
+        loop.run_sync(main)
+
+    def test_coalesce_callbacks(self, loop, slow_tcp_agent):
+        @gen.coroutine
+        def main():
+            c = consul.tornado.Consul(port=slow_tcp_agent, coalesce=True)
+            plain, (meta, data) = yield [c.catalog.nodes(),
+                                         c.catalog.nodes(meta=True)]
+            assert c.http.coalesce.coalesced == 1
+            assert plain == ('1', {'path': '/v1/catalog/nodes'})
+            assert isinstance(meta, consul.base.QueryMeta)
+
+        loop.run_sync(main)
+
+    def test_cache(self, loop, tcp_agent):
+        @gen.coroutine
+        def main():
+            c = consul.tornado.Consul(port=tcp_agent, cache=True)
+            for _ in range(2):
+                data = yield c.catalog.datacenters()
+                assert data == {'path': '/v1/catalog/datacenters'}
+            assert c.http.cache.hits == 1
+
+        loop.run_sync(main)
+
+    def test_watch(self, loop):
+        results = [consul.Timeout(), ('5', 'a'), ('6', 'a'), ('7', 'b'),
+                   ('3', 'b'), ('4', 'c'), consul.ACLPermissionDenied()]
+        calls = []
+
+        @gen.coroutine
+        def call(key, index=None, wait=None):
+            calls.append(index)
+            result = results.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            raise gen.Return(result)
+
+        @gen.coroutine
+        def main():
+            c = consul.tornado.Consul()
+            watch = c.watch(call, 'foo')
+            watch.backoff = 0.001
+            # the timeout is retried after a backoff
+            assert (yield watch.next()) == ('5', 'a')
+            assert watch.failures == 0
+            # the index advances past unchanged data
+            assert (yield watch.next()) == ('7', 'b')
+            # the index went backwards and is reset
+            assert (yield watch.next()) == ('4', 'c')
+            assert calls == [None, None, '5', '6', '7', '0']
+            with pytest.raises(consul.ACLPermissionDenied):
+                yield watch.next()
+
+        loop.run_sync(main)
+
+    def test_fanout(self, loop, tcp_agent):
+        @gen.coroutine
+        def main():
+            c = consul.tornado.Consul(port=tcp_agent)
+
+            @gen.coroutine
+            def nodes(dc=None):
+                if dc == 'dc3':
+                    raise consul.ACLPermissionDenied()
+                if dc == 'dc4':
+                    yield gen.sleep(5)
+                result = yield c.catalog.nodes(dc=dc)
+                raise gen.Return(result)
+
+            fanout = yield c.fanout(
+                nodes, datacenters=['dc1', 'dc2', 'dc3', 'dc4'],
+                timeout=0.5)
+            assert fanout.merged() == [
+                ('dc1', {'path': '/v1/catalog/nodes?dc=dc1'}),
+                ('dc2', {'path': '/v1/catalog/nodes?dc=dc2'})]
+            assert isinstance(fanout.errors['dc3'], consul.ACLPermissionDenied)
+            assert isinstance(fanout.errors['dc4'], consul.Timeout)
+
+        loop.run_sync(main)
+
+    def test_put_many(self, loop, tcp_agent):
+        @gen.coroutine
+        def main():
+            c = consul.tornado.Consul(port=tcp_agent)
+            keys = ['bulk/%d' % i for i in range(150)]
+            result = yield c.kv.put_many(
+                [(key, 'v') for key in keys], concurrency=2)
+            assert result.ok and result.applied == keys
+
+        loop.run_sync(main)
+
+    def test_blocking_timeout(self, loop, slow_tcp_agent):
+        @gen.coroutine
+        def main():
+            c = consul.tornado.Consul(port=slow_tcp_agent)
+            # a client timing out before the agent answers
+            c.http.client = httpclient.AsyncHTTPClient(
+                force_instance=True, defaults={'request_timeout': 0.5})
+            with pytest.raises(consul.Timeout):
+                yield c.catalog.nodes()
+            # blocking queries are given their wait and some
+            index, data = yield c.catalog.nodes(index=1, wait='1s')
+            assert data == {'path': '/v1/catalog/nodes?index=1&wait=1s'}
+            c.http.client.close()
+
+        loop.run_sync(main)
+
+    def test_retry(self, loop, flaky_tcp_agent):
+        @gen.coroutine
+        def main():
+            c = consul.tornado.Consul(port=flaky_tcp_agent)
+            with pytest.raises(consul.ConsulException):
+                yield c.agent.self()
+
+            c = consul.tornado.Consul(
+                port=flaky_tcp_agent,
+                retry=consul.base.RetryPolicy(backoff=0.001))
+            data = yield c.agent.self()
+            assert data == {'path': '/v1/agent/self'}
+
+        loop.run_sync(main)
@@ -324,6 +324,73 @@ class TestConsul(object):
         compat_string = "foo"
         assert compat_string == c.http.compat_string(compat_string)
 
+    @pytest_twisted.inlineCallbacks
+    def test_watch(self):
+        results = [consul.Timeout(), ('5', 'a'), ('6', 'a'), ('7', 'b'),
+                   ('3', 'b'), ('4', 'c'), consul.ACLPermissionDenied()]
+        calls = []
+
+        def call(key, index=None, wait=None):
+            calls.append(index)
+            result = results.pop(0)
+            if isinstance(result, Exception):
+                return defer.fail(result)
+            return defer.succeed(result)
+
+        c = consul.twisted.Consul()
+        watch = c.watch(call, 'foo')
+        watch.backoff = 0.001
+        # the timeout is retried after a backoff
+        assert (yield watch.next()) == ('5', 'a')
+        assert watch.failures == 0
+        # the index advances past unchanged data
+        assert (yield watch.next()) == ('7', 'b')
+        # the index went backwards and is reset
+        assert (yield watch.next()) == ('4', 'c')
+        assert calls == [None, None, '5', '6', '7', '0']
+        with pytest.raises(consul.ACLPermissionDenied):
+            yield watch.next()
+
+    @pytest_twisted.inlineCallbacks
+    def test_fanout(self, tcp_agent):
+        c = consul.twisted.Consul(port=tcp_agent)
+
+        def nodes(dc=None):
+            if dc == 'dc3':
+                raise ConsulException('denied')
+            if dc == 'dc4':
+                return defer.Deferred()
+            return c.catalog.nodes(dc=dc)
+
+        fanout = yield c.fanout(nodes,
+                                datacenters=['dc1', 'dc2', 'dc3', 'dc4'],
+                                timeout=0.5)
+        assert [(dc, 'dc=%s' % dc in data['path'])
+                for dc, data in fanout.merged()] == [
+            ('dc1', True), ('dc2', True)]
+        assert isinstance(fanout.errors['dc3'], ConsulException)
+        assert isinstance(fanout.errors['dc4'], consul.Timeout)
+
+    @pytest_twisted.inlineCallbacks
+    def test_put_many(self, tcp_agent):
+        c = consul.twisted.Consul(port=tcp_agent)
+        keys = ['bulk/%d' % i for i in range(150)]
+        result = yield c.kv.put_many(
+            [(key, 'v') for key in keys], concurrency=2)
+        assert result.ok and result.applied == keys
+
+    @pytest_twisted.inlineCallbacks
+    def test_retry(self, flaky_tcp_agent):
+        c = consul.twisted.Consul(port=flaky_tcp_agent)
+        with pytest.raises(ConsulException):
+            yield c.agent.self()
+
+        c = consul.twisted.Consul(
+            port=flaky_tcp_agent,
+            retry=consul.base.RetryPolicy(backoff=0.001))
+        data = yield c.agent.self()
+        assert data == {'path': '/v1/agent/self'}
+
     @pytest_twisted.inlineCallbacks
     def test_gen_exception(self, consul_port, local_server):
         c = consul.twisted.Consul(port=consul_port, verify=False)